@@ -1,14 +1,23 @@
 import streamlit as st
-from gtts import gTTS
-import pyttsx3
-import io
-import base64
-import hashlib
-import json
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
 
+from extraction import ExtractionError, estimate_characters, iter_segments, preview_text
+from history_store import get_history_store
+from incremental import incremental_task, plan
+from jobs import JobLimitReached, Overloaded, get_job_manager, synthesis_task
+import metrics
+from auth import RateLimited, get_authenticator
+from audio_formats import FORMATS, MIME_TYPES, SAMPLE_RATES, can_transcode, duration, extension, mime_type
+from backends import BackendUnavailable, backends, get_backend
+from synthesis import synthesizer, warm_up
+from usage_stats import get_usage_stats
+from user_store import get_user_store
+
+STYLESHEET = Path(__file__).parent / 'static' / 'style.css'
+
 # Page config
 st.set_page_config(
     page_title="VoiceCraft Pro",
@@ -17,153 +26,13 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS for modern glassmorphism design
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
-    
-    * {
-        font-family: 'Inter', sans-serif;
-    }
-    
-    .main {
-        background: linear-gradient(135deg, #f0f9ff 0%, #e0f2fe 100%);
-        min-height: 100vh;
-    }
-    
-    .glass-card {
-        background: rgba(255, 255, 255, 0.85);
-        backdrop-filter: blur(10px);
-        border-radius: 20px;
-        border: 2px solid #06b6d4;
-        padding: 2rem;
-        margin: 1rem 0;
-        box-shadow: 0 8px 32px rgba(6, 182, 212, 0.15);
-    }
-    
-    .auth-container {
-        max-width: 400px;
-        margin: 0 auto;
-        padding: 3rem;
-        background: rgba(255, 255, 255, 0.98);
-        border-radius: 24px;
-        border: 2px solid #06b6d4;
-        box-shadow: 0 20px 60px rgba(6, 182, 212, 0.25);
-    }
-    
-    .stButton>button {
-        background: linear-gradient(135deg, #0891b2 0%, #06b6d4 100%);
-        color: white;
-        border: none;
-        border-radius: 12px;
-        padding: 0.75rem 2rem;
-        font-weight: 700;
-        transition: all 0.3s ease;
-        width: 100%;
-        font-size: 1rem;
-    }
-    
-    .stButton>button:hover {
-        transform: translateY(-3px);
-        box-shadow: 0 10px 25px rgba(6, 182, 212, 0.6);
-    }
-    
-    .stTextInput>div>div>input, .stTextArea>div>div>textarea {
-        background: rgba(255, 255, 255, 0.95) !important;
-        color: #0f172a !important;
-        border: 2px solid #06b6d4 !important;
-        border-radius: 12px;
-        padding: 0.75rem !important;
-        transition: all 0.3s ease;
-        font-size: 1rem !important;
-    }
-    
-    .stTextInput>div>div>input::placeholder, .stTextArea>div>div>textarea::placeholder {
-        color: #64748b !important;
-    }
-    
-    .stTextInput>div>div>input:focus, .stTextArea>div>div>textarea:focus {
-        border-color: #0891b2 !important;
-        box-shadow: 0 0 0 4px rgba(6, 182, 212, 0.3) !important;
-    }
-    
-    .metric-card {
-        background: linear-gradient(135deg, rgba(6, 182, 212, 0.1), rgba(14, 165, 233, 0.1));
-        border-radius: 16px;
-        padding: 1.5rem;
-        text-align: center;
-        border: 2px solid rgba(6, 182, 212, 0.5);
-    }
-    
-    .history-item {
-        background: rgba(6, 182, 212, 0.08);
-        border-radius: 12px;
-        padding: 1rem;
-        margin: 0.5rem 0;
-        border-left: 4px solid #0891b2;
-    }
-    
-    h1, h2, h3, h4 {
-        color: #0f172a !important;
-        font-weight: 800 !important;
-    }
-    
-    p, div, label, span {
-        color: #1e293b !important;
-    }
-    
-    .welcome-text {
-        font-size: 2.5rem;
-        background: linear-gradient(120deg, #0891b2 0%, #06b6d4 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        font-weight: 800;
-    }
-    
-    .user-card {
-        background: linear-gradient(135deg, rgba(6, 182, 212, 0.15), rgba(14, 165, 233, 0.1));
-        border: 2px solid #06b6d4;
-        border-radius: 16px;
-        padding: 1.2rem;
-        text-align: center;
-        margin-bottom: 1rem;
-    }
-    
-    .user-card h3 {
-        color: #0891b2;
-        margin: 0;
-        font-size: 1.3rem;
-    }
-    
-    .user-card p {
-        color: #1e293b;
-        margin: 0;
-        font-size: 0.95rem;
-        font-weight: 600;
-    }
-    
-    .stSelectbox>div>div>select {
-        background-color: rgba(255, 255, 255, 0.95) !important;
-        color: #0f172a !important;
-        border: 2px solid #06b6d4 !important;
-    }
-    
-    .stRadio>div {
-        color: #0f172a !important;
-    }
-    
-    .stRadio label, .stCheckbox label {
-        color: #1e293b !important;
-        font-size: 1rem !important;
-        font-weight: 600 !important;
-    }
-    
-    .stTabs [data-baseweb="tab"] {
-        color: #1e293b !important;
-        font-weight: 600 !important;
-    }
-</style>
-""", unsafe_allow_html=True)
+# Custom CSS for modern glassmorphism design. With static serving on (see
+# .streamlit/config.toml) the browser fetches and caches static/style.css and
+# each rerun only sends the one-line @import; otherwise the file goes inline.
+if st.get_option('server.enableStaticServing'):
+    st.html('<style>@import url("app/static/style.css");</style>')
+else:
+    st.html(STYLESHEET)
 
 # Initialize session state
 if 'users' not in st.session_state:
@@ -175,7 +44,9 @@ if 'current_user' not in st.session_state:
 if 'user_data' not in st.session_state:
     st.session_state.user_data = None
 if 'audio_history' not in st.session_state:
-    st.session_state.audio_history = []
+    st.session_state.audio_history = None
+if 'history_open' not in st.session_state:
+    st.session_state.history_open = set()
 if 'page' not in st.session_state:
     st.session_state.page = 'login'
 
@@ -188,122 +59,234 @@ else:
 # User data file
 USER_DATA_FILE = 'users.json'
 
-def load_users():
-    if os.path.exists(USER_DATA_FILE):
-        with open(USER_DATA_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+# Long text is split into chunks, so this is only a sanity limit
+MAX_TEXT_CHARS = 1_000_000
+# Seconds before the streamed audio runs out that it is swapped for a longer one
+STREAM_SWITCH_MARGIN = 1.5
+
+LANGUAGES = {
+    'English (US)': 'en',
+    'English (UK)': 'en-uk',
+    'Spanish': 'es',
+    'French': 'fr',
+    'German': 'de',
+    'Italian': 'it',
+    'Portuguese': 'pt',
+    'Russian': 'ru',
+    'Japanese': 'ja',
+    'Korean': 'ko',
+    'Chinese': 'zh-cn',
+    'Hindi': 'hi',
+    'Arabic': 'ar'
+}
+VOICE_TYPES = ["Normal", "Angry", "Kind", "Exclamation", "Question", "Whisper"]
 
-def save_users(users):
-    with open(USER_DATA_FILE, 'w') as f:
-        json.dump(users, f)
+# Usernames allowed to see the Stats page
+ADMINS = {u.strip() for u in os.environ.get('VOICECRAFT_ADMINS', '').split(',') if u.strip()}
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+# No-op unless VOICECRAFT_METRICS=1; only the first rerun binds the port
+metrics.start_http_server()
+
+# Engines load and probe their voices in the background while the login
+# page renders; also once per process
+warm_up()
+
+def get_users():
+    # Existing users.json accounts are imported into the store on first use
+    return get_user_store(legacy_json=USER_DATA_FILE)
+
+def get_stats():
+    return get_usage_stats(get_users())
+
+def get_history(filters, cursor):
+    """
+    One page of compact metadata records (audio stays on disk until it is
+    played), the cursor of the next page and the user's usage, kept until
+    the page or the history changes.
+    """
+    key = (tuple(filters.items()), cursor)
+    cached = st.session_state.audio_history
+    if cached is None or cached['key'] != key:
+        store = get_history_store()
+        records, next_cursor = store.page(st.session_state.current_user, cursor, **filters)
+        usage = cached['usage'] if cached is not None else store.usage(st.session_state.current_user)
+        cached = st.session_state.audio_history = {'key': key, 'records': records, 'next': next_cursor,
+                                                   'usage': usage}
+    return cached
+
+def get_auth():
+    return get_authenticator(get_users())
+
+def client_ip():
+    # None when the app is opened on localhost
+    return st.context.ip_address
 
 def register_user(username, password, name):
-    users = load_users()
-    if username in users:
+    try:
+        created = get_auth().register(username, password, {
+            'name': name,
+            'created_at': datetime.now().strftime("%Y-%m-%d %H:%M"),
+            'total_conversions': 0
+        }, ip=client_ip())
+    except RateLimited as e:
+        return False, f"{e}."
+    if not created:
         return False, "Username already exists!"
-    
-    users[username] = {
-        'password': hash_password(password),
-        'name': name,
-        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M"),
-        'total_conversions': 0
-    }
-    save_users(users)
     return True, "Registration successful!"
 
 def login_user(username, password):
-    users = load_users()
-    if username not in users:
-        return False, "User not found!"
-    
-    if users[username]['password'] != hash_password(password):
-        return False, "Incorrect password!"
-    
-    return True, users[username]
-
-def text_to_speech(text, lang='en', slow=False):
     try:
-        tts = gTTS(text=text, lang=lang, slow=slow)
-        fp = io.BytesIO()
-        tts.write_to_fp(fp)
-        fp.seek(0)
-        return fp, None
-    except Exception as e:
-        return None, str(e)
-
-def text_to_speech_advanced(text, voice_type='normal', gender='female', emotion='neutral'):
+        user = get_auth().login(username, password, ip=client_ip())
+    except RateLimited as e:
+        return False, f"{e}."
+    # Same answer for unknown users and wrong passwords
+    if user is None:
+        return False, "Incorrect username or password!"
+    
+    return True, user
+
+def audio_download_button(load_audio, filename, fmt, label="⬇️ Download Audio", key=None):
+    # load_audio is only called when the button is clicked, and the bytes are
+    # then served over HTTP instead of riding along in every rerun
+    return st.download_button(label, data=load_audio, file_name=f"{filename}.{fmt}",
+                              mime=MIME_TYPES.get(fmt, 'application/octet-stream'),
+                              key=key, on_click="ignore", use_container_width=True)
+
+# Background jobs
+def submit_synthesis(state_key, source, synthesize, finish, engine, lang, generation=None, segment_key=None,
+                     characters=None, stream=False, **meta):
     """
-    Advanced TTS with voice and emotion options using pyttsx3
+    Queue a synthesis job for a string or a lazy stream of text segments and
+    remember its id in session state under state_key. With a generation
+    (see incremental.plan) only its pending segments are synthesized, and
+    segment_key(text) gives the backend and cache key of a segment's audio.
+    characters sizes a stream for the scheduler, and stream keeps the
+    finished parts for playback while it runs; returns whether the job
+    was queued.
     """
+    username = st.session_state.current_user
+    stats = get_stats()
+    
+    def on_done(job, audio, characters):
+        stats.record(username, engine, lang, characters, time.monotonic() - job.started)
+    
+    if isinstance(source, str):
+        meta['text'] = source
+        characters = len(source)
+    if generation is not None:
+        task = incremental_task(generation, synthesize, segment_key, on_done, finish)
+        meta.update(reused=generation.reused, segments=len(generation.segments))
+        characters = sum(len(generation.segments[i]) for i in generation.pending())
+    else:
+        task = synthesis_task(source, synthesize, on_done, finish)
+    # Short jobs are started first, so estimate how long this one will take
+    cost = (characters or 0) * get_backend(engine).speed()
     try:
-        engine = pyttsx3.init()
-        
-        # Get available voices
-        voices = engine.getProperty('voices')
-        
-        # Select voice based on gender
-        if gender == 'male':
-            # Usually the first voice is male, second is female (varies by system)
-            voice_id = voices[0].id if len(voices) > 0 else voices[0].id
-        else:
-            # Female voice
-            voice_id = voices[1].id if len(voices) > 1 else voices[0].id
-        
-        engine.setProperty('voice', voice_id)
-        
-        # Modify speech parameters based on emotion/voice type
-        rate = engine.getProperty('rate')  # Default rate
-        volume = engine.getProperty('volume')
-        
-        if voice_type == 'angry':
-            rate = 150  # Faster, more aggressive
-            volume = 1.0
-        elif voice_type == 'kind':
-            rate = 110  # Slower, gentler
-            volume = 0.9
-        elif voice_type == 'exclamation':
-            rate = 140  # Fast and excited
-            volume = 1.0
-        elif voice_type == 'question':
-            rate = 115  # Slightly slower for clarity
-            volume = 0.95
-        elif voice_type == 'whisper':
-            rate = 100
-            volume = 0.6
-        else:  # normal
-            rate = 125
-            volume = 0.95
-        
-        engine.setProperty('rate', rate)
-        engine.setProperty('volume', volume)
-        
-        # Save to bytes
-        fp = io.BytesIO()
-        engine.save_to_file(text, 'temp_audio.mp3')
-        engine.runAndWait()
-        
-        # Read the saved file
-        if os.path.exists('temp_audio.mp3'):
-            with open('temp_audio.mp3', 'rb') as f:
-                fp.write(f.read())
-            fp.seek(0)
-            os.remove('temp_audio.mp3')
-            return fp, None
-        else:
-            return None, "Could not generate audio"
-    except Exception as e:
-        return None, str(e)
+        st.session_state[state_key] = get_job_manager().submit(username, task, cost=cost, stream=stream, **meta)
+    except (JobLimitReached, Overloaded) as e:
+        st.warning(f"⏳ {e}")
+        return False
+    return True
+
+def stream_preview(state_key, job):
+    """
+    Play what a running job has finished so far. The player only switches to
+    the longer audio when the shorter one is about to run out, and resumes
+    where listening had got to, so refreshes don't restart playback.
+    """
+    now = time.monotonic()
+    shown = st.session_state.get(f"{state_key}_stream")
+    if shown is None or shown['job'] != job.id:
+        parts, audio = job.streamed, job.preview()
+        shown = {'job': job.id, 'parts': parts, 'audio': audio, 'length': duration(audio), 'offset': 0,
+                 'since': now}
+    elif job.streamed > shown['parts']:
+        elapsed = now - shown['since']
+        # Unknown lengths (no parser for the format) switch straight away
+        if shown['length'] is None or elapsed >= shown['length'] - STREAM_SWITCH_MARGIN:
+            # If the old audio ran out while waiting, carry on from its end
+            offset = int(min(elapsed, shown['length'] or elapsed))
+            # The only place the parts are stitched, at most once per refresh
+            parts, audio = job.streamed, job.preview()
+            shown = {'job': job.id, 'parts': parts, 'audio': audio, 'length': duration(audio), 'offset': offset,
+                     'since': now - offset}
+    st.session_state[f"{state_key}_stream"] = shown
+    st.audio(shown['audio'], format=mime_type(shown['audio']), autoplay=True, start_time=shown['offset'])
 
-def get_audio_download_link(audio_buffer, filename):
-    audio_buffer.seek(0)
-    b64 = base64.b64encode(audio_buffer.read()).decode()
-    href = f'<a href="data:audio/mp3;base64,{b64}" download="{filename}.mp3" style="text-decoration:none;">'
-    href += f'<button style="background:linear-gradient(135deg, #11998e 0%, #38ef7d 100%);color:white;padding:10px 20px;border:none;border-radius:8px;cursor:pointer;width:100%;">⬇️ Download Audio</button></a>'
-    return href
+@st.fragment(run_every=1.0)
+def running_job_panel(state_key, stream_playback):
+    jobs = get_job_manager()
+    job = jobs.get(st.session_state.get(state_key))
+    if job is None or not job.active:
+        # Let the whole page render the finished result
+        st.rerun()
+    
+    if job.status == 'queued':
+        label = "⏳ Waiting for a free worker..."
+    elif job.total is None:
+        label = f"🎵 Generating audio... {job.done} parts so far"
+    else:
+        label = f"🎵 Generating audio... {job.done}/{job.total} parts"
+    st.progress(job.fraction, text=label)
+    # Start listening while the rest is still being synthesized
+    if stream_playback and job.streamed and job.total != 1:
+        stream_preview(state_key, job)
+    if st.button("⏹️ Cancel", key=f"cancel_{job.id}"):
+        jobs.cancel(job.id)
+        st.rerun()
+
+def job_panel(state_key, stream_playback=False, can_save=False):
+    job = get_job_manager().get(st.session_state.get(state_key))
+    if job is None:
+        return
+    if job.active:
+        running_job_panel(state_key, stream_playback)
+        return
+    
+    if job.status == 'cancelled':
+        st.info("Conversion cancelled.")
+        return
+    if job.status == 'failed':
+        st.error(f"❌ Error: {job.error}")
+        return
+    
+    st.success("✅ Audio generated successfully!")
+    total_time = job.finished - job.started
+    first_audio = job.first_audio_at if job.first_audio_at is not None else total_time
+    caption = (f"⏱️ First audio in {first_audio:.2f}s · complete in {total_time:.2f}s "
+               f"· queued {job.started - job.submitted:.2f}s")
+    if job.meta.get('reused'):
+        caption += f" · reused {job.meta['reused']}/{job.meta['segments']} sentences"
+    st.caption(caption)
+    
+    # Display audio
+    st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+    st.audio(job.result, format=mime_type(job.result))
+    
+    # Download and save options
+    col_dl, col_save = st.columns(2)
+    
+    with col_dl:
+        audio_download_button(lambda: job.result, job.meta['filename'], extension(job.result),
+                              key=f"dl_{job.id}")
+    
+    with col_save:
+        if can_save and st.button("💾 Save to History", key=f"save_{job.id}"):
+            text = job.meta['text']
+            get_history_store().add(
+                st.session_state.current_user,
+                job.result,
+                text=text[:100] + "..." if len(text) > 100 else text,
+                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M"),
+                language=job.meta['language'],
+                voice_type=job.meta['voice_type'],
+                gender=job.meta['gender'],
+                source=text
+            )
+            st.session_state.audio_history = None
+            st.success("Saved!")
+    
+    st.markdown('</div>', unsafe_allow_html=True)
 
 # Authentication Pages
 def login_page():
@@ -372,10 +355,13 @@ def main_app():
         st.markdown("---")
         
         # Stats
+        total_conversions = get_stats().conversions(
+            st.session_state.current_user, user_data.get('total_conversions', 0)
+        )
         st.markdown("### 📊 Your Stats")
         st.markdown(f"""
         <div class="metric-card">
-            <h4 style="color:#0891b2;margin:0;font-size:2rem;">{user_data.get('total_conversions', 0)}</h4>
+            <h4 style="color:#0891b2;margin:0;font-size:2rem;">{total_conversions}</h4>
             <p style="color:#1e293b;margin:0;font-weight:600;">Total Conversions</p>
         </div>
         """, unsafe_allow_html=True)
@@ -383,9 +369,10 @@ def main_app():
         st.markdown("---")
         
         # Navigation
-        page = st.radio("Navigate", 
-                       ["🎙️ Text to Speech", "📁 File Upload", "📜 History", "⚙️ Settings"],
-                       label_visibility="collapsed")
+        pages = ["🎙️ Text to Speech", "📁 File Upload", "📜 History", "⚙️ Settings"]
+        if st.session_state.current_user in ADMINS:
+            pages.append("📈 Stats")
+        page = st.radio("Navigate", pages, label_visibility="collapsed")
         
         st.markdown("---")
         
@@ -393,6 +380,9 @@ def main_app():
             st.session_state.logged_in = False
             st.session_state.current_user = None
             st.session_state.user_data = None
+            st.session_state.audio_history = None
+            st.session_state.history_open = set()
+            st.session_state.history_filter_key = None
             st.rerun()
     
     # Main Content Area
@@ -406,6 +396,8 @@ def main_app():
         history_page()
     elif "Settings" in page:
         settings_page()
+    elif "Stats" in page:
+        stats_page()
 
 def tts_page():
     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
@@ -442,7 +434,7 @@ def tts_page():
         # Voice Type Selection
         voice_type = st.selectbox(
             "Voice Type",
-            ["Normal", "Angry", "Kind", "Exclamation", "Question", "Whisper"],
+            VOICE_TYPES,
             help="Choose the emotion/style of the voice"
         )
         
@@ -456,30 +448,38 @@ def tts_page():
         
         st.markdown("---")
         
-        languages = {
-            'English (US)': 'en',
-            'English (UK)': 'en-uk',
-            'Spanish': 'es',
-            'French': 'fr',
-            'German': 'de',
-            'Italian': 'it',
-            'Portuguese': 'pt',
-            'Russian': 'ru',
-            'Japanese': 'ja',
-            'Korean': 'ko',
-            'Chinese': 'zh-cn',
-            'Hindi': 'hi',
-            'Arabic': 'ar'
-        }
-        
-        selected_lang = st.selectbox("Language", list(languages.keys()))
-        lang_code = languages[selected_lang]
+        selected_lang = st.selectbox("Language", list(LANGUAGES.keys()))
+        lang_code = LANGUAGES[selected_lang]
         
         speed = st.select_slider("Speed", options=["Slow", "Normal", "Fast"], value="Normal")
         slow_speed = speed == "Slow"
         
+        output_formats = {"Engine default": None} | {spec['label']: fmt for fmt, spec in FORMATS.items()}
+        output_label = st.selectbox("Output format", list(output_formats),
+                                    help="Opus gives the smallest files for the same quality")
+        output_fmt = output_formats[output_label]
+        bitrate = None
+        sample_rate = None
+        if output_fmt:
+            if FORMATS[output_fmt]['bitrates']:
+                bitrate = st.select_slider("Bitrate (kbit/s)", options=sorted(FORMATS[output_fmt]['bitrates']),
+                                           value=FORMATS[output_fmt]['bitrates'][0])
+            rates = {"Original": None} | {f"{r / 1000:g} kHz": r for r in SAMPLE_RATES}
+            sample_rate = rates[st.selectbox("Sample rate", list(rates))]
+            if not can_transcode():
+                st.caption("ffmpeg isn't installed here, so only WAV engine output can be converted.")
+        
+        engines = ["Auto (fastest)"] + [b.name for b in backends() if b.available() and b.supports(lang_code)]
+        engine_choice = st.selectbox("Engine", engines,
+                                     help="Auto picks the fastest engine that speaks the selected language")
+        
+        stream_playback = st.checkbox("⚡ Stream playback", value=True,
+                                      help="Start playing the first sentence while the rest is generated")
+        incremental = st.checkbox("♻️ Only regenerate edits", value=True,
+                                  help="Keep the audio of sentences that haven't changed since the last generation")
+        
         st.markdown("---")
-        st.info(f"Characters: {len(text_input)}/5000")
+        st.info(f"Characters: {len(text_input):,}/{MAX_TEXT_CHARS:,}")
     
     # Use sample text if available
     if 'sample_text' in st.session_state and st.session_state.sample_text:
@@ -491,58 +491,35 @@ def tts_page():
     if st.button("🎙️ Generate Speech", type="primary", use_container_width=True):
         if not text_input.strip():
             st.error("⚠️ Please enter some text!")
-        elif len(text_input) > 5000:
-            st.error("⚠️ Text too long! Max 5000 characters.")
+        elif len(text_input) > MAX_TEXT_CHARS:
+            st.error(f"⚠️ Text too long! Max {MAX_TEXT_CHARS:,} characters.")
         else:
-            with st.spinner("🎵 Generating audio... Please wait"):
-                # Map voice type to lowercase for function
-                voice_type_lower = voice_type.lower()
-                gender_lower = gender.lower()
-                
-                audio_buffer, error = text_to_speech_advanced(
-                    text_input, 
-                    voice_type=voice_type_lower, 
-                    gender=gender_lower
+            try:
+                synthesize, engine, finish = synthesizer(
+                    lang_code, backend=None if engine_choice.startswith("Auto") else engine_choice,
+                    slow=slow_speed, voice_type=voice_type.lower(), gender=gender.lower(),
+                    fmt=output_fmt, bitrate=bitrate, sample_rate=sample_rate
                 )
-                
-                if error:
-                    st.error(f"❌ Error: {error}")
-                else:
-                    st.success("✅ Audio generated successfully!")
-                    
-                    # Display audio
-                    st.markdown('<div class="glass-card">', unsafe_allow_html=True)
-                    st.audio(audio_buffer, format='audio/mp3')
-                    
-                    # Download and save options
-                    col_dl, col_save = st.columns(2)
-                    
-                    with col_dl:
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename = f"voicecraft_{timestamp}"
-                        st.markdown(get_audio_download_link(audio_buffer, filename), unsafe_allow_html=True)
-                    
-                    with col_save:
-                        if st.button("💾 Save to History"):
-                            audio_buffer.seek(0)
-                            st.session_state.audio_history.append({
-                                'text': text_input[:100] + "..." if len(text_input) > 100 else text_input,
-                                'audio': audio_buffer.getvalue(),
-                                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M"),
-                                'language': selected_lang,
-                                'voice_type': voice_type,
-                                'gender': gender
-                            })
-                            st.success("Saved!")
-                    
-                    st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    # Update user stats
-                    users = load_users()
-                    if st.session_state.current_user in users:
-                        users[st.session_state.current_user]['total_conversions'] = \
-                            users[st.session_state.current_user].get('total_conversions', 0) + 1
-                        save_users(users)
+            except BackendUnavailable as e:
+                st.error(f"⚠️ {e}")
+            else:
+                generation = None
+                if incremental:
+                    # What was asked for; the output format is applied
+                    # afterwards by finish. Which backend actually made each
+                    # sentence (Auto may fall back) is kept with its key
+                    settings = (engine_choice, lang_code, slow_speed, voice_type.lower(), gender.lower())
+                    generation = plan(text_input, settings, st.session_state.get('tts_generation'))
+                submitted = submit_synthesis(
+                    'tts_job', text_input, synthesize, finish, engine=engine, lang=lang_code,
+                    generation=generation, segment_key=synthesize.segment_key, language=selected_lang,
+                    voice_type=voice_type, gender=gender, stream=stream_playback,
+                    filename=f"voicecraft_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                )
+                if submitted and generation is not None:
+                    st.session_state.tts_generation = generation
+    
+    job_panel('tts_job', stream_playback=stream_playback, can_save=True)
 
 def file_upload_page():
     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
@@ -552,55 +529,133 @@ def file_upload_page():
     
     if uploaded_file is not None:
         try:
-            if uploaded_file.type == "text/plain":
-                text_content = uploaded_file.read().decode('utf-8')
-                st.success(f"✅ Loaded {len(text_content)} characters")
-                
-                st.markdown("### Preview:")
-                st.text_area("Content", text_content[:1000] + "..." if len(text_content) > 1000 else text_content, height=200)
-                
-                if st.button("🎙️ Convert to Speech"):
-                    if len(text_content) > 5000:
-                        st.warning("File too large! Using first 5000 characters.")
-                        text_content = text_content[:5000]
-                    
-                    with st.spinner("Generating audio..."):
-                        audio_buffer, error = text_to_speech(text_content, 'en')
-                        if audio_buffer:
-                            st.audio(audio_buffer, format='audio/mp3')
-                            st.download_button("⬇️ Download", audio_buffer, "file_audio.mp3", "audio/mp3")
-                        else:
-                            st.error(f"Error: {error}")
-            else:
-                st.warning("📄 Currently only .txt files are fully supported. PDF/DOCX support coming soon!")
+            # Read in place; both leave the file rewound
+            preview = preview_text(uploaded_file, uploaded_file.name)
+            st.success(f"✅ Loaded {uploaded_file.name} ({uploaded_file.size / 1024:,.0f} KB)")
+            
+            st.markdown("### Preview:")
+            st.text_area("Content", preview + "..." if len(preview) >= 1000 else preview, height=200)
+            
+            if st.button("🎙️ Convert to Speech"):
+                try:
+                    synthesize, engine, finish = synthesizer('en')
+                except BackendUnavailable as e:
+                    st.error(f"⚠️ {e}")
+                else:
+                    # The text is extracted lazily, so its length is estimated from a sample
+                    characters = min(estimate_characters(uploaded_file, uploaded_file.name), MAX_TEXT_CHARS)
+                    # The job reads this file object from here on: each rerun gets a fresh
+                    # UploadedFile over the same bytes, so nothing else moves its position
+                    submit_synthesis(
+                        'upload_job',
+                        iter_segments(uploaded_file, uploaded_file.name, max_chars=MAX_TEXT_CHARS),
+                        synthesize, finish, engine=engine, lang='en', filename='file_audio',
+                        characters=characters
+                    )
+            
+            job_panel('upload_job')
+        except ExtractionError as e:
+            st.warning(f"📄 {e}")
         except Exception as e:
             st.error(f"Error reading file: {e}")
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+def history_filters():
+    query = st.text_input("🔍 Search", placeholder="Words from the converted text", key="history_query")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        language = st.selectbox("Language", ["All"] + list(LANGUAGES), key="history_language")
+    with col2:
+        voice_type = st.selectbox("Voice Type", ["All"] + VOICE_TYPES, key="history_voice_type")
+    with col3:
+        gender = st.selectbox("Gender", ["All", "Female", "Male"], key="history_gender")
+    with col4:
+        dates = st.date_input("Dates", value=(), key="history_dates")
+    since = until = None
+    if dates:
+        start, end = dates if len(dates) == 2 else (dates[0], dates[0])
+        since = datetime(start.year, start.month, start.day).timestamp()
+        until = (datetime(end.year, end.month, end.day) + timedelta(days=1)).timestamp()
+    return {
+        'query': query.strip() or None,
+        'language': None if language == "All" else language,
+        'voice_type': None if voice_type == "All" else voice_type,
+        'gender': None if gender == "All" else gender,
+        'since': since,
+        'until': until,
+    }
+
 def history_page():
     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
     st.markdown("### 📜 Conversion History")
     
-    if not st.session_state.audio_history:
+    store = get_history_store()
+    filters = history_filters()
+    # Cursors of the pages above the current one; back to the newest page
+    # whenever the filters change
+    if st.session_state.get('history_filter_key') != filters:
+        st.session_state.history_filter_key = filters
+        st.session_state.history_cursors = [None]
+    cursors = st.session_state.history_cursors
+    page = get_history(filters, cursors[-1])
+    history, usage = page['records'], page['usage']
+    if not history and len(cursors) > 1:
+        # The last entries of this page were deleted
+        cursors.pop()
+        st.rerun()
+    
+    if not usage['entries']:
         st.info("No history yet. Start converting text to see your history here!")
+    elif not history:
+        st.info("No conversions match these filters.")
     else:
-        for idx, item in enumerate(reversed(st.session_state.audio_history[-10:])):
-            voice_info = f"{item.get('voice_type', 'Normal')} | {item.get('gender', 'Female')} | {item['language']}"
+        st.caption(f"{usage['entries']}/{usage['max_entries']} items · "
+                   f"{usage['bytes'] / 1_048_576:.1f}/{usage['quota_bytes'] / 1_048_576:.0f} MB used")
+        for item in history:
+            voice_info = f"{item.get('voice_type') or 'Normal'} | {item.get('gender') or 'Female'} | {item['language']}"
             with st.expander(f"🎵 {item['timestamp']} - {voice_info}"):
                 st.write(f"**Text:** {item['text']}")
-                st.audio(io.BytesIO(item['audio']), format='audio/mp3')
+                
+                # Only read the audio from disk once the user asks for it
+                if item['id'] not in st.session_state.history_open:
+                    if st.button("▶️ Load audio", key=f"load_{item['id']}"):
+                        st.session_state.history_open.add(item['id'])
+                        st.rerun()
+                else:
+                    audio = store.load_audio(item['digest'])
+                    st.audio(audio, format=MIME_TYPES.get(item['format'], 'audio/mpeg'))
                 
                 col1, col2 = st.columns(2)
                 with col1:
-                    st.download_button("⬇️ Download", io.BytesIO(item['audio']), f"history_{idx}.mp3", "audio/mp3")
+                    audio_download_button(lambda digest=item['digest']: store.load_audio(digest),
+                                          f"history_{item['id']}", item['format'] or 'mp3',
+                                          label="⬇️ Download", key=f"dl_{item['id']}")
                 with col2:
-                    if st.button("🗑️ Delete", key=f"del_{idx}"):
-                        st.session_state.audio_history.remove(item)
+                    if st.button("🗑️ Delete", key=f"del_{item['id']}"):
+                        store.delete(st.session_state.current_user, item['id'])
+                        st.session_state.history_open.discard(item['id'])
+                        st.session_state.audio_history = None
                         st.rerun()
     
-    if st.session_state.audio_history and st.button("🗑️ Clear All History"):
-        st.session_state.audio_history = []
+    if len(cursors) > 1 or page['next'] is not None:
+        col_newer, col_page, col_older = st.columns([1, 2, 1])
+        with col_newer:
+            if len(cursors) > 1 and st.button("⬅️ Newer", key="history_newer"):
+                cursors.pop()
+                st.rerun()
+        with col_page:
+            st.caption(f"Page {len(cursors)}")
+        with col_older:
+            if page['next'] is not None and st.button("Older ➡️", key="history_older"):
+                cursors.append(page['next'])
+                st.rerun()
+    
+    if usage['entries'] and st.button("🗑️ Clear All History"):
+        store.clear(st.session_state.current_user)
+        st.session_state.audio_history = None
+        st.session_state.history_open = set()
+        st.session_state.history_cursors = [None]
         st.success("History cleared!")
         st.rerun()
     
@@ -610,8 +665,8 @@ def settings_page():
     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
     st.markdown("### ⚙️ Account Settings")
     
-    users = load_users()
-    user = users.get(st.session_state.current_user, {})
+    users = get_users()
+    user = users.get(st.session_state.current_user) or {}
     
     with st.form("settings_form"):
         new_name = st.text_input("Display Name", value=user.get('name', ''))
@@ -621,16 +676,20 @@ def settings_page():
         
         if st.form_submit_button("💾 Save Changes"):
             if current_pass:
-                if hash_password(current_pass) != user['password']:
-                    st.error("Current password is incorrect!")
+                try:
+                    verified = get_auth().login(st.session_state.current_user, current_pass, ip=client_ip())
+                    error = None if verified else "Current password is incorrect!"
+                    if verified and new_pass and new_pass == confirm_new_pass:
+                        get_auth().set_password(st.session_state.current_user, new_pass)
+                except RateLimited as e:
+                    error = f"{e}."
+                if error:
+                    st.error(error)
                 elif new_pass and new_pass != confirm_new_pass:
                     st.error("New passwords don't match!")
                 else:
-                    users[st.session_state.current_user]['name'] = new_name
-                    if new_pass:
-                        users[st.session_state.current_user]['password'] = hash_password(new_pass)
-                    save_users(users)
-                    st.session_state.user_data = users[st.session_state.current_user]
+                    users.update(st.session_state.current_user, name=new_name)
+                    st.session_state.user_data = users.get(st.session_state.current_user)
                     st.success("Settings updated!")
                     st.rerun()
             else:
@@ -655,6 +714,40 @@ def settings_page():
     """)
     st.markdown('</div>', unsafe_allow_html=True)
 
+def stats_page():
+    st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+    st.markdown("### 📈 Stats")
+    
+    if not metrics.ENABLED:
+        st.info("Stage timings are off. Start the app with VOICECRAFT_METRICS=1 to collect them.")
+    
+    # Gauges come from the registered collectors, so only what has been used shows up
+    gauges = {}
+    for name, samples in metrics.gauges().items():
+        for labels, value in samples:
+            suffix = ','.join(f"{v}" for _, v in sorted(labels.items()))
+            label = name.removeprefix('voicecraft_') + (f" [{suffix}]" if suffix else '')
+            gauges[label] = round(value, 3) if isinstance(value, float) else value
+    if gauges:
+        cols = st.columns(4)
+        for i, (name, value) in enumerate(sorted(gauges.items())):
+            cols[i % 4].metric(name, value)
+    
+    rows = [
+        {'stage': stage, 'engine': engine, 'lang': lang, 'voice_type': voice_type, 'count': count,
+         'mean_ms': round(total / count * 1000, 2), 'p50_ms': p50 * 1000, 'p95_ms': p95 * 1000}
+        for (stage, engine, lang, voice_type), (count, total, p50, p95) in sorted(metrics.histograms().items())
+    ]
+    if rows:
+        st.markdown("#### Stage latency")
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+        st.caption("p50/p95 are histogram bucket upper bounds.")
+    
+    with st.expander("Raw /metrics output"):
+        st.code(metrics.render(), language="text")
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+
 # Main execution
 if not st.session_state.logged_in:
     login_page()
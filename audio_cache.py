@@ -0,0 +1,187 @@
+"""
+Content-addressed cache for synthesized audio.
+
+Two tiers: an in-process LRU bounded by total bytes, backed by a directory
+on disk bounded by total size. The disk tier is shared by every session
+(and every process pointed at the same directory).
+
+With shared state (see state.py) the second tier is Redis instead, so
+every replica reuses what any of them synthesized. Entries there expire
+CACHE_TTL seconds after they were last read; give the server a
+maxmemory-policy such as allkeys-lru to bound its size.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import state
+from metrics import register_collector
+from normalization import normalize
+
+CACHE_DIR = os.environ.get('VOICECRAFT_CACHE_DIR', '.audio_cache')
+MEMORY_BUDGET = int(os.environ.get('VOICECRAFT_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+DISK_BUDGET = int(os.environ.get('VOICECRAFT_CACHE_DISK_BYTES', str(512 * 1024 * 1024)))
+CACHE_TTL = int(os.environ.get('VOICECRAFT_CACHE_TTL', str(7 * 24 * 3600)))
+
+
+def normalize_text(text, lang=None):
+    """Canonical form of text for the key; lang-specific rules need the engine to speak lang."""
+    return normalize(text, lang)
+
+
+def cache_key(text, engine, lang=None, slow=False, voice_type=None, gender=None):
+    # Engines that ignore the language leave lang out, and so get only the
+    # language-neutral normalization: "3" is "three" in English but not for them
+    payload = json.dumps([normalize_text(text, lang), engine, lang, bool(slow), voice_type, gender])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AudioCache:
+    def __init__(self, directory=CACHE_DIR, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET,
+                 client=None, ttl=CACHE_TTL):
+        # With a Redis client the second tier is Redis, not the directory
+        self.client = client
+        self.ttl = ttl
+        if client is not None:
+            directory = None
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        # disk_hits are second-tier hits, whether that's the directory or Redis
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0,
+                         'memory_evictions': 0, 'disk_evictions': 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(e.stat().st_size for e in os.scandir(directory) if e.is_file())
+        else:
+            self._disk_bytes = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.bin')
+
+    def _remember(self, key, data):
+        # Caller holds the lock
+        if len(data) > self.memory_budget:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.counters['memory_evictions'] += 1
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return data
+        if self.directory or self.client is not None:
+            data = self._load(key)
+            if data is not None:
+                with self._lock:
+                    self.counters['disk_hits'] += 1
+                    self._remember(key, data)
+                return data
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def _load(self, key):
+        if self.client is not None:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.get(state.key('audio', key))
+            pipe.expire(state.key('audio', key), self.ttl)
+            return pipe.execute()[0]
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # mtime doubles as last-access time for disk eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key, data):
+        data = bytes(data)
+        with self._lock:
+            self._remember(key, data)
+        if self.client is not None:
+            self.client.set(state.key('audio', key), data, ex=self.ttl, nx=True)
+            return
+        if not self.directory or len(data) > self.disk_budget:
+            return
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._disk_bytes += len(data)
+            over = self._disk_bytes > self.disk_budget
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith('.bin'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        # Drop least recently used files until we're back at 90% of budget
+        target = self.disk_budget * 0.9
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            with self._lock:
+                self.counters['disk_evictions'] += 1
+        with self._lock:
+            self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['misses']
+            hits = lookups - self.counters['misses']
+            return dict(
+                self.counters,
+                hit_rate=hits / lookups if lookups else 0.0,
+                memory_bytes=self._memory_bytes,
+                memory_entries=len(self._memory),
+                disk_bytes=self._disk_bytes,
+            )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_audio_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AudioCache(client=state.get_redis()) if state.shared() else AudioCache()
+            register_collector('audio_cache', _collect)
+        return _cache
+
+
+def _collect():
+    for name, value in _cache.stats().items():
+        yield f'voicecraft_audio_cache_{name}', {}, value
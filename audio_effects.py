@@ -0,0 +1,301 @@
+"""
+Post-processing of finished conversions on PCM with vectorized NumPy.
+
+The chunks of a conversion are decoded to float32 PCM once, each chunk's
+leading/trailing silence is trimmed, the chunks are joined with short
+equal-power crossfades, the voice-type effect (pitch, tempo, gain,
+high-pass) is applied, loudness is normalized, and the result is encoded
+once, in the requested output format or the container the engine
+produced. This makes voice types sound the same on every backend instead
+of depending on pyttsx3's rate/volume properties.
+
+Decoding anything but WAV needs ffmpeg (see audio_formats); without it
+the chunks are stitched as before, no effects are applied, and the
+result is transcoded only if ffmpeg could do that either.
+
+Samples are arrays of shape (frames, channels) in [-1, 1].
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from audio_cache import get_audio_cache
+from audio_formats import FORMATS, DecodeError, decode, encode, resample, variant
+from chunking import detect_format, get_executor, stitch
+
+ENABLED = os.environ.get('VOICECRAFT_POSTPROCESS', '1') == '1'
+TARGET_DBFS = float(os.environ.get('VOICECRAFT_TARGET_DBFS', '-18'))
+PEAK_DBFS = -1.0
+SILENCE_DBFS = -45.0
+# Kept around each chunk after trimming, so sentences still breathe
+CHUNK_PAD_MS = 120
+CROSSFADE_MS = 20
+# Frames per vectorized overlap-add step in time_stretch
+STRETCH_BLOCK = 2048
+# Samples per FFT block when filtering
+FILTER_BLOCK = 1 << 16
+
+# Per voice type: semitones, tempo factor, gain relative to the loudness
+# target, high-pass cutoff in Hz (0 = off)
+EFFECTS = {
+    'normal': {},
+    'angry': {'pitch': 1.0, 'tempo': 1.08, 'gain_db': 3.0},
+    'kind': {'pitch': 0.5, 'tempo': 0.94, 'gain_db': -1.5},
+    'exclamation': {'pitch': 2.0, 'tempo': 1.05, 'gain_db': 2.0},
+    'question': {'pitch': 1.0, 'tempo': 0.97},
+    'whisper': {'pitch': -1.0, 'tempo': 0.95, 'gain_db': -8.0, 'highpass': 400},
+}
+
+
+def _db(value):
+    return 10 ** (value / 20)
+
+
+def frame_levels(samples, rate, frame_ms=10):
+    """RMS level in dBFS of consecutive frames."""
+    size = max(1, rate * frame_ms // 1000)
+    count = len(samples) // size
+    if count == 0:
+        return np.full(1, -np.inf), size
+    frames = samples[:count * size].reshape(count, size * samples.shape[1])
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(rms), size
+
+
+def trim_silence(samples, rate, threshold_db=SILENCE_DBFS, pad_ms=0):
+    """Drop leading/trailing audio quieter than threshold_db, keeping pad_ms."""
+    levels, size = frame_levels(samples, rate)
+    loud = np.flatnonzero(levels > threshold_db)
+    if loud.size == 0:
+        return samples[:0]
+    pad = rate * pad_ms // 1000
+    start = max(0, loud[0] * size - pad)
+    end = min(len(samples), (loud[-1] + 1) * size + pad)
+    return samples[start:end]
+
+
+def loudness(samples, rate):
+    """
+    Gated RMS loudness in dBFS over 400 ms blocks, in the spirit of
+    ITU-R BS.1770 (absolute gate at -70, relative gate 10 dB under the
+    ungated mean) but without K-weighting.
+    """
+    levels, _ = frame_levels(samples, rate, frame_ms=400)
+    levels = levels[levels > -70]
+    if levels.size == 0:
+        levels, _ = frame_levels(samples, rate, frame_ms=max(1, len(samples) * 1000 // rate))
+        return float(levels[0])
+    power = _db(levels) ** 2
+    gate = 10 * np.log10(power.mean()) - 10
+    gated = power[levels > gate]
+    return float(10 * np.log10(gated.mean()))
+
+
+def normalize_loudness(samples, rate, target_db=TARGET_DBFS, peak_db=PEAK_DBFS):
+    current = loudness(samples, rate)
+    if not np.isfinite(current):
+        return samples
+    samples = samples * _db(target_db - current)
+    peak = np.max(np.abs(samples)) if samples.size else 0.0
+    if peak > _db(peak_db):
+        # Louder than the target allows without clipping: back off to the ceiling
+        samples = samples * (_db(peak_db) / peak)
+    return samples
+
+
+def gain(samples, db):
+    return samples * _db(db)
+
+
+def fir_filter(samples, kernel, block=FILTER_BLOCK):
+    """
+    Linear-phase FIR filtering by FFT overlap-add, block by block so the
+    temporaries stay small; the kernel's delay is removed.
+    """
+    size = 1 << (block + len(kernel) - 2).bit_length()
+    response = np.fft.rfft(kernel, n=size)[:, None]
+    out = np.zeros((len(samples) + len(kernel) - 1, samples.shape[1]), np.float32)
+    for start in range(0, len(samples), block):
+        segment = samples[start:start + block]
+        filtered = np.fft.irfft(np.fft.rfft(segment, n=size, axis=0) * response, n=size, axis=0)
+        count = len(segment) + len(kernel) - 1
+        out[start:start + count] += filtered[:count]
+    delay = len(kernel) // 2
+    return out[delay:delay + len(samples)]
+
+
+def highpass(samples, rate, cutoff, taps=511):
+    """Windowed-sinc high-pass (spectral inversion of a Blackman low-pass)."""
+    n = np.arange(taps) - taps // 2
+    kernel = -np.sinc(2 * cutoff / rate * n) * (2 * cutoff / rate) * np.blackman(taps)
+    kernel[taps // 2] += 1
+    return fir_filter(samples, kernel)
+
+
+def _align(mono, starts, frame, hop_out, step=4):
+    """
+    WSOLA: nudge each analysis frame by up to hop_out samples so it lines
+    up with the natural continuation of the previous one. The search runs
+    on a decimated copy with one vectorized correlation per frame.
+    """
+    coarse = mono[::step]
+    tolerance = hop_out // step
+    template_len = hop_out // step
+    last = (len(mono) - frame) // step
+    aligned = starts.copy()
+    for i in range(1, len(starts)):
+        natural = (aligned[i - 1] + hop_out) // step
+        template = coarse[natural:natural + template_len]
+        lo = max(0, starts[i] // step - tolerance)
+        hi = min(last, starts[i] // step + tolerance)
+        if hi <= lo or len(template) < template_len:
+            continue
+        corr = np.correlate(coarse[lo:hi + template_len], template, 'valid')
+        aligned[i] = (lo + int(np.argmax(corr))) * step
+    return aligned
+
+
+def time_stretch(samples, rate, factor, frame_ms=40):
+    """
+    Change tempo by factor (>1 is faster) keeping the pitch, with WSOLA
+    overlap-add of Hann windows at 75% overlap.
+
+    Output frames i and i+4 are exactly one frame apart, so each of the
+    four phases is laid down as one contiguous block instead of adding
+    frames one at a time.
+    """
+    if factor == 1 or len(samples) == 0:
+        return samples
+    frame = max(64, rate * frame_ms // 1000 // 4 * 4)
+    hop_out = frame // 4
+    hop_in = hop_out * factor
+    if len(samples) < frame + hop_out:
+        return resample(samples, factor)
+    count = int((len(samples) - frame - hop_out) / hop_in) + 1
+    starts = _align(samples.mean(axis=1), (np.arange(count) * hop_in).astype(np.int64), frame, hop_out)
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame) / frame)).astype(np.float32)
+    # (positions, channels, frame) view of every possible frame, no copy
+    views = np.lib.stride_tricks.sliding_window_view(samples, frame, axis=0)
+
+    channels = samples.shape[1]
+    length = (count - 1) * hop_out + frame
+    out = np.zeros((length, channels), np.float32)
+    for phase in range(4):
+        # Blocks bound the temporary copy on multi-minute input
+        for first in range(phase, count, 4 * STRETCH_BLOCK):
+            group = starts[first:first + 4 * STRETCH_BLOCK:4]
+            offset = first * hop_out
+            span = len(group) * frame
+            block = views[group] * window
+            out[offset:offset + span] += block.transpose(0, 2, 1).reshape(span, channels)
+    # Windows only sum to a constant where four of them overlap
+    norm = np.zeros(length, np.float32)
+    for phase in range(4):
+        frames = len(range(phase, count, 4))
+        norm[phase * hop_out:phase * hop_out + frames * frame] += np.tile(window, frames)
+    return out / np.maximum(norm, 1e-3)[:, None]
+
+
+def pitch_shift(samples, rate, semitones):
+    """Shift pitch keeping the duration: stretch, then resample back."""
+    if not semitones:
+        return samples
+    ratio = 2 ** (semitones / 12)
+    return resample(time_stretch(samples, rate, 1 / ratio), ratio)
+
+
+def crossfade_join(parts, rate, crossfade_ms=CROSSFADE_MS):
+    """Concatenate sample arrays with equal-power crossfades at the joins."""
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return np.zeros((0, 1), np.float32)
+    fade = min([rate * crossfade_ms // 1000] + [len(p) // 2 for p in parts])
+    if len(parts) == 1 or fade == 0:
+        return np.concatenate(parts)
+    t = np.linspace(0, np.pi / 2, fade, dtype=np.float32)[:, None]
+    fade_out, fade_in = np.cos(t), np.sin(t)
+    pieces = []
+    tail = None
+    for i, part in enumerate(parts):
+        start = 0
+        if tail is not None:
+            pieces.append(tail * fade_out + part[:fade] * fade_in)
+            start = fade
+        if i < len(parts) - 1:
+            pieces.append(part[start:len(part) - fade])
+            tail = part[len(part) - fade:]
+        else:
+            pieces.append(part[start:])
+    return np.concatenate(pieces)
+
+
+def _match(samples, rate, channels, target_rate):
+    if samples.shape[1] != channels:
+        samples = np.repeat(samples.mean(axis=1, keepdims=True), channels, axis=1)
+    if rate != target_rate:
+        samples = resample(samples, rate / target_rate)
+    return samples
+
+
+def process(parts, voice_type='normal', native_styles=False, fmt=None, bitrate=None, sample_rate=None):
+    """
+    Decode the chunks of one conversion, join and post-process them, and
+    encode the result once, as fmt or else in the chunks' own container.
+
+    native_styles: the engine already spoke at the voice type's rate
+    (pyttsx3), so the tempo change is skipped.
+    """
+    if fmt is None:
+        source = detect_format(parts[0])
+        fmt = source if source in FORMATS else 'wav'
+    decoded = list(get_executor().map(decode, parts)) if len(parts) > 1 else [decode(parts[0])]
+    rate = decoded[0][1]
+    channels = decoded[0][0].shape[1]
+    pieces = [trim_silence(_match(s, r, channels, rate), rate, pad_ms=CHUNK_PAD_MS) for s, r in decoded]
+    samples = crossfade_join(pieces, rate)
+    if not len(samples):
+        return variant(stitch(parts), fmt, bitrate, sample_rate)
+
+    effect = EFFECTS.get(voice_type, {})
+    if effect.get('highpass'):
+        samples = highpass(samples, rate, effect['highpass'])
+    if effect.get('tempo', 1) != 1 and not native_styles:
+        samples = time_stretch(samples, rate, effect['tempo'])
+    if effect.get('pitch'):
+        samples = pitch_shift(samples, rate, effect['pitch'])
+    samples = normalize_loudness(samples, rate)
+    if effect.get('gain_db'):
+        samples = gain(samples, effect['gain_db'])
+        samples = np.clip(samples, -_db(PEAK_DBFS), _db(PEAK_DBFS))
+    return encode(samples, rate, fmt, bitrate, sample_rate)
+
+
+def finisher(voice_type='normal', native_styles=False, fmt=None, bitrate=None, sample_rate=None):
+    """
+    parts -> bytes callable for jobs: post-processed audio in the output
+    format when possible, otherwise the chunks stitched together and
+    transcoded if that can be done. Results are cached by the chunks'
+    digests and the settings, so a repeated conversion isn't re-encoded.
+    """
+    def finish(parts):
+        if not ENABLED:
+            return variant(stitch(parts), fmt, bitrate, sample_rate)
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(hashlib.sha256(part).digest())
+        key = hashlib.sha256(
+            f"finish:{digest.hexdigest()}:{voice_type}:{native_styles}:{fmt}:{bitrate}:{sample_rate}".encode()
+        ).hexdigest()
+        cache = get_audio_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        try:
+            audio = process(parts, voice_type, native_styles, fmt, bitrate, sample_rate)
+        except DecodeError:
+            return variant(stitch(parts), fmt, bitrate, sample_rate)
+        cache.put(key, audio)
+        return audio
+    return finish
@@ -0,0 +1,220 @@
+"""
+Audio containers, codecs and transcoding.
+
+Engines return whatever their driver writes: gTTS gives MP3, pyttsx3 gives
+WAV (or AIFF from the macOS driver) whatever the file is called. The
+container is always detected from the bytes, never assumed, and audio is
+transcoded at most once, straight from the engine's bytes (or the
+post-processed PCM) into the requested format. Transcoded variants are
+kept in the audio cache, keyed by the source digest and the settings.
+
+WAV is handled with the wave module; everything else needs ffmpeg. numpy
+is only imported by the functions that touch samples, so the format tables
+can be imported by the UI without it.
+"""
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import wave
+
+from audio_cache import get_audio_cache
+from chunking import detect_format
+
+FFMPEG = os.environ.get('VOICECRAFT_FFMPEG', '') or shutil.which('ffmpeg')
+# Compressed input is decoded to mono at this rate (gTTS speaks at 24 kHz)
+DECODE_RATE = int(os.environ.get('VOICECRAFT_DECODE_RATE', '24000'))
+
+MIME_TYPES = {
+    'mp3': 'audio/mpeg',
+    'ogg': 'audio/ogg',
+    'wav': 'audio/wav',
+    'aiff': 'audio/aiff',
+    'flac': 'audio/flac',
+}
+
+# Formats offered for output; bitrates in kbit/s, first entry is the default
+FORMATS = {
+    'mp3': {'label': 'MP3', 'codec': 'libmp3lame', 'bitrates': (128, 64, 96, 192)},
+    'ogg': {'label': 'Opus (OGG)', 'codec': 'libopus', 'bitrates': (48, 24, 32, 64, 96)},
+    'wav': {'label': 'WAV', 'codec': 'pcm_s16le', 'bitrates': ()},
+}
+SAMPLE_RATES = (16000, 22050, 24000, 44100, 48000)
+
+
+class DecodeError(Exception):
+    pass
+
+
+def can_transcode():
+    return bool(FFMPEG)
+
+
+def mime_type(data):
+    return MIME_TYPES.get(detect_format(data), 'application/octet-stream')
+
+
+def extension(data):
+    return detect_format(data) or 'bin'
+
+
+# MPEG Layer III bitrates (kbit/s) by bitrate index, for MPEG-1 and MPEG-2/2.5
+_MP3_BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def _mp3_duration(data):
+    # Walk the frame headers; anything that isn't one (ID3 tags) is skipped
+    seconds = 0.0
+    i = 0
+    end = len(data) - 4
+    while i <= end:
+        b1, b2 = data[i + 1], data[i + 2]
+        version, layer = (b1 >> 3) & 3, (b1 >> 1) & 3
+        bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+        if (data[i] != 0xFF or b1 & 0xE0 != 0xE0 or version == 1 or layer != 1
+                or bitrate_index in (0, 15) or rate_index == 3):
+            i += 1
+            continue
+        rate = _MP3_RATES[version][rate_index]
+        bitrate = _MP3_BITRATES[3 if version == 3 else 2][bitrate_index] * 1000
+        samples = 1152 if version == 3 else 576
+        seconds += samples / rate
+        i += samples // 8 * bitrate // rate + ((b2 >> 1) & 1)
+    return seconds
+
+
+def duration(data):
+    """Seconds of audio in WAV or MP3 data, or None for other containers."""
+    fmt = detect_format(data)
+    if fmt == 'wav':
+        with wave.open(io.BytesIO(data), 'rb') as reader:
+            return reader.getnframes() / reader.getframerate()
+    if fmt == 'mp3':
+        return _mp3_duration(data)
+    return None
+
+
+def _ffmpeg(args, data):
+    if not FFMPEG:
+        raise DecodeError("ffmpeg is not installed")
+    result = subprocess.run([FFMPEG, '-v', 'error', *args], input=data, capture_output=True)
+    if result.returncode != 0:
+        raise DecodeError(result.stderr.decode('utf-8', 'replace').strip() or "ffmpeg failed")
+    return result.stdout
+
+
+def _codec_args(fmt, bitrate=None, sample_rate=None):
+    spec = FORMATS[fmt]
+    args = ['-c:a', spec['codec']]
+    if spec['bitrates']:
+        args += ['-b:a', f"{bitrate or spec['bitrates'][0]}k"]
+    if sample_rate:
+        args += ['-ar', str(sample_rate)]
+    return args + ['-f', fmt, 'pipe:1']
+
+
+def decode(data):
+    """(samples, rate) for WAV or, through ffmpeg, any other audio."""
+    import numpy as np
+    if detect_format(data) == 'wav':
+        with wave.open(io.BytesIO(data), 'rb') as reader:
+            channels, width, rate = reader.getnchannels(), reader.getsampwidth(), reader.getframerate()
+            raw = reader.readframes(reader.getnframes())
+        if width == 1:
+            samples = (np.frombuffer(raw, np.uint8).astype(np.float32) - 128) / 128
+        elif width == 2:
+            samples = np.frombuffer(raw, '<i2').astype(np.float32) / 32768
+        elif width == 3:
+            # Widen 24-bit little-endian samples to int32 by hand
+            b = np.frombuffer(raw, np.uint8).reshape(-1, 3).astype(np.int32)
+            samples = ((b[:, 0] << 8 | b[:, 1] << 16 | b[:, 2] << 24) >> 8).astype(np.float32) / 8388608
+        elif width == 4:
+            samples = np.frombuffer(raw, '<i4').astype(np.float32) / 2147483648
+        else:
+            raise DecodeError(f"Unsupported WAV sample width {width}")
+        return samples.reshape(-1, channels), rate
+    raw = _ffmpeg(['-i', 'pipe:0', '-f', 's16le', '-ac', '1', '-ar', str(DECODE_RATE), 'pipe:1'], data)
+    return (np.frombuffer(raw, '<i2').astype(np.float32) / 32768).reshape(-1, 1), DECODE_RATE
+
+
+def resample(samples, factor):
+    """Read samples factor times faster by linear interpolation (changes pitch and length)."""
+    import numpy as np
+    positions = np.arange(0, len(samples) - 1, factor)
+    # Evenly spaced positions, so no search is needed: blend neighbours directly
+    index = positions.astype(np.int64)
+    frac = (positions - index).astype(np.float32)[:, None]
+    return samples[index] * (1 - frac) + samples[index + 1] * frac
+
+
+def encode(samples, rate, fmt='wav', bitrate=None, sample_rate=None):
+    """Encode float PCM of shape (frames, channels) in one pass."""
+    import numpy as np
+    if fmt == 'wav' and sample_rate and sample_rate != rate:
+        samples, rate = resample(samples, rate / sample_rate), sample_rate
+    pcm = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+    if fmt == 'wav':
+        out = io.BytesIO()
+        with wave.open(out, 'wb') as writer:
+            writer.setnchannels(samples.shape[1])
+            writer.setsampwidth(2)
+            writer.setframerate(rate)
+            writer.writeframes(pcm.tobytes())
+        return out.getvalue()
+    return _ffmpeg(['-f', 's16le', '-ar', str(rate), '-ac', str(samples.shape[1]), '-i', 'pipe:0',
+                    *_codec_args(fmt, bitrate, sample_rate)], pcm.tobytes())
+
+
+def _needs_transcode(data, fmt, bitrate, sample_rate):
+    if not fmt or detect_format(data) != fmt:
+        return bool(fmt)
+    # Same container: only re-encode when asked for different parameters
+    if bitrate:
+        return True
+    if not sample_rate:
+        return False
+    if fmt != 'wav':
+        return True
+    with wave.open(io.BytesIO(data), 'rb') as reader:
+        return reader.getframerate() != sample_rate
+
+
+def transcode(data, fmt, bitrate=None, sample_rate=None):
+    """data re-encoded as fmt; unchanged if it already is fmt and nothing else was asked for."""
+    if not _needs_transcode(data, fmt, bitrate, sample_rate):
+        return data
+    if fmt == 'wav':
+        # WAV output from ffmpeg on a pipe has no valid length header
+        samples, rate = decode(data)
+        return encode(samples, rate, 'wav', sample_rate=sample_rate)
+    return _ffmpeg(['-i', 'pipe:0', *_codec_args(fmt, bitrate, sample_rate)], data)
+
+
+def variant_key(source_digest, fmt, bitrate=None, sample_rate=None):
+    return hashlib.sha256(f"variant:{source_digest}:{fmt}:{bitrate}:{sample_rate}".encode()).hexdigest()
+
+
+def variant(data, fmt, bitrate=None, sample_rate=None):
+    """
+    Cached transcode. Falls back to the original bytes when the format
+    can't be produced here (no ffmpeg); check the result's container with
+    detect_format/mime_type rather than assuming fmt.
+    """
+    if not _needs_transcode(data, fmt, bitrate, sample_rate):
+        return data
+    cache = get_audio_cache()
+    key = variant_key(hashlib.sha256(data).hexdigest(), fmt, bitrate, sample_rate)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        encoded = transcode(data, fmt, bitrate, sample_rate)
+    except DecodeError:
+        return data
+    cache.put(key, encoded)
+    return encoded
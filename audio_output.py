@@ -0,0 +1,72 @@
+"""
+Private, per-job output targets for engines that can only write to a path.
+
+Preference order: an anonymous memfd (Linux), a unique file on tmpfs
+(/dev/shm), then a unique file in the system temp directory. Nothing is
+ever written to a shared, fixed file name.
+"""
+import os
+import tempfile
+
+SHM_DIR = '/dev/shm'
+
+
+class OutputTarget:
+    def __init__(self, suffix='.mp3'):
+        self.fd = None
+        self.path = None
+        self.kind = None
+        if hasattr(os, 'memfd_create'):
+            try:
+                self.fd = os.memfd_create('voicecraft-audio', os.MFD_CLOEXEC)
+                self.path = f"/proc/{os.getpid()}/fd/{self.fd}"
+                self.kind = 'memfd'
+                return
+            except OSError:
+                self.fd = None
+        directory = SHM_DIR if os.access(SHM_DIR, os.W_OK) else None
+        fd, self.path = tempfile.mkstemp(prefix='voicecraft-', suffix=suffix, dir=directory)
+        # Let the engine open the path itself; some drivers won't share it
+        os.close(fd)
+        self.kind = 'tmpfs' if directory else 'tempfile'
+
+    def read(self):
+        """Return everything the engine wrote, as one bytes object."""
+        if self.fd is not None:
+            fd = self.fd
+        else:
+            try:
+                fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            except FileNotFoundError:
+                return b''
+        try:
+            size = os.fstat(fd).st_size
+            os.lseek(fd, 0, os.SEEK_SET)
+            # A single read sized from fstat allocates the result exactly once
+            data = os.read(fd, size)
+            while len(data) < size:
+                more = os.read(fd, size - len(data))
+                if not more:
+                    break
+                data += more
+            return data
+        finally:
+            if fd != self.fd:
+                os.close(fd)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        elif self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,284 @@
+"""
+Password hashing, login and sign-up.
+
+Passwords are hashed with salted scrypt at a fixed cost (VOICECRAFT_SCRYPT_*;
+calibrate() suggests an N for a target time on this machine). Hashing runs
+on a small dedicated pool, so a burst of attempts queues there instead of
+tying up every session thread and tens of MB of memory per attempt; a
+session waits at most VOICECRAFT_AUTH_HASH_TIMEOUT seconds for its turn
+before the attempt fails as busy.
+
+Password hashes for all users are held in an in-memory index, so an attempt
+never touches the database unless it succeeds, and attempts are throttled
+with token buckets per username and per client IP before anything is
+hashed. Records still holding the old unsalted SHA-256 digest are rehashed
+with scrypt the first time their owner logs in.
+
+With shared state (see state.py) other replicas may have added a user or
+changed a password since the index was loaded, so an unknown username or
+a wrong password is checked once more against the store before the
+attempt fails. Rate limits stay per replica.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import state
+from metrics import register_collector, span
+
+SCRYPT_N = int(os.environ.get('VOICECRAFT_SCRYPT_N', str(2 ** 15)))
+SCRYPT_R = int(os.environ.get('VOICECRAFT_SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('VOICECRAFT_SCRYPT_P', '1'))
+SALT_BYTES = 16
+HASH_BYTES = 32
+# Each scrypt call holds 128 * r * N bytes (32 MiB at the defaults)
+HASH_WORKERS = int(os.environ.get('VOICECRAFT_AUTH_HASH_WORKERS', '2'))
+HASH_TIMEOUT = float(os.environ.get('VOICECRAFT_AUTH_HASH_TIMEOUT', '10'))
+
+# Token buckets: burst size and tokens regained per second
+USER_BURST = int(os.environ.get('VOICECRAFT_AUTH_USER_BURST', '5'))
+USER_REFILL = float(os.environ.get('VOICECRAFT_AUTH_USER_REFILL', str(1 / 12)))
+IP_BURST = int(os.environ.get('VOICECRAFT_AUTH_IP_BURST', '20'))
+IP_REFILL = float(os.environ.get('VOICECRAFT_AUTH_IP_REFILL', str(1 / 3)))
+MAX_BUCKETS = 10_000
+
+_legacy_re = re.compile(r'[0-9a-f]{64}')
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many attempts, try again in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class AuthBusy(RateLimited):
+    """The hashing pool is too backed up to take the attempt in time."""
+
+    def __init__(self, retry_after):
+        Exception.__init__(self, f"The server is busy, try again in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=2 * 128 * r * n, dklen=HASH_BYTES)
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def hash_password(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """'scrypt$N$r$p$salt$hash' with a fresh random salt."""
+    salt = secrets.token_bytes(SALT_BYTES)
+    return f"scrypt${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+
+def verify_password(password, stored):
+    """(matches, needs_rehash) for a password against a stored hash."""
+    if _legacy_re.fullmatch(stored):
+        digest = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        return hmac.compare_digest(digest, stored), True
+    try:
+        scheme, n, r, p, salt, digest = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+        salt, digest = base64.b64decode(salt), base64.b64decode(digest)
+    except ValueError:
+        return False, False
+    if scheme != 'scrypt':
+        return False, False
+    matches = hmac.compare_digest(_scrypt(password, salt, n, r, p), digest)
+    return matches, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+def calibrate(target_seconds=0.1, r=SCRYPT_R, p=SCRYPT_P):
+    """Smallest power-of-two N whose hash takes at least target_seconds here."""
+    n = 2 ** 12
+    while True:
+        started = time.perf_counter()
+        _scrypt('calibrate', b'\0' * SALT_BYTES, n, r, p)
+        if time.perf_counter() - started >= target_seconds or n >= 2 ** 20:
+            return n
+        n *= 2
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by any hashable; full buckets are forgotten.
+    Buckets are kept in order of last use, so pruning only looks at the
+    stale end instead of sweeping them all.
+    """
+
+    def __init__(self, burst, refill, max_keys=MAX_BUCKETS):
+        self.burst = burst
+        self.refill = refill
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def _level(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.refill)
+
+    def wait(self, key, now):
+        """Seconds until key has a token (0 if it has one now)."""
+        level = self._level(key, now)
+        return 0.0 if level >= 1 else (1 - level) / self.refill
+
+    def take(self, key, now):
+        self._buckets[key] = (self._level(key, now) - 1, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_keys:
+            self._prune(now)
+
+    def reset(self, key):
+        self._buckets.pop(key, None)
+
+    def _prune(self, now):
+        # Anything untouched for burst / refill seconds is full; stop at the
+        # first bucket still refilling, so each one is dropped at most once
+        while self._buckets:
+            key = next(iter(self._buckets))
+            if self._level(key, now) < self.burst:
+                return
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class Authenticator:
+    def __init__(self, store, hash_workers=HASH_WORKERS, shared=False, hash_timeout=HASH_TIMEOUT):
+        self.store = store
+        self.shared = shared
+        self.hash_timeout = hash_timeout
+        self._executor = ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix='auth-hash')
+        self._lock = threading.Lock()
+        self._passwords = dict(store.credentials())
+        self._users = RateLimiter(USER_BURST, USER_REFILL)
+        self._ips = RateLimiter(IP_BURST, IP_REFILL)
+        self._dummy = None
+        self.counters = {'logins': 0, 'failures': 0, 'rate_limited': 0, 'rehashed': 0, 'busy': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _admit(self, username=None, ip=None):
+        """Take a token from every bucket the attempt falls in, or raise RateLimited."""
+        buckets = [(limiter, key) for limiter, key in ((self._users, username), (self._ips, ip))
+                   if key is not None]
+        now = time.monotonic()
+        with self._lock:
+            wait = max((limiter.wait(key, now) for limiter, key in buckets), default=0)
+            if wait:
+                self.counters['rate_limited'] += 1
+                raise RateLimited(wait)
+            for limiter, key in buckets:
+                limiter.take(key, now)
+
+    def _run(self, fn, *args):
+        # Blocks the session's thread, but only for so long
+        future = self._executor.submit(fn, *args)
+        try:
+            return future.result(timeout=self.hash_timeout)
+        except TimeoutError:
+            # Still queued: give up its turn; already hashing: let it finish
+            future.cancel()
+            self._count('busy')
+            raise AuthBusy(self.hash_timeout)
+
+    def _reload(self, username):
+        """Re-read username's hash from the store into the index."""
+        record = self.store.get(username)
+        with self._lock:
+            if record is None:
+                self._passwords.pop(username, None)
+                return None
+            self._passwords[username] = record['password']
+            return record['password']
+
+    def login(self, username, password, ip=None):
+        """The user's record if the password is right, else None."""
+        self._admit(username, ip)
+        with self._lock:
+            stored = self._passwords.get(username)
+        if stored is None and self.shared:
+            stored = self._reload(username)
+        with span('auth_verify'):
+            if stored is None:
+                # Spend the same time on unknown usernames as on wrong passwords
+                if self._dummy is None:
+                    self._dummy = self._run(hash_password, secrets.token_hex(8))
+                self._run(verify_password, password, self._dummy)
+                matches = False
+            else:
+                matches, needs_rehash = self._run(verify_password, password, stored)
+                if not matches and self.shared:
+                    # The password may have been changed on another replica
+                    fresh = self._reload(username)
+                    if fresh is not None and fresh != stored:
+                        matches, needs_rehash = self._run(verify_password, password, fresh)
+        if not matches:
+            self._count('failures')
+            return None
+        self._count('logins')
+        with self._lock:
+            self._users.reset(username)
+        if needs_rehash:
+            try:
+                self.set_password(username, password)
+                self._count('rehashed')
+            except AuthBusy:
+                # Rehashed at a quieter login instead
+                pass
+        return self.store.get(username)
+
+    def register(self, username, password, record, ip=None):
+        """Create a user; returns False if the username is taken."""
+        self._admit(ip=ip)
+        with self._lock:
+            if username in self._passwords:
+                return False
+        with span('auth_hash'):
+            hashed = self._run(hash_password, password)
+        if not self.store.create(username, dict(record, password=hashed)):
+            return False
+        with self._lock:
+            self._passwords[username] = hashed
+        return True
+
+    def set_password(self, username, password):
+        with span('auth_hash'):
+            hashed = self._run(hash_password, password)
+        self.store.update(username, password=hashed)
+        with self._lock:
+            self._passwords[username] = hashed
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, users=len(self._passwords), buckets=len(self._users) + len(self._ips))
+
+
+_auth = None
+_auth_lock = threading.Lock()
+
+
+def get_authenticator(store):
+    global _auth
+    with _auth_lock:
+        if _auth is None:
+            _auth = Authenticator(store, shared=state.shared())
+            register_collector('auth', _collect)
+        return _auth
+
+
+def _collect():
+    for name, value in _auth.stats().items():
+        yield f'voicecraft_auth_{name}', {}, value
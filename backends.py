@@ -0,0 +1,300 @@
+"""
+Pluggable text-to-speech backends.
+
+Every backend implements the same small interface (synthesize, stream,
+list_voices, capabilities) and registers itself by name. Callers either
+ask for a backend by name or let select_backend() pick the fastest one
+that is available for a language, judged by the seconds-per-character it
+has actually been delivering in this process.
+
+Built in:
+    gtts     Google Translate TTS (needs network access)
+    pyttsx3  local system voices through the pooled engines in engine_pool
+    http     a locally hosted server speaking the OpenAI-style
+             POST /v1/audio/speech API (Kokoro-FastAPI, openedai-speech,
+             LocalAI, ...), enabled by setting VOICECRAFT_TTS_HTTP_URL
+"""
+import importlib.util
+import io
+import os
+import threading
+import time
+
+from audio_cache import cache_key
+from chunking import stream_long_text
+
+# Languages the system voices are trusted with; other text goes elsewhere
+PYTTSX3_LANGS = os.environ.get('VOICECRAFT_PYTTSX3_LANGS', 'en,en-uk')
+
+HTTP_URL = os.environ.get('VOICECRAFT_TTS_HTTP_URL', '').rstrip('/')
+HTTP_MODEL = os.environ.get('VOICECRAFT_TTS_HTTP_MODEL', 'tts-1')
+HTTP_LANGS = os.environ.get('VOICECRAFT_TTS_HTTP_LANGS', 'en,en-uk')
+HTTP_VOICE_FEMALE = os.environ.get('VOICECRAFT_TTS_HTTP_VOICE_FEMALE', 'nova')
+HTTP_VOICE_MALE = os.environ.get('VOICECRAFT_TTS_HTTP_VOICE_MALE', 'onyx')
+HTTP_POOL_SIZE = int(os.environ.get('VOICECRAFT_TTS_HTTP_POOL_SIZE', '8'))
+HTTP_TIMEOUT = float(os.environ.get('VOICECRAFT_TTS_HTTP_TIMEOUT', '60'))
+
+# A backend that just failed is skipped by select_backend() for this long
+FAILURE_COOLDOWN = float(os.environ.get('VOICECRAFT_BACKEND_COOLDOWN', '60'))
+# Weight of the newest measurement in the seconds-per-character average
+SPEED_SMOOTHING = 0.3
+
+
+class BackendUnavailable(Exception):
+    pass
+
+
+def _langs(value):
+    return frozenset(code.strip() for code in value.split(',') if code.strip())
+
+
+class Backend:
+    """
+    Base class for TTS backends.
+
+    capabilities keys:
+        languages     frozenset of language codes, or None for "any"
+        voice_styles  honours voice_type (rate/volume presets)
+        genders       honours gender
+        offline       works without internet access
+        format        container of the returned audio ('mp3' or 'wav')
+    expected_seconds_per_char ranks backends before any have been measured.
+    Subclasses override installed(); available() also turns false for good
+    once the backend is marked broken (e.g. its warm-up failed).
+    """
+
+    name = None
+    capabilities = {}
+    expected_seconds_per_char = 0.01
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds_per_char = None
+        self.failed_at = None
+        self.broken = None
+
+    def installed(self):
+        """Whether the dependencies and configuration are there."""
+        return True
+
+    def available(self):
+        """Whether the backend can be used at all."""
+        return self.broken is None and self.installed()
+
+    def mark_broken(self, reason):
+        """Take the backend out of use for the rest of the process."""
+        self.broken = reason or "unknown error"
+
+    def supports(self, lang):
+        languages = self.capabilities.get('languages')
+        return languages is None or lang in languages
+
+    def synthesize(self, text, lang='en', voice_type='normal', gender='female', slow=False):
+        """Return the audio for text as bytes; raise on failure."""
+        raise NotImplementedError
+
+    def cache_key(self, text, lang, slow, voice_type, gender):
+        # Subclasses leave out options that don't change their output
+        return cache_key(text, self.name, lang=lang, slow=slow, voice_type=voice_type, gender=gender)
+
+    def stream(self, text, **options):
+        """Yield (index, total, audio_bytes) for text chunk by chunk, in order."""
+        def synthesize(chunk):
+            try:
+                return io.BytesIO(self.synthesize(chunk, **options)), None
+            except Exception as e:
+                return None, str(e)
+        return stream_long_text(text, synthesize)
+
+    def list_voices(self):
+        return []
+
+    def warm_up(self):
+        """Pay start-up costs (imports, connections, voice discovery) ahead of the first request."""
+
+    def record(self, characters, seconds, ok=True):
+        """Feed a finished call into the speed estimate used for selection."""
+        with self._lock:
+            if not ok:
+                self.failed_at = time.monotonic()
+                return
+            self.failed_at = None
+            self.broken = None
+            if characters <= 0:
+                return
+            sample = seconds / characters
+            if self.seconds_per_char is None:
+                self.seconds_per_char = sample
+            else:
+                self.seconds_per_char += SPEED_SMOOTHING * (sample - self.seconds_per_char)
+
+    def cooling_down(self):
+        failed_at = self.failed_at
+        return failed_at is not None and time.monotonic() - failed_at < FAILURE_COOLDOWN
+
+    def speed(self):
+        return self.seconds_per_char if self.seconds_per_char is not None else self.expected_seconds_per_char
+
+
+class GTTSBackend(Backend):
+    name = 'gtts'
+    capabilities = {'languages': None, 'voice_styles': False, 'genders': False, 'offline': False, 'format': 'mp3'}
+    # One round trip to Google per ~100 characters
+    expected_seconds_per_char = 0.004
+
+    def installed(self):
+        # gTTS itself is imported on first use
+        return importlib.util.find_spec('gtts') is not None
+
+    def warm_up(self):
+        from gtts_transport import get_gtts_transport
+        import gtts  # noqa: F401
+        get_gtts_transport()
+
+    def synthesize(self, text, lang='en', voice_type='normal', gender='female', slow=False):
+        from gtts_transport import get_gtts_transport
+        return get_gtts_transport().synthesize(text, lang=lang, slow=slow)
+
+    def cache_key(self, text, lang, slow, voice_type, gender):
+        return cache_key(text, self.name, lang=lang, slow=slow)
+
+    def list_voices(self):
+        from gtts.lang import tts_langs
+        return [{'id': code, 'name': name, 'lang': code} for code, name in sorted(tts_langs().items())]
+
+
+class Pyttsx3Backend(Backend):
+    name = 'pyttsx3'
+    capabilities = {'languages': _langs(PYTTSX3_LANGS), 'voice_styles': True, 'genders': True,
+                    'offline': True, 'format': 'wav'}
+    expected_seconds_per_char = 0.002
+
+    def installed(self):
+        return importlib.util.find_spec('pyttsx3') is not None
+
+    def warm_up(self):
+        from engine_pool import get_engine_pool
+        pool = get_engine_pool()
+        # Starts the drivers and probes the installed voices; a driver that
+        # can't start (no eSpeak) raises here
+        for future in pool.warm_up():
+            future.result(timeout=pool.job_timeout)
+
+    def synthesize(self, text, lang='en', voice_type='normal', gender='female', slow=False):
+        from engine_pool import get_engine_pool
+        # The engine pool is this backend's connection pool: long-lived
+        # drivers, one per worker thread
+        return get_engine_pool().synthesize(text, voice_type=voice_type, gender=gender)
+
+    def cache_key(self, text, lang, slow, voice_type, gender):
+        return cache_key(text, self.name, voice_type=voice_type, gender=gender)
+
+    def list_voices(self):
+        from engine_pool import get_engine_pool
+        pool = get_engine_pool()
+        return [{'id': voice, 'name': voice, 'lang': None} for voice in pool.voices or []]
+
+
+class HTTPBackend(Backend):
+    """Client for a local TTS server with a pooled keep-alive session."""
+
+    name = 'http'
+    capabilities = {'languages': _langs(HTTP_LANGS), 'voice_styles': False, 'genders': True,
+                    'offline': True, 'format': 'mp3'}
+    # A local GPU/CPU server with no Internet round trip
+    expected_seconds_per_char = 0.001
+
+    def __init__(self, url=HTTP_URL, model=HTTP_MODEL, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT):
+        super().__init__()
+        self.url = url
+        self.model = model
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def installed(self):
+        return bool(self.url)
+
+    def warm_up(self):
+        self.session()
+
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                # Keep up to pool_size connections open to the one host
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def synthesize(self, text, lang='en', voice_type='normal', gender='female', slow=False):
+        if not self.url:
+            raise BackendUnavailable("VOICECRAFT_TTS_HTTP_URL is not set")
+        voice = HTTP_VOICE_MALE if gender == 'male' else HTTP_VOICE_FEMALE
+        response = self.session().post(
+            f"{self.url}/v1/audio/speech",
+            json={'model': self.model, 'input': text, 'voice': voice, 'response_format': 'mp3',
+                  'speed': 0.75 if slow else 1.0},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        if not response.content:
+            raise RuntimeError("TTS server returned no audio")
+        return response.content
+
+    def cache_key(self, text, lang, slow, voice_type, gender):
+        # The server's model decides the voice, not the language code
+        return cache_key(text, f"{self.name}:{self.model}", slow=slow, gender=gender)
+
+    def list_voices(self):
+        response = self.session().get(f"{self.url}/v1/audio/voices", timeout=self.timeout)
+        response.raise_for_status()
+        voices = response.json().get('voices', [])
+        return [{'id': v, 'name': v, 'lang': None} if isinstance(v, str) else v for v in voices]
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def register_backend(backend):
+    """Add or replace a backend instance under backend.name."""
+    with _registry_lock:
+        _registry[backend.name] = backend
+    return backend
+
+
+def get_backend(name):
+    with _registry_lock:
+        backend = _registry.get(name)
+    if backend is None:
+        raise BackendUnavailable(f"Unknown TTS backend {name!r}")
+    return backend
+
+
+def backends():
+    with _registry_lock:
+        return list(_registry.values())
+
+
+def select_backend(lang, require=(), exclude=()):
+    """
+    Fastest available backend for lang, preferring ones with every
+    capability named in require and skipping recently failed ones and
+    those named in exclude.
+    """
+    candidates = [b for b in backends() if b.name not in exclude and b.available() and b.supports(lang)]
+    if not candidates:
+        raise BackendUnavailable(f"No TTS backend available for language {lang!r}")
+    healthy = [b for b in candidates if not b.cooling_down()] or candidates
+    preferred = [b for b in healthy if all(b.capabilities.get(c) for c in require)] or healthy
+    return min(preferred, key=lambda b: b.speed())
+
+
+for _backend in (GTTSBackend(), Pyttsx3Backend(), HTTPBackend()):
+    register_backend(_backend)
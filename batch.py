@@ -0,0 +1,185 @@
+"""
+Headless batch conversion.
+
+Runs the same synthesis path as the Streamlit app without importing
+streamlit, for converting large numbers of texts or files unattended.
+
+Manifest: JSON Lines (.jsonl) or CSV with one item per row. Fields:
+    id          output name (default: item_<row number>)
+    text        text to convert, or
+    file        path to a .txt/.pdf/.docx file (relative to the manifest)
+    engine      'gtts' (default), 'pyttsx3', 'http' or 'auto' for the fastest
+                backend available for lang
+    lang        language code (default 'en')
+    slow        slow mode where the backend supports it (default false)
+    voice_type  pyttsx3 voice type (default 'normal')
+    gender      pyttsx3 voice gender (default 'female')
+    format      'mp3', 'ogg' (Opus) or 'wav' (default: the engine's own)
+    bitrate     kbit/s for mp3/ogg
+    sample_rate output sample rate in Hz
+
+Finished items are logged to progress.jsonl in the output directory, and a
+re-run skips them unless --no-resume is given.
+
+    python batch.py scripts.jsonl -o out/ --workers 8
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from chunking import detect_format, stream_segments
+from extraction import iter_segments
+from synthesis import synthesizer
+
+BATCH_WORKERS = int(os.environ.get('VOICECRAFT_BATCH_WORKERS', '4'))
+PROGRESS_FILE = 'progress.jsonl'
+
+_unsafe = re.compile(r'[^A-Za-z0-9._-]+')
+
+
+def load_manifest(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    base = os.path.dirname(os.path.abspath(path))
+    items = []
+    for i, row in enumerate(rows, 1):
+        item = {k: v for k, v in row.items() if v not in (None, '')}
+        item['id'] = _unsafe.sub('_', str(item.get('id') or f"item_{i:06d}"))
+        if 'file' in item:
+            item['file'] = os.path.join(base, item['file'])
+        elif 'text' not in item:
+            raise ValueError(f"Manifest row {i} needs 'text' or 'file'")
+        items.append(item)
+    return items
+
+
+def _synthesizer(item):
+    engine = item.get('engine', 'gtts')
+    synthesize, _, finish = synthesizer(
+        lang=item.get('lang', 'en'),
+        backend=None if engine == 'auto' else engine,
+        slow=str(item.get('slow', '')).lower() in ('1', 'true', 'yes'),
+        voice_type=item.get('voice_type', 'normal').lower(),
+        gender=item.get('gender', 'female').lower(),
+        fmt=item.get('format'),
+        bitrate=int(item['bitrate']) if item.get('bitrate') else None,
+        sample_rate=int(item['sample_rate']) if item.get('sample_rate') else None,
+    )
+    return synthesize, finish
+
+
+def convert_item(item, output_dir):
+    """Synthesize one manifest item and return the path of the written file."""
+    if 'file' in item:
+        f = open(item['file'], 'rb')
+        segments = iter_segments(f, item['file'])
+    else:
+        f = None
+        segments = [item['text']]
+    try:
+        synthesize, finish = _synthesizer(item)
+        parts = [data for _, _, data in stream_segments(segments, synthesize)]
+    finally:
+        if f is not None:
+            f.close()
+    audio = finish(parts)
+    path = os.path.join(output_dir, f"{item['id']}.{detect_format(audio) or 'mp3'}")
+    tmp = path + '.part'
+    with open(tmp, 'wb') as out:
+        out.write(audio)
+    os.replace(tmp, path)
+    return path
+
+
+class Progress:
+    """Append-only log of finished items, safe to share between workers."""
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, PROGRESS_FILE)
+        self._lock = threading.Lock()
+
+    def completed(self):
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line from an interrupted run
+                    continue
+                if record.get('status') == 'done' and os.path.exists(record.get('output', '')):
+                    done.add(record['id'])
+        return done
+
+    def log(self, **record):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+
+
+def convert_manifest(items, output_dir, workers=BATCH_WORKERS, resume=True, on_item=None):
+    """
+    Convert manifest items (see load_manifest) into output_dir.
+
+    Returns a summary dict; on_item(record) is called after each item.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    progress = Progress(output_dir)
+    skip = progress.completed() if resume else set()
+    todo = [item for item in items if item['id'] not in skip]
+    summary = {'total': len(items), 'skipped': len(items) - len(todo), 'done': 0, 'failed': 0}
+
+    def run(item):
+        started = time.perf_counter()
+        try:
+            output = convert_item(item, output_dir)
+        except Exception as e:
+            return {'id': item['id'], 'status': 'failed', 'error': str(e)}
+        return {'id': item['id'], 'status': 'done', 'output': output,
+                'seconds': round(time.perf_counter() - started, 3)}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tts-batch') as executor:
+        for future in as_completed([executor.submit(run, item) for item in todo]):
+            record = future.result()
+            progress.log(**record)
+            summary[record['status']] += 1
+            if on_item:
+                on_item(record)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a manifest of texts/files to speech.")
+    parser.add_argument('manifest', help="JSON Lines or CSV manifest")
+    parser.add_argument('-o', '--output-dir', required=True)
+    parser.add_argument('-w', '--workers', type=int, default=BATCH_WORKERS)
+    parser.add_argument('--no-resume', action='store_true', help="redo items already marked done")
+    args = parser.parse_args(argv)
+
+    items = load_manifest(args.manifest)
+
+    def report(record):
+        if record['status'] == 'done':
+            print(f"✓ {record['id']} -> {record['output']} ({record['seconds']}s)")
+        else:
+            print(f"✗ {record['id']}: {record['error']}", file=sys.stderr)
+
+    summary = convert_manifest(items, args.output_dir, workers=args.workers,
+                               resume=not args.no_resume, on_item=report)
+    print(json.dumps(summary))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""
+Offline benchmark for the synthesis and persistence hot paths.
+
+gTTS requests go to a local mock endpoint (benchmarks/mock_gtts.py, no
+network) through the real pooled transport, and pyttsx3 is replaced with
+a fake driver, both with a configurable simulated cost, so numbers are
+reproducible on any machine. For every scenario, text size and worker
+count it reports p50/p95/p99 latency, jobs/sec and peak RSS, and writes
+everything to JSON so two runs can be diffed:
+
+    python benchmarks/bench_synthesis.py -o before.json
+    python benchmarks/bench_synthesis.py -o after.json
+    python benchmarks/bench_synthesis.py --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_engine import FakeEngine  # noqa: E402
+
+DEFAULT_SIZES = [100, 1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_WORKERS = [1, 4, 8]
+SCENARIOS = ('gtts', 'pyttsx3', 'user_store')
+
+WORDS = ("the quick brown fox jumps over a lazy dog while voices read long "
+         "passages of text aloud for listeners everywhere").split()
+
+
+def install_stubs(args):
+    # Must happen before synthesis/engine_pool import the real modules
+    sys.modules['pyttsx3'] = types.SimpleNamespace(Engine=FakeEngine)
+
+    import audio_cache
+    import engine_pool
+    import gtts_transport
+    from mock_gtts import serve
+    _, endpoint = serve(latency=args.gtts_latency)
+    gtts_transport._transport = gtts_transport.GTTSTransport(endpoint=endpoint)
+    # Measure synthesis, not cache hits
+    audio_cache._cache = audio_cache.AudioCache(directory=None, memory_budget=0)
+    # The drivers run in spawned processes, so they get the fake as their factory
+    engine_pool._pool = engine_pool.EnginePool(size=args.pool_size, queue_size=1024,
+                                               engine_factory=partial(FakeEngine, args.pyttsx3_cps))
+
+
+def make_text(size, seed):
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        if rng.random() < 0.08:
+            word += '.'
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its own high-water mark
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def synthesis_job(scenario):
+    from chunking import synthesize_long_text
+    from synthesis import text_to_speech, text_to_speech_advanced
+
+    if scenario == 'gtts':
+        synthesize = lambda chunk: text_to_speech(chunk, 'en')
+    else:
+        synthesize = lambda chunk: text_to_speech_advanced(chunk, voice_type='normal', gender='female')
+
+    def job(text):
+        buffer, error = synthesize_long_text(text, synthesize)
+        if error:
+            raise RuntimeError(error)
+        return len(buffer.getvalue())
+    return job
+
+
+def user_store_job(directory):
+    from user_store import UserStore
+
+    store = UserStore(os.path.join(directory, 'bench_users.db'))
+    counter = iter(range(10 ** 9))
+    lock = threading.Lock()
+
+    def job(text):
+        with lock:
+            n = next(counter)
+        username = f"user{n}"
+        store.create(username, {'password': text[:64], 'name': username, 'created_at': 'now'})
+        store.get(username)
+        store.increment(username)
+        return 0
+    return job
+
+
+def run_config(job, size, workers, jobs, seed):
+    texts = [make_text(size, seed + i) for i in range(jobs)]
+    latencies = []
+    lock = threading.Lock()
+
+    def timed(text):
+        started = time.perf_counter()
+        job(text)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+
+    rss_reset = reset_peak_rss()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(timed, texts))
+    wall = time.perf_counter() - started
+    return {
+        'text_chars': size,
+        'workers': workers,
+        'jobs': jobs,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'jobs_per_sec': jobs / wall,
+        'chars_per_sec': jobs * size / wall,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'peak_rss_is_per_config': rss_reset,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    install_stubs(args)
+    workdir = tempfile.mkdtemp(prefix='voicecraft-bench-')
+    results = []
+    try:
+        for scenario in args.scenarios:
+            job = user_store_job(workdir) if scenario == 'user_store' else synthesis_job(scenario)
+            sizes = [100] if scenario == 'user_store' else args.sizes
+            for size in sizes:
+                # Keep big texts from making the whole run take hours
+                jobs = args.jobs or max(4, min(200, 200_000 // max(size, 1)))
+                for workers in args.workers:
+                    result = run_config(job, size, workers, jobs, args.seed)
+                    result['scenario'] = scenario
+                    results.append(result)
+                    print(f"{scenario:<10} {size:>9,} chars  {workers:>2} workers  "
+                          f"p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+                          f"p99 {result['p99_ms']:9.2f} ms  {result['jobs_per_sec']:9.1f} jobs/s  "
+                          f"rss {result['peak_rss_bytes'] / 1_048_576:7.1f} MiB", flush=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        },
+        'results': results,
+    }
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = {(r['scenario'], r['text_chars'], r['workers']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    print(f"{'scenario':<10} {'chars':>9} {'wk':>3} {'p50 Δ':>9} {'p95 Δ':>9} {'p99 Δ':>9} {'jobs/s Δ':>9}")
+    for r in new:
+        before = old.get((r['scenario'], r['text_chars'], r['workers']))
+        if before is None:
+            continue
+        deltas = [(r[m] - before[m]) / before[m] * 100 if before[m] else 0.0
+                  for m in ('p50_ms', 'p95_ms', 'p99_ms', 'jobs_per_sec')]
+        print(f"{r['scenario']:<10} {r['text_chars']:>9,} {r['workers']:>3} "
+              + ' '.join(f"{d:>+8.1f}%" for d in deltas))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline synthesis benchmark.")
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--workers', nargs='+', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--jobs', type=int, default=0, help="jobs per configuration (default: scaled by size)")
+    parser.add_argument('--pool-size', type=int, default=4, help="pyttsx3 engine pool size")
+    parser.add_argument('--gtts-latency', type=float, default=0.005,
+                        help="simulated seconds per mock gTTS request (100-char token)")
+    parser.add_argument('--pyttsx3-cps', type=float, default=200_000,
+                        help="simulated pyttsx3 speed in characters/second (0 = instant)")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    report = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
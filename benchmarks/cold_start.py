@@ -0,0 +1,115 @@
+"""
+Import and cold-start budget for app.py.
+
+Every measurement runs in a fresh interpreter, in a scratch directory, so
+nothing is already imported or cached:
+
+    import   the app's own modules on top of streamlit (what app.py adds
+             to a server's start-up); none of the engines or numpy may
+             be loaded
+    first    AppTest's first run of app.py, i.e. the login page a new
+             visitor gets from a freshly started server
+    rerun    the median of the following reruns
+    css      bytes of stylesheet markup sent with every rerun
+
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --import-budget 30 --first-budget 1500 --runs 5
+
+Exits non-zero when a budget is exceeded or a heavy module is imported
+eagerly.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_MODULES = ('extraction', 'history_store', 'jobs', 'metrics', 'auth', 'audio_formats', 'backends',
+               'state', 'synthesis', 'usage_stats', 'user_store')
+# Only needed once something is synthesized (or by the background warm-up)
+LAZY_MODULES = ('numpy', 'gtts', 'pyttsx3', 'requests', 'redis', 'audio_effects', 'engine_pool',
+                'gtts_transport')
+
+IMPORT_PROBE = """
+import json, sys, time
+import streamlit
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - started
+print(json.dumps({{'ms': elapsed * 1000, 'loaded': [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+APP_PROBE = """
+import json, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=60)
+started = time.perf_counter()
+at.run()
+first = time.perf_counter() - started
+reruns = []
+for _ in range({reruns}):
+    started = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - started)
+css = sum(len(e.proto.body) for e in at.get('html') if '<style' in e.proto.body or '@import' in e.proto.body)
+print(json.dumps({{'first_ms': first * 1000, 'rerun_ms': [r * 1000 for r in reruns], 'css_bytes': css,
+                  'errors': [str(e.value) for e in at.exception]}}))
+"""
+
+
+def probe(code):
+    with tempfile.TemporaryDirectory() as scratch:
+        # The app's databases and caches go to the scratch directory, so
+        # it gets the repo's Streamlit config too
+        shutil.copytree(os.path.join(ROOT, '.streamlit'), os.path.join(scratch, '.streamlit'))
+        result = subprocess.run([sys.executable, '-c', code], cwd=scratch, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import and cold-start budget for app.py.")
+    parser.add_argument('--runs', type=int, default=3, help="fresh interpreters per measurement")
+    parser.add_argument('--reruns', type=int, default=5, help="reruns measured after each first run")
+    parser.add_argument('--import-budget', type=float, default=50, help="ms for the app's own modules")
+    parser.add_argument('--first-budget', type=float, default=1000, help="ms for the first run")
+    parser.add_argument('--rerun-budget', type=float, default=100, help="ms per rerun")
+    parser.add_argument('--css-budget', type=int, default=200, help="stylesheet bytes per rerun")
+    args = parser.parse_args(argv)
+
+    imports = [probe(IMPORT_PROBE.format(root=ROOT, modules=APP_MODULES, lazy=LAZY_MODULES))
+               for _ in range(args.runs)]
+    apps = [probe(APP_PROBE.format(app=os.path.join(ROOT, 'app.py'), reruns=args.reruns))
+            for _ in range(args.runs)]
+    for app in apps:
+        if app['errors']:
+            raise RuntimeError(f"app.py raised: {app['errors']}")
+
+    loaded = sorted({m for run in imports for m in run['loaded']})
+    results = [
+        ('import', statistics.median(r['ms'] for r in imports), args.import_budget, 'ms'),
+        ('first', statistics.median(a['first_ms'] for a in apps), args.first_budget, 'ms'),
+        ('rerun', statistics.median(ms for a in apps for ms in a['rerun_ms']), args.rerun_budget, 'ms'),
+        ('css', max(a['css_bytes'] for a in apps), args.css_budget, 'bytes'),
+    ]
+    failed = bool(loaded)
+    print(f"{'measure':<8} {'value':>10} {'budget':>10}")
+    for name, value, budget, unit in results:
+        over = value > budget
+        failed |= over
+        print(f"{name:<8} {value:>10.1f} {budget:>10.1f} {unit}{'  OVER BUDGET' if over else ''}")
+    if loaded:
+        print(f"imported eagerly: {', '.join(loaded)}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+Compare the per-rerun websocket payload of the old base64 data-URI download
+link with the deferred st.download_button that replaced it.
+
+    python benchmarks/download_payload.py --audio-bytes 1048576
+"""
+import argparse
+import base64
+import json
+import os
+import uuid
+
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+
+def legacy_link_msg(audio, filename):
+    # Byte-for-byte what get_audio_download_link used to emit
+    b64 = base64.b64encode(audio).decode()
+    href = f'<a href="data:audio/mp3;base64,{b64}" download="{filename}.mp3" style="text-decoration:none;">'
+    href += f'<button style="background:linear-gradient(135deg, #11998e 0%, #38ef7d 100%);color:white;padding:10px 20px;border:none;border-radius:8px;cursor:pointer;width:100%;">⬇️ Download Audio</button></a>'
+    msg = ForwardMsg()
+    msg.delta.new_element.markdown.body = href
+    msg.delta.new_element.markdown.allow_html = True
+    return msg
+
+
+def download_button_msg(filename):
+    # Deferred buttons only carry an id; the file is fetched over HTTP on click
+    msg = ForwardMsg()
+    button = msg.delta.new_element.download_button
+    button.id = f"$$ID-{uuid.uuid4().hex}-None"
+    button.label = "⬇️ Download Audio"
+    button.deferred_file_id = uuid.uuid4().hex
+    return msg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--audio-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--reruns', type=int, default=10)
+    args = parser.parse_args()
+
+    audio = os.urandom(args.audio_bytes)
+    before = legacy_link_msg(audio, 'voicecraft_sample').ByteSize()
+    after = download_button_msg('voicecraft_sample').ByteSize()
+    print(json.dumps({
+        'audio_bytes': args.audio_bytes,
+        'per_rerun_bytes_before': before,
+        'per_rerun_bytes_after': after,
+        'reruns': args.reruns,
+        'total_bytes_before': before * args.reruns,
+        # The audio itself crosses the wire once, when Download is clicked
+        'total_bytes_after': after * args.reruns + args.audio_bytes,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
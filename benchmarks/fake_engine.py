@@ -0,0 +1,40 @@
+"""
+Stand-in for pyttsx3.Engine for the offline benchmarks.
+
+It lives in its own module, not in a script's __main__, because the engine
+pool builds its drivers in spawned processes: the factory has to be
+importable there.
+"""
+import time
+import types
+import wave
+
+
+class FakeEngine:
+    """Drop-in for pyttsx3.Engine writing silent WAV proportional to the text."""
+
+    def __init__(self, chars_per_second=0.0):
+        self.chars_per_second = chars_per_second
+        voices = [types.SimpleNamespace(id='male'), types.SimpleNamespace(id='female')]
+        self.props = {'voices': voices, 'voice': 'male', 'rate': 200, 'volume': 1.0}
+        self.queue = []
+
+    def getProperty(self, name):
+        return self.props[name]
+
+    def setProperty(self, name, value):
+        self.props[name] = value
+
+    def save_to_file(self, text, path):
+        self.queue.append((text, path))
+
+    def runAndWait(self):
+        for text, path in self.queue:
+            if self.chars_per_second:
+                time.sleep(len(text) / self.chars_per_second)
+            with wave.open(path, 'wb') as w:
+                w.setnchannels(1)
+                w.setsampwidth(2)
+                w.setframerate(16000)
+                w.writeframes(b'\0\0' * (len(text) * 8))
+        self.queue = []
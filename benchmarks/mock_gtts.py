@@ -0,0 +1,113 @@
+"""
+Local stand-in for Google's batchexecute TTS endpoint.
+
+Answers the requests gTTS prepares with a response in the same framing,
+carrying one fake MP3 frame per fragment, so the gTTS transport can be
+exercised and benchmarked without network access:
+
+    python benchmarks/mock_gtts.py --port 8765 --latency 0.05 --fail-rate 0.1
+    VOICECRAFT_GTTS_ENDPOINT=http://127.0.0.1:8765/ streamlit run app.py
+
+Tests can also queue exact error replies on the server returned by serve():
+server.failures.append((429, '2')) answers the next request with a 429 and
+Retry-After: 2.
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+def fake_frame(text):
+    # One 417-byte MPEG-1 Layer III frame header plus the text as padding
+    return b'\xff\xfb\x90\x64' + text.encode('utf-8')[:413].ljust(413, b'\0')
+
+
+def parse_fragment(body):
+    """(text, lang, slow) from a batchexecute form body built by gTTS."""
+    rpc = json.loads(parse_qs(body)['f.req'][0])
+    text, lang, speed, _ = json.loads(rpc[0][0][1])
+    return text, lang, bool(speed)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.0
+    jitter = 0.0
+    fail_rate = 0.0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            failure = server.failures.popleft() if server.failures else None
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        if failure is not None:
+            status, retry_after = failure
+            self._reply(status, b'try again', {'Retry-After': retry_after} if retry_after is not None else {})
+            return
+        if self.fail_rate and random.random() < self.fail_rate:
+            self._reply(503, b'try again')
+            return
+        text, _, _ = parse_fragment(body)
+        audio = base64.b64encode(fake_frame(text)).decode('ascii')
+        payload = f')]}}\'\n\n123\n[["wrb.fr","jQ1olc","[\\"{audio}\\"]",null,null,null,"generic"]]\n'
+        self._reply(200, payload.encode('utf-8'))
+
+    def _reply(self, status, data, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0, jitter=0.0):
+    """
+    Start the mock on a daemon thread; returns (server, endpoint_url). Each
+    request takes latency plus up to jitter seconds.
+    """
+    handler = type('Handler', (MockHandler,), {'latency': latency, 'jitter': jitter, 'fail_rate': fail_rate})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.failures = deque()
+    server.requests = 0
+    server.connections = set()
+    threading.Thread(target=server.serve_forever, name='mock-gtts', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock Google TTS endpoint.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds per request")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many more seconds per request")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of requests answered 503")
+    args = parser.parse_args(argv)
+    server, url = serve(args.host, args.port, args.latency, args.fail_rate, args.jitter)
+    print(f"mock gTTS endpoint at {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
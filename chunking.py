@@ -0,0 +1,271 @@
+"""
+Split long text at sentence/clause boundaries, synthesize the pieces
+concurrently and stitch the audio back together in order.
+
+Chunks from every conversion share one bounded pool. Each conversion only
+keeps a small window of chunks queued, and queued chunks run lowest
+priority first: a job's chunks carry the job's aged cost (see
+jobs.JobManager and job_priority), so a short job's few chunks start
+ahead of a long document's backlog instead of behind it.
+"""
+import heapq
+import io
+import os
+import re
+import threading
+import time
+import wave
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+CHUNK_CHARS = int(os.environ.get('VOICECRAFT_CHUNK_CHARS', '400'))
+CHUNK_WORKERS = int(os.environ.get('VOICECRAFT_CHUNK_WORKERS', str(min(8, (os.cpu_count() or 1) * 2))))
+
+_sentence_end = re.compile(r'(?<=[.!?…])\s+|(?<=[。！？])|\n\s*\n')
+_clause_end = re.compile(r'(?<=[,;:،、，；])\s*')
+
+
+def _pieces(text, max_chars):
+    """Yield pieces no longer than max_chars, preferring natural boundaries."""
+    for sentence in _sentence_end.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            yield sentence
+            continue
+        for clause in _clause_end.split(sentence):
+            clause = clause.strip()
+            while len(clause) > max_chars:
+                # Fall back to the last space, then to a hard cut
+                cut = clause.rfind(' ', 0, max_chars)
+                if cut <= 0:
+                    cut = max_chars
+                yield clause[:cut].strip()
+                clause = clause[cut:].strip()
+            if clause:
+                yield clause
+
+
+def iter_chunks(segments, max_chars=CHUNK_CHARS):
+    """Pack consecutive sentences from segments into chunks of at most max_chars."""
+    current = ''
+    for segment in segments:
+        for piece in _pieces(segment, max_chars):
+            if current and len(current) + 1 + len(piece) > max_chars:
+                yield current
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+    if current:
+        yield current
+
+
+def split_text(text, max_chars=CHUNK_CHARS):
+    return list(iter_chunks([text], max_chars))
+
+
+def split_sentences(text, max_chars=CHUNK_CHARS):
+    """Sentences (or clauses, for long ones) of text, unpacked."""
+    return list(_pieces(text, max_chars))
+
+
+def detect_format(data):
+    if data[:4] == b'RIFF' and data[8:12] == b'WAVE':
+        return 'wav'
+    if data[:4] == b'OggS':
+        return 'ogg'
+    if data[:4] == b'FORM' and data[8:12] in (b'AIFF', b'AIFC'):
+        return 'aiff'
+    if data[:4] == b'fLaC':
+        return 'flac'
+    if data[:3] == b'ID3' or (len(data) > 1 and data[0] == 0xFF and data[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    return None
+
+
+def _strip_id3(data):
+    # ID3v2 header at the front
+    if data[:3] == b'ID3' and len(data) >= 10:
+        size = ((data[6] & 0x7F) << 21) | ((data[7] & 0x7F) << 14) | ((data[8] & 0x7F) << 7) | (data[9] & 0x7F)
+        data = data[10 + size:]
+    # ID3v1 tag at the back
+    if len(data) >= 128 and data[-128:-125] == b'TAG':
+        data = data[:-128]
+    return data
+
+
+def stitch(parts):
+    """Join same-format audio segments into one MP3 or WAV stream."""
+    if len(parts) == 1:
+        return parts[0]
+    formats = {detect_format(p) for p in parts}
+    if formats == {'mp3'}:
+        # MP3 is a sequence of self-contained frames, so joining is concatenation
+        return b''.join(_strip_id3(p) for p in parts)
+    if formats == {'wav'}:
+        out = io.BytesIO()
+        writer = None
+        for part in parts:
+            with wave.open(io.BytesIO(part), 'rb') as reader:
+                if writer is None:
+                    writer = wave.open(out, 'wb')
+                    writer.setparams(reader.getparams())
+                writer.writeframesraw(reader.readframes(reader.getnframes()))
+        writer.close()
+        return out.getvalue()
+    raise ValueError(f"Cannot stitch audio formats {sorted(map(str, formats))}")
+
+
+_local = threading.local()
+
+
+@contextmanager
+def job_priority(priority):
+    """Queue work this thread submits to the chunk pool at priority (lower runs first)."""
+    previous = getattr(_local, 'priority', None)
+    _local.priority = priority
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def current_priority():
+    # Outside a job, work queues like a zero-cost job submitted just now
+    priority = getattr(_local, 'priority', None)
+    return time.monotonic() if priority is None else priority
+
+
+class PriorityExecutor:
+    """
+    Thread pool whose queued calls run lowest priority first, in submission
+    order among equals. Calls take the submitting thread's job_priority.
+    """
+
+    def __init__(self, max_workers, thread_name_prefix='tts-chunk'):
+        # (priority, sequence, future, fn, args)
+        self._queue = []
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        for i in range(max(1, max_workers)):
+            threading.Thread(target=self._worker, name=f"{thread_name_prefix}-{i}", daemon=True).start()
+
+    def submit(self, fn, *args):
+        future = Future()
+        priority = current_priority()
+        with self._lock:
+            heapq.heappush(self._queue, (priority, self._sequence, future, fn, args))
+            self._sequence += 1
+            self._ready.notify()
+        return future
+
+    def map(self, fn, iterable):
+        futures = [self.submit(fn, item) for item in iterable]
+        return (future.result() for future in futures)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._ready.wait()
+                _, _, future, fn, args = heapq.heappop(self._queue)
+            # Skips chunks whose stream was closed while they waited
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = PriorityExecutor(CHUNK_WORKERS, thread_name_prefix='tts-chunk')
+        return _executor
+
+
+class SynthesisError(Exception):
+    pass
+
+
+def _stream_chunks(chunks, synthesize, total, window):
+    executor = get_executor()
+    in_flight = deque()
+    chunks = iter(chunks)
+    index = 0
+    try:
+        while True:
+            # Keep at most `window` chunks queued ahead of the consumer
+            while len(in_flight) < window:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                in_flight.append(executor.submit(synthesize, chunk))
+            if not in_flight:
+                break
+            buffer, error = in_flight.popleft().result()
+            if error:
+                raise SynthesisError(error)
+            yield index, total, buffer.getvalue()
+            index += 1
+        if index == 0:
+            raise SynthesisError("Nothing to synthesize")
+    finally:
+        # Abandoned or failed streams shouldn't keep the pool busy
+        for future in in_flight:
+            future.cancel()
+
+
+def stream_long_text(text, synthesize, max_chars=CHUNK_CHARS):
+    """
+    Yield (index, total, audio_bytes) for each chunk, in order, as soon as
+    that chunk and all the ones before it are ready.
+
+    Later chunks keep synthesizing in the background while earlier ones are
+    consumed. Raises SynthesisError on the first failed chunk.
+    """
+    return stream_chunks(split_text(text, max_chars), synthesize)
+
+
+def stream_chunks(chunks, synthesize, window=None):
+    """Like stream_long_text, for text that has already been split."""
+    chunks = list(chunks)
+    return _stream_chunks(chunks, synthesize, len(chunks), window=window or CHUNK_WORKERS * 2)
+
+
+def stream_segments(segments, synthesize, max_chars=CHUNK_CHARS, window=None):
+    """
+    Like stream_long_text, but for a lazy iterable of text segments (pages,
+    paragraphs). Only a bounded window of chunks is read ahead, and total
+    is None because the length isn't known up front.
+    """
+    return _stream_chunks(iter_chunks(segments, max_chars), synthesize, None, window=window or CHUNK_WORKERS * 2)
+
+
+def synthesize_long_text(text, synthesize, max_chars=CHUNK_CHARS, progress=None):
+    """
+    Synthesize text of any length with synthesize(chunk) -> (buffer, error).
+
+    Chunks run concurrently on a shared bounded pool; progress(done, total)
+    is called from the caller's thread as results arrive in order.
+    """
+    parts = []
+    try:
+        for i, total, data in stream_long_text(text, synthesize, max_chars):
+            parts.append(data)
+            if progress:
+                progress(i + 1, total)
+        return io.BytesIO(stitch(parts)), None
+    except Exception as e:
+        return None, str(e)
@@ -0,0 +1,284 @@
+"""
+Long-lived pool of pre-initialized pyttsx3 engines.
+
+Each worker thread owns one driver process for its whole lifetime, so the
+cost of pyttsx3 start-up and voice enumeration is paid once instead of per
+request. The drivers can't share a process: eSpeak, the default on Linux,
+is initialised once per process, delivers all audio to the callback of
+the driver built last, and keeps voice, rate and volume globally. In a
+process of its own each driver's state is really its own, so properties
+are only re-applied when they change, and a hung driver can be killed.
+"""
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+from audio_output import OutputTarget
+from metrics import register_collector, span
+
+POOL_SIZE = int(os.environ.get('VOICECRAFT_ENGINE_POOL_SIZE', '2'))
+QUEUE_SIZE = int(os.environ.get('VOICECRAFT_ENGINE_QUEUE_SIZE', '32'))
+JOB_TIMEOUT = float(os.environ.get('VOICECRAFT_ENGINE_JOB_TIMEOUT', '120'))
+
+# (rate, volume) per voice type
+VOICE_PRESETS = {
+    'normal': (125, 0.95),
+    'angry': (150, 1.0),        # Faster, more aggressive
+    'kind': (110, 0.9),         # Slower, gentler
+    'exclamation': (140, 1.0),  # Fast and excited
+    'question': (115, 0.95),    # Slightly slower for clarity
+    'whisper': (100, 0.6),
+}
+
+
+class PoolBusy(Exception):
+    pass
+
+
+def select_voice(voices, gender):
+    if not voices:
+        return None
+    # Usually the first voice is male, second is female (varies by system)
+    if gender == 'male':
+        return voices[0]
+    return voices[1] if len(voices) > 1 else voices[0]
+
+
+def default_engine():
+    import pyttsx3
+    # pyttsx3.init() hands out one shared engine per driver, so build a
+    # private instance directly
+    return pyttsx3.Engine()
+
+
+def configure(engine, voices, applied, voice_type, gender):
+    """Apply the preset for voice_type and gender; returns what is now applied."""
+    rate, volume = VOICE_PRESETS.get(voice_type, VOICE_PRESETS['normal'])
+    wanted = (select_voice(voices, gender), rate, volume)
+    # Only touch the driver for properties that actually changed
+    previous = applied or (None, None, None)
+    if wanted[0] is not None and wanted[0] != previous[0]:
+        engine.setProperty('voice', wanted[0])
+    if rate != previous[1]:
+        engine.setProperty('rate', rate)
+    if volume != previous[2]:
+        engine.setProperty('volume', volume)
+    return wanted
+
+
+def serve(conn, engine_factory=default_engine):
+    """
+    Body of a driver process: build one engine, report its voices, then
+    render (text, voice_type, gender) requests from conn until the parent
+    closes it. Replies are (ok, audio or error message, voices or None). A
+    failed render ends the process, since the driver's state is unknown.
+    """
+    if sys.platform == 'win32':
+        # SAPI5 is COM based and needs COM initialised
+        import comtypes
+        comtypes.CoInitialize()
+    try:
+        engine = engine_factory()
+        voices = [v.id for v in engine.getProperty('voices')]
+    except Exception as e:
+        conn.send((False, str(e), None))
+        return
+    conn.send((True, None, voices))
+    applied = None
+    while True:
+        try:
+            text, voice_type, gender = conn.recv()
+        except EOFError:
+            return
+        try:
+            applied = configure(engine, voices, applied, voice_type, gender)
+            with OutputTarget() as target:
+                engine.save_to_file(text, target.path)
+                engine.runAndWait()
+                data = target.read()
+        except Exception as e:
+            conn.send((False, str(e), None))
+            return
+        conn.send((True, data, None))
+
+
+class EngineWorker(threading.Thread):
+    def __init__(self, pool, index):
+        super().__init__(name=f"pyttsx3-worker-{index}", daemon=True)
+        self.pool = pool
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.restarts = 0
+        self.busy_since = None
+
+    def _receive(self):
+        try:
+            ok, result, voices = self.conn.recv()
+        except (EOFError, OSError):
+            raise RuntimeError("The speech engine stopped unexpectedly") from None
+        if voices is not None:
+            self.pool.set_voices(voices)
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def start_engine(self):
+        # spawn, not fork: the parent has threads (and maybe a driver) already
+        context = multiprocessing.get_context('spawn')
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=serve, args=(child_conn, self.pool.engine_factory),
+                                  name=f"pyttsx3-driver-{self.index}", daemon=True)
+        with span('engine_init', engine='pyttsx3'):
+            process.start()
+            child_conn.close()
+            self.process, self.conn = process, conn
+            self._receive()
+
+    def stop_engine(self):
+        process, conn = self.process, self.conn
+        self.process = self.conn = None
+        if process is not None:
+            process.kill()
+            process.join(timeout=5)
+        if conn is not None:
+            conn.close()
+
+    def kill(self):
+        """Kill the driver process from another thread; the job running on it fails."""
+        process = self.process
+        if process is not None:
+            process.kill()
+
+    def ensure_engine(self):
+        if self.process is not None and not self.process.is_alive():
+            self.stop_engine()
+        if self.process is None:
+            self.start_engine()
+
+    def render(self, text, voice_type, gender):
+        self.ensure_engine()
+        with span('run_and_wait', engine='pyttsx3', voice_type=voice_type):
+            self.conn.send((text, voice_type, gender))
+            data = self._receive()
+        if not data:
+            raise RuntimeError("Could not generate audio")
+        return data
+
+    def run(self):
+        try:
+            while True:
+                job = self.pool.jobs.get()
+                if job is None:
+                    break
+                future, args = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.busy_since = time.monotonic()
+                try:
+                    # No arguments: a warm-up job that only starts the driver
+                    result = self.render(*args) if args else self.ensure_engine()
+                except BaseException as e:
+                    # Treat any failure as a broken driver and rebuild it lazily
+                    self.stop_engine()
+                    self.restarts += 1
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+                finally:
+                    self.busy_since = None
+        finally:
+            self.stop_engine()
+
+
+class EnginePool:
+    def __init__(self, size=POOL_SIZE, queue_size=QUEUE_SIZE, job_timeout=JOB_TIMEOUT,
+                 engine_factory=default_engine):
+        self.size = max(1, size)
+        self.job_timeout = job_timeout
+        # Called in each driver process, so it must be importable there
+        self.engine_factory = engine_factory
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.voices = None
+        self._lock = threading.Lock()
+        self.workers = [self._spawn(i) for i in range(self.size)]
+
+    def _spawn(self, index):
+        worker = EngineWorker(self, index)
+        worker.start()
+        return worker
+
+    def set_voices(self, voices):
+        # The installed voices don't change while the process runs
+        if self.voices is None:
+            self.voices = voices
+
+    def health_check(self):
+        """Replace workers whose thread died; kill drivers whose job overran the timeout."""
+        now = time.monotonic()
+        with self._lock:
+            for i, worker in enumerate(self.workers):
+                if not worker.is_alive():
+                    replacement = self._spawn(i)
+                    replacement.restarts = worker.restarts + 1
+                    self.workers[i] = replacement
+                elif worker.busy_since is not None and now - worker.busy_since > self.job_timeout:
+                    worker.kill()
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'queued': self.jobs.qsize(),
+            'busy': sum(1 for w in self.workers if w.busy_since is not None),
+            'restarts': sum(w.restarts for w in self.workers),
+        }
+
+    def submit(self, text, voice_type='normal', gender='female', timeout=1.0):
+        self.health_check()
+        future = Future()
+        try:
+            self.jobs.put((future, (text, voice_type, gender)), timeout=timeout)
+        except queue.Full:
+            raise PoolBusy("Speech engine is busy, please try again in a moment")
+        return future
+
+    def warm_up(self):
+        """Queue one driver start per worker; returns the futures."""
+        futures = []
+        for _ in self.workers:
+            future = Future()
+            try:
+                self.jobs.put_nowait((future, ()))
+            except queue.Full:
+                break
+            futures.append(future)
+        return futures
+
+    def synthesize(self, text, voice_type='normal', gender='female'):
+        return self.submit(text, voice_type, gender).result(timeout=self.job_timeout)
+
+    def shutdown(self):
+        for _ in self.workers:
+            self.jobs.put(None)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_engine_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = EnginePool()
+            register_collector('engine_pool', _collect)
+        return _pool
+
+
+def _collect():
+    for name, value in _pool.stats().items():
+        yield f'voicecraft_engine_pool_{name}', {}, value
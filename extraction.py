@@ -0,0 +1,206 @@
+"""
+Incremental text extraction from uploaded files.
+
+Every extractor returns a lazy iterator of text segments (paragraphs or
+pages), so a long document can be fed to synthesis without ever holding
+all of its text in memory.
+"""
+import codecs
+import re
+import zipfile
+from xml.etree import ElementTree
+
+READ_SIZE = 64 * 1024
+SNIFF_SIZE = 32 * 1024
+# Characters extracted to estimate a whole file's text length
+ESTIMATE_SAMPLE = 20_000
+
+_paragraph_break = re.compile(r'\n\s*\n')
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def detect_encoding(sample):
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        # A sample cut mid-character is still valid UTF-8 up to the cut
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        from charset_normalizer import from_bytes
+    except ImportError:
+        return 'cp1252'
+    best = from_bytes(sample).best()
+    return best.encoding if best else 'cp1252'
+
+
+def iter_text(fileobj, read_size=READ_SIZE):
+    """Decode a text file chunk by chunk, yielding paragraph-aligned segments."""
+    first = fileobj.read(read_size)
+    encoding = detect_encoding(first[:SNIFF_SIZE])
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    data = first
+    while data:
+        pending += decoder.decode(data)
+        # Hold back the trailing partial paragraph until more text arrives
+        cut = None
+        for match in _paragraph_break.finditer(pending):
+            cut = match.end()
+        if cut is None and len(pending) > 4 * read_size:
+            # No paragraph breaks at all; settle for the last line or space
+            cut = max(pending.rfind('\n'), pending.rfind(' ')) + 1 or len(pending)
+        if cut:
+            yield pending[:cut]
+            pending = pending[cut:]
+        data = fileobj.read(read_size)
+    pending += decoder.decode(b'', final=True)
+    if pending.strip():
+        yield pending
+
+
+def _pdf_reader(fileobj):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ExtractionError("PDF support needs the 'pypdf' package (pip install pypdf)")
+    return PdfReader(fileobj)
+
+
+def iter_pdf(fileobj):
+    """Yield the text of a PDF one page at a time."""
+    reader = _pdf_reader(fileobj)
+    for page in reader.pages:
+        text = page.extract_text() or ''
+        if text.strip():
+            yield text
+
+
+def _docx_archive(fileobj):
+    try:
+        return zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise ExtractionError("Not a valid .docx file")
+
+
+def _docx_paragraphs(xml):
+    parts = []
+    runs = 0
+    for event, elem in ElementTree.iterparse(xml, events=('start', 'end')):
+        if elem.tag == WORD_NS + 'r':
+            runs += 1 if event == 'start' else -1
+        if event == 'start':
+            continue
+        if elem.tag == WORD_NS + 't' and elem.text:
+            parts.append(elem.text)
+        elif elem.tag == WORD_NS + 'tab' and runs:
+            # w:tab is also a tab stop definition in the paragraph's properties
+            parts.append('\t')
+        elif elem.tag in (WORD_NS + 'br', WORD_NS + 'cr'):
+            parts.append('\n')
+        elif elem.tag == WORD_NS + 'p':
+            text = ''.join(parts).strip()
+            parts = []
+            if text:
+                yield text + '\n\n'
+            # Drop finished paragraphs so memory stays flat
+            elem.clear()
+
+
+def iter_docx(fileobj):
+    """Yield a DOCX document's paragraphs, streaming its XML instead of parsing it whole."""
+    archive = _docx_archive(fileobj)
+    with archive, archive.open('word/document.xml') as xml:
+        yield from _docx_paragraphs(xml)
+
+
+EXTRACTORS = {
+    'txt': iter_text,
+    'pdf': iter_pdf,
+    'docx': iter_docx,
+}
+
+
+def iter_segments(fileobj, filename, max_chars=None):
+    """Pick an extractor by file extension; optionally stop after max_chars."""
+    extension = filename.rsplit('.', 1)[-1].lower()
+    extractor = EXTRACTORS.get(extension)
+    if extractor is None:
+        raise ExtractionError(f"Unsupported file type: .{extension}")
+    remaining = max_chars
+    for segment in extractor(fileobj):
+        if remaining is not None:
+            if remaining <= 0:
+                return
+            segment = segment[:remaining]
+            remaining -= len(segment)
+        yield segment
+
+
+def _sample(segments, sample_chars):
+    """(characters, whether segments ran out) after reading about sample_chars."""
+    characters = 0
+    for segment in segments:
+        characters += len(segment)
+        if characters >= sample_chars:
+            return characters, False
+    return characters, True
+
+
+def estimate_characters(fileobj, filename, sample_chars=ESTIMATE_SAMPLE):
+    """
+    Rough length of a file's text without extracting all of it: the text of
+    the first sample_chars or so, scaled by how much of the file (bytes of
+    text or document XML, PDF pages) it came from. Exact for short files.
+    Leaves fileobj rewound.
+    """
+    extension = filename.rsplit('.', 1)[-1].lower()
+    try:
+        if extension == 'txt':
+            size = fileobj.seek(0, 2)
+            fileobj.seek(0)
+            characters, done = _sample(iter_text(fileobj), sample_chars)
+            return characters if done else int(characters * size / max(1, fileobj.tell()))
+        if extension == 'pdf':
+            pages = _pdf_reader(fileobj).pages
+            characters = read = 0
+            for page in pages:
+                characters += len(page.extract_text() or '')
+                read += 1
+                if characters >= sample_chars:
+                    break
+            return int(characters * len(pages) / max(1, read))
+        if extension == 'docx':
+            archive = _docx_archive(fileobj)
+            with archive, archive.open('word/document.xml') as xml:
+                characters, done = _sample(_docx_paragraphs(xml), sample_chars)
+                size = archive.getinfo('word/document.xml').file_size
+                return characters if done else int(characters * size / max(1, xml.tell()))
+        raise ExtractionError(f"Unsupported file type: .{extension}")
+    finally:
+        fileobj.seek(0)
+
+
+def preview_text(fileobj, filename, chars=1000):
+    """First few characters of a file, leaving it rewound for the real pass."""
+    text = ''
+    for segment in iter_segments(fileobj, filename, max_chars=chars):
+        text += segment
+    fileobj.seek(0)
+    return text
@@ -0,0 +1,178 @@
+"""
+Pooled, retrying transport for Google Translate TTS.
+
+gTTS opens a new session for every ~100-character fragment it sends and
+gives up on the first error. Here gTTS is only used to tokenize the text
+and build the requests; they are sent over one long-lived keep-alive
+session, the fragments of a text are fetched concurrently, transient
+failures are retried with jittered exponential backoff, and identical
+requests that are already in flight share a single upstream call.
+
+VOICECRAFT_GTTS_ENDPOINT points the transport at another batchexecute URL
+(a proxy, or the mock in benchmarks/mock_gtts.py).
+"""
+import base64
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import register_collector
+
+ENDPOINT = os.environ.get('VOICECRAFT_GTTS_ENDPOINT', '')
+POOL_SIZE = int(os.environ.get('VOICECRAFT_GTTS_POOL_SIZE', '16'))
+FRAGMENT_WORKERS = int(os.environ.get('VOICECRAFT_GTTS_FRAGMENT_WORKERS', '8'))
+RETRIES = int(os.environ.get('VOICECRAFT_GTTS_RETRIES', '3'))
+BACKOFF = float(os.environ.get('VOICECRAFT_GTTS_BACKOFF', '0.5'))
+BACKOFF_MAX = float(os.environ.get('VOICECRAFT_GTTS_BACKOFF_MAX', '8'))
+TIMEOUT = float(os.environ.get('VOICECRAFT_GTTS_TIMEOUT', '15'))
+VERIFY_TLS = os.environ.get('VOICECRAFT_GTTS_VERIFY_TLS', '1') != '0'
+
+# Rate limiting and server-side hiccups; anything else won't get better
+RETRY_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+# Same extraction gTTS does on each response line
+_audio_re = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+
+class GTTSTransportError(Exception):
+    pass
+
+
+class _Retryable(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def backoff_delay(attempt, base=BACKOFF, cap=BACKOFF_MAX):
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def decode_audio(body):
+    """Pull the base64 MP3 out of a batchexecute response body."""
+    parts = []
+    for line in body.splitlines():
+        if 'jQ1olc' not in line:
+            continue
+        match = _audio_re.search(line)
+        if not match:
+            raise GTTSTransportError("TTS API response contained no audio")
+        parts.append(base64.b64decode(match.group(1).encode('ascii')))
+    if not parts:
+        raise GTTSTransportError("TTS API response contained no audio")
+    return b''.join(parts)
+
+
+class GTTSTransport:
+    def __init__(self, endpoint=ENDPOINT, pool_size=POOL_SIZE, fragment_workers=FRAGMENT_WORKERS,
+                 retries=RETRIES, timeout=TIMEOUT, verify=VERIFY_TLS):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.endpoint = endpoint
+        self.retries = retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.verify = verify
+        # One host, so one pool; pool_block makes extra threads wait for a
+        # connection rather than opening throwaway ones
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Its own threads: callers are often chunking workers already
+        self._executor = ThreadPoolExecutor(max_workers=fragment_workers, thread_name_prefix='gtts-fetch')
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.counters = {'requests': 0, 'retries': 0, 'coalesced': 0}
+
+    def _prepare(self, text, lang, slow):
+        from gtts import gTTS
+        prepared = gTTS(text=text, lang=lang, slow=slow)._prepare_requests()
+        if self.endpoint:
+            for request in prepared:
+                request.url = self.endpoint
+        return prepared
+
+    def _send(self, request):
+        import requests
+        with self._lock:
+            self.counters['requests'] += 1
+        try:
+            response = self.session.send(request, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise _Retryable(f"Failed to connect to the TTS API: {e}")
+        if response.status_code in RETRY_STATUS:
+            retry_after = response.headers.get('Retry-After', '')
+            raise _Retryable(f"{response.status_code} ({response.reason}) from TTS API",
+                             float(retry_after) if retry_after.isdigit() else None)
+        if response.status_code != 200:
+            raise GTTSTransportError(f"{response.status_code} ({response.reason}) from TTS API")
+        return decode_audio(response.text)
+
+    def fetch_fragment(self, request):
+        """Send one prepared request, retrying transient failures."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self._send(request)
+            except _Retryable as e:
+                if attempt == self.retries:
+                    raise GTTSTransportError(str(e)) from None
+                delay = backoff_delay(attempt)
+                if e.retry_after is not None:
+                    delay = max(delay, min(e.retry_after, BACKOFF_MAX))
+                with self._lock:
+                    self.counters['retries'] += 1
+                time.sleep(delay)
+
+    def _fetch(self, text, lang, slow):
+        prepared = self._prepare(text, lang, slow)
+        if len(prepared) == 1:
+            return self.fetch_fragment(prepared[0])
+        return b''.join(self._executor.map(self.fetch_fragment, prepared))
+
+    def synthesize(self, text, lang='en', slow=False):
+        """MP3 bytes for text; concurrent identical calls share one fetch."""
+        key = (text, lang, bool(slow))
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.counters['coalesced'] += 1
+        if not owner:
+            return future.result()
+        try:
+            future.set_result(self._fetch(text, lang, slow))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, inflight=len(self._inflight))
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_gtts_transport():
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = GTTSTransport()
+            register_collector('gtts_transport', _collect)
+        return _transport
+
+
+def _collect():
+    for name, value in _transport.stats().items():
+        yield f'voicecraft_gtts_{name}', {}, value
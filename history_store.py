@@ -0,0 +1,545 @@
+"""
+Disk-backed conversion history.
+
+Audio is stored once per distinct content (named by its SHA-256) with a
+reference count, so saving the same clip twice costs nothing extra. Only
+compact metadata records travel through the session; audio bytes are read
+from disk when a history item is actually played or downloaded.
+
+The full source text of every entry is indexed with SQLite FTS5 (or
+matched with LIKE where SQLite was built without it), next to a token
+naming its owner that every search matches too, and entries are read a page
+at a time with keyset cursors on the entry id, so searching and paging stay
+cheap however long a user's history gets, and however many other users
+there are.
+
+RedisHistoryStore keeps entries and audio in Redis for deployments with
+several replicas (see state.py).
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import state
+from chunking import detect_format
+from metrics import span
+
+HISTORY_DIR = os.environ.get('VOICECRAFT_HISTORY_DIR', '.history')
+QUOTA_BYTES = int(os.environ.get('VOICECRAFT_HISTORY_QUOTA_BYTES', str(50 * 1024 * 1024)))
+MAX_ENTRIES = int(os.environ.get('VOICECRAFT_HISTORY_MAX_ENTRIES', '200'))
+PAGE_SIZE = 10
+FILTER_COLUMNS = ('language', 'voice_type', 'gender')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    digest TEXT NOT NULL REFERENCES blobs (digest),
+    size INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    language TEXT,
+    voice_type TEXT,
+    gender TEXT,
+    created REAL NOT NULL,
+    format TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_by_user ON entries (username, id);
+"""
+
+# Filtered pages are read newest first straight off one of these; a date
+# range only sorts the entries inside it
+FILTER_INDEXES = """
+CREATE INDEX IF NOT EXISTS entries_by_language ON entries (username, language, id);
+CREATE INDEX IF NOT EXISTS entries_by_voice_type ON entries (username, voice_type, id);
+CREATE INDEX IF NOT EXISTS entries_by_gender ON entries (username, gender, id);
+CREATE INDEX IF NOT EXISTS entries_by_created ON entries (username, created);
+"""
+
+# rowid is the entry id; owner is owner_token(username) and text the whole
+# source text, not the preview
+FTS_SCHEMA = ("CREATE VIRTUAL TABLE entries_fts USING fts5(owner, text, "
+              "tokenize='unicode61 remove_diacritics 2')")
+
+ENTRY_COLUMNS = 'id, digest, size, text, timestamp, language, voice_type, gender, format'
+ENTRY_SELECT = ', '.join(f'entries.{column}' for column in ENTRY_COLUMNS.split(', '))
+
+
+def owner_token(username):
+    """A single FTS token standing for username, whatever characters it has."""
+    return 'u' + hashlib.sha256(username.encode('utf-8')).hexdigest()[:20]
+
+
+class HistoryStore:
+    def __init__(self, directory=HISTORY_DIR, quota_bytes=QUOTA_BYTES, max_entries=MAX_ENTRIES):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, 'blobs')
+        self.quota_bytes = quota_bytes
+        self.max_entries = max_entries
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+        conn.executescript(FILTER_INDEXES)
+        self.fts = self._create_fts(conn)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, 'history.db'), timeout=30,
+                                   isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.create_function('owner_token', 1, owner_token, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self, conn):
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(entries)')}
+        if 'format' in columns:
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have migrated while we waited for the lock
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(entries)')}
+            if 'format' not in columns:
+                conn.execute('ALTER TABLE entries ADD COLUMN format TEXT')
+                # Older clips were all labelled MP3; sniff what they really are
+                for row in conn.execute('SELECT DISTINCT digest FROM entries').fetchall():
+                    try:
+                        with open(self._blob_path(row['digest']), 'rb') as f:
+                            fmt = detect_format(f.read(12))
+                    except OSError:
+                        continue
+                    conn.execute('UPDATE entries SET format = ? WHERE digest = ?', (fmt, row['digest']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _create_fts(self, conn):
+        """Create and backfill the search index if needed; False without FTS5."""
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'entries_fts'"
+            ).fetchone()
+            if exists and 'owner' not in {row['name'] for row in conn.execute('PRAGMA table_info(entries_fts)')}:
+                # Indexed before searches were scoped to their owner: keep the
+                # texts, add the owners
+                conn.execute('ALTER TABLE entries_fts RENAME TO entries_fts_old')
+                conn.execute(FTS_SCHEMA)
+                conn.execute(
+                    'INSERT INTO entries_fts (rowid, owner, text) SELECT entries.id, owner_token(entries.username), '
+                    'entries_fts_old.text FROM entries_fts_old JOIN entries ON entries.id = entries_fts_old.rowid'
+                )
+                conn.execute('DROP TABLE entries_fts_old')
+            elif not exists:
+                conn.execute(FTS_SCHEMA)
+                # Older entries only kept their preview, so that's what gets indexed
+                conn.execute('INSERT INTO entries_fts (rowid, owner, text) '
+                             'SELECT id, owner_token(username), text FROM entries')
+            conn.execute('COMMIT')
+        except sqlite3.OperationalError as e:
+            conn.execute('ROLLBACK')
+            if 'fts5' not in str(e):
+                raise
+            return False
+        return True
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _write_blob(self, digest, data):
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _release(self, conn, digest):
+        # Caller holds the write transaction, which also serializes blob
+        # creation and removal between sessions
+        conn.execute('UPDATE blobs SET refcount = refcount - 1 WHERE digest = ?', (digest,))
+        row = conn.execute('SELECT refcount FROM blobs WHERE digest = ?', (digest,)).fetchone()
+        if row is not None and row['refcount'] <= 0:
+            conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def add(self, username, audio, text, timestamp, language, voice_type, gender, source=None):
+        """Store one clip and return its metadata record; source is the full text to index."""
+        digest = hashlib.sha256(audio).hexdigest()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            with span('history_blob_write'):
+                self._write_blob(digest, audio)
+            conn.execute(
+                'INSERT INTO blobs (digest, size, refcount) VALUES (?, ?, 1) '
+                'ON CONFLICT (digest) DO UPDATE SET refcount = refcount + 1',
+                (digest, len(audio))
+            )
+            cur = conn.execute(
+                'INSERT INTO entries (username, digest, size, text, timestamp, language, voice_type, '
+                'gender, created, format) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (username, digest, len(audio), text, timestamp, language, voice_type, gender, time.time(),
+                 detect_format(audio))
+            )
+            entry_id = cur.lastrowid
+            if self.fts:
+                conn.execute('INSERT INTO entries_fts (rowid, owner, text) VALUES (?, ?, ?)',
+                             (entry_id, owner_token(username), source or text))
+            self._enforce_quota(conn, username)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self.get(username, entry_id)
+
+    def _enforce_quota(self, conn, username):
+        """Drop the user's oldest entries until they fit the quota."""
+        row = conn.execute(
+            'SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS total FROM entries WHERE username = ?',
+            (username,)
+        ).fetchone()
+        count, total = row['n'], row['total']
+        if count <= self.max_entries and total <= self.quota_bytes:
+            return
+        for old in conn.execute(
+            'SELECT id, digest, size FROM entries WHERE username = ? ORDER BY id', (username,)
+        ).fetchall():
+            # Always keep the newest entry, even if it alone exceeds the quota
+            if (count <= self.max_entries and total <= self.quota_bytes) or count == 1:
+                break
+            self._delete_entry(conn, old['id'], old['digest'])
+            count -= 1
+            total -= old['size']
+
+    def _delete_entry(self, conn, entry_id, digest):
+        conn.execute('DELETE FROM entries WHERE id = ?', (entry_id,))
+        if self.fts:
+            conn.execute('DELETE FROM entries_fts WHERE rowid = ?', (entry_id,))
+        self._release(conn, digest)
+
+    def get(self, username, entry_id):
+        row = self._connect().execute(
+            f'SELECT {ENTRY_COLUMNS} FROM entries WHERE id = ? AND username = ?',
+            (entry_id, username)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def list(self, username, limit=None):
+        """Metadata records for username, newest first."""
+        sql = f'SELECT {ENTRY_COLUMNS} FROM entries WHERE username = ? ORDER BY id DESC'
+        params = (username,)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params += (limit,)
+        return [dict(row) for row in self._connect().execute(sql, params)]
+
+    def page(self, username, cursor=None, limit=PAGE_SIZE, query=None, language=None,
+             voice_type=None, gender=None, since=None, until=None):
+        """
+        (records, next_cursor): up to limit entries newest first, older than
+        cursor, optionally matching every word of query (as prefixes), the
+        given language/voice_type/gender and a created time in [since,
+        until). next_cursor is None on the last page.
+        """
+        words = (query or '').split()
+        if words and self.fts:
+            # Walk the matches newest first and stop at the page size; the
+            # CROSS JOIN keeps SQLite from scanning entries instead. Matching
+            # the owner's token too keeps other users' entries out of the
+            # walk. Every word is quoted so user input can't be read as FTS
+            # syntax.
+            source = 'entries_fts CROSS JOIN entries ON entries.id = entries_fts.rowid'
+            order = 'entries_fts.rowid'
+            where = ['entries_fts MATCH ?', 'entries.username = ?']
+            text = ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+            params = [f'owner : "{owner_token(username)}" AND text : ({text})', username]
+        else:
+            source, order = 'entries', 'entries.id'
+            where, params = ['entries.username = ?'], [username]
+            # Without FTS5 only the stored preview can be searched
+            for word in words:
+                where.append("entries.text LIKE ? ESCAPE '\\'")
+                params.append('%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if cursor is not None:
+            where.append(f'{order} < ?')
+            params.append(cursor)
+        for column, value in (('language', language), ('voice_type', voice_type), ('gender', gender)):
+            if value is not None:
+                where.append(f'entries.{column} = ?')
+                params.append(value)
+        if since is not None:
+            where.append('entries.created >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('entries.created < ?')
+            params.append(until)
+        with span('history_page'):
+            rows = self._connect().execute(
+                f"SELECT {ENTRY_SELECT} FROM {source} WHERE {' AND '.join(where)} ORDER BY {order} DESC LIMIT ?",
+                (*params, limit + 1)
+            ).fetchall()
+        records = [dict(row) for row in rows[:limit]]
+        return records, records[-1]['id'] if len(rows) > limit else None
+
+    def load_audio(self, digest):
+        with span('history_load'), open(self._blob_path(digest), 'rb') as f:
+            return f.read()
+
+    def delete(self, username, entry_id):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT digest FROM entries WHERE id = ? AND username = ?',
+                               (entry_id, username)).fetchone()
+            if row is not None:
+                self._delete_entry(conn, entry_id, row['digest'])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return row is not None
+
+    def clear(self, username):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('SELECT id, digest FROM entries WHERE username = ?', (username,)).fetchall()
+            conn.execute('DELETE FROM entries WHERE username = ?', (username,))
+            if self.fts:
+                conn.executemany('DELETE FROM entries_fts WHERE rowid = ?', [(row['id'],) for row in rows])
+            for row in rows:
+                self._release(conn, row['digest'])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def usage(self, username):
+        row = self._connect().execute(
+            'SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM entries WHERE username = ?',
+            (username,)
+        ).fetchone()
+        return dict(row, quota_bytes=self.quota_bytes, max_entries=self.max_entries)
+
+
+# KEYS: entry, source, user's entries, user's bytes, blob refcount, blob,
+# then the entry's filter sets; ARGV: entry id, size. A no-op if another
+# replica already deleted the entry.
+DELETE_SCRIPT = """
+if redis.call('DEL', KEYS[1]) == 0 then return 0 end
+redis.call('DEL', KEYS[2])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('DECRBY', KEYS[4], ARGV[2])
+if redis.call('DECR', KEYS[5]) <= 0 then redis.call('DEL', KEYS[5], KEYS[6]) end
+for i = 7, #KEYS do redis.call('ZREM', KEYS[i], ARGV[1]) end
+return 1
+"""
+
+SCAN_BATCH = 100
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class RedisHistoryStore:
+    """
+    HistoryStore on Redis. Each entry is a hash (its full text in a key of
+    its own), each user's entry ids sit in a sorted set scored by id, with
+    one more per language, voice type and gender value, and audio is a
+    reference-counted blob per digest.
+
+    Pages are read newest first off the most selective sorted set and the
+    remaining filters and search words are checked here. Redis has no
+    full-text index, so a search reads the texts of the entries it passes;
+    the per-user entry cap keeps that bounded.
+    """
+
+    def __init__(self, client=None, quota_bytes=QUOTA_BYTES, max_entries=MAX_ENTRIES):
+        self._redis = client if client is not None else state.get_redis()
+        self.quota_bytes = quota_bytes
+        self.max_entries = max_entries
+        self._delete = self._redis.register_script(DELETE_SCRIPT)
+
+    def _key(self, *parts):
+        return state.key('history', *parts)
+
+    def _filter_key(self, username, column, value):
+        return self._key('user', username, column, value)
+
+    def add(self, username, audio, text, timestamp, language, voice_type, gender, source=None):
+        """Store one clip and return its metadata record; source is the full text to search."""
+        digest = hashlib.sha256(audio).hexdigest()
+        entry_id = self._redis.incr(self._key('next_id'))
+        record = {'username': username, 'digest': digest, 'size': len(audio), 'text': text,
+                  'timestamp': timestamp, 'language': language, 'voice_type': voice_type, 'gender': gender,
+                  'created': time.time(), 'format': detect_format(audio)}
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.set(self._key('blob', digest), audio, nx=True)
+        pipe.incr(self._key('refs', digest))
+        pipe.hset(self._key('entry', entry_id), mapping={k: v for k, v in record.items() if v is not None})
+        pipe.set(self._key('source', entry_id), source or text)
+        pipe.zadd(self._key('user', username), {entry_id: entry_id})
+        for column in FILTER_COLUMNS:
+            if record[column] is not None:
+                pipe.zadd(self._filter_key(username, column, record[column]), {entry_id: entry_id})
+        pipe.incrby(self._key('user', username, 'bytes'), len(audio))
+        with span('history_blob_write'):
+            pipe.execute()
+        self._enforce_quota(username)
+        return self.get(username, entry_id)
+
+    def _enforce_quota(self, username):
+        """Drop the user's oldest entries until they fit the quota."""
+        while True:
+            count, total = self._usage(username)
+            # Always keep the newest entry, even if it alone exceeds the quota
+            if (count <= self.max_entries and total <= self.quota_bytes) or count <= 1:
+                return
+            oldest = self._redis.zrange(self._key('user', username), 0, 0)
+            if not oldest:
+                return
+            self._delete_entry(username, int(oldest[0]))
+
+    def _delete_entry(self, username, entry_id):
+        record = self._load(entry_id)
+        if record is None or record['username'] != username:
+            return False
+        keys = [self._key('entry', entry_id), self._key('source', entry_id), self._key('user', username),
+                self._key('user', username, 'bytes'), self._key('refs', record['digest']),
+                self._key('blob', record['digest'])]
+        keys += [self._filter_key(username, column, record[column])
+                 for column in FILTER_COLUMNS if record[column] is not None]
+        return self._delete(keys=keys, args=[entry_id, record['size']]) == 1
+
+    def _decode(self, entry_id, raw):
+        if not raw:
+            return None
+        raw = {_text(k): _text(v) for k, v in raw.items()}
+        record = {column: raw.get(column) for column in ENTRY_COLUMNS.split(', ')}
+        record.update(id=entry_id, size=int(raw['size']), username=raw['username'], created=float(raw['created']))
+        return record
+
+    def _load(self, entry_id):
+        return self._decode(entry_id, self._redis.hgetall(self._key('entry', entry_id)))
+
+    def _public(self, record):
+        return {column: record[column] for column in ENTRY_COLUMNS.split(', ')}
+
+    def get(self, username, entry_id):
+        record = self._load(entry_id)
+        if record is None or record['username'] != username:
+            return None
+        return self._public(record)
+
+    def _records(self, ids, with_source=False):
+        pipe = self._redis.pipeline(transaction=False)
+        for entry_id in ids:
+            pipe.hgetall(self._key('entry', entry_id))
+            if with_source:
+                pipe.get(self._key('source', entry_id))
+        results = pipe.execute()
+        step = 2 if with_source else 1
+        for i, entry_id in enumerate(ids):
+            record = self._decode(entry_id, results[i * step])
+            if record is not None:
+                if with_source:
+                    record['source'] = _text(results[i * step + 1]) or record['text']
+                yield record
+
+    def list(self, username, limit=None):
+        """Metadata records for username, newest first."""
+        ids = [int(i) for i in self._redis.zrevrange(self._key('user', username), 0,
+                                                      -1 if limit is None else limit - 1)]
+        return [self._public(record) for record in self._records(ids)]
+
+    def page(self, username, cursor=None, limit=PAGE_SIZE, query=None, language=None,
+             voice_type=None, gender=None, since=None, until=None):
+        """Same as HistoryStore.page; words match case-insensitively as word prefixes."""
+        filters = {'language': language, 'voice_type': voice_type, 'gender': gender}
+        index = self._key('user', username)
+        for column, value in filters.items():
+            if value is not None:
+                index = self._filter_key(username, column, value)
+                break
+        words = [re.compile(r'(?<!\w)' + re.escape(word), re.IGNORECASE) for word in (query or '').split()]
+        matches = []
+        upper = '+inf' if cursor is None else f'({cursor}'
+        with span('history_page'):
+            while len(matches) <= limit:
+                ids = [int(i) for i in self._redis.zrevrangebyscore(index, upper, '-inf', start=0, num=SCAN_BATCH)]
+                if not ids:
+                    break
+                upper = f'({ids[-1]}'
+                for record in self._records(ids, with_source=bool(words)):
+                    if any(value is not None and record[column] != value for column, value in filters.items()):
+                        continue
+                    if since is not None and record['created'] < since:
+                        continue
+                    if until is not None and record['created'] >= until:
+                        continue
+                    if not all(word.search(record['source']) for word in words):
+                        continue
+                    matches.append(self._public(record))
+                    if len(matches) > limit:
+                        break
+        records = matches[:limit]
+        return records, records[-1]['id'] if len(matches) > limit else None
+
+    def load_audio(self, digest):
+        with span('history_load'):
+            data = self._redis.get(self._key('blob', digest))
+        if data is None:
+            raise FileNotFoundError(f"No audio stored for {digest}")
+        return data
+
+    def delete(self, username, entry_id):
+        return self._delete_entry(username, entry_id)
+
+    def clear(self, username):
+        for entry_id in self._redis.zrange(self._key('user', username), 0, -1):
+            self._delete_entry(username, int(entry_id))
+
+    def _usage(self, username):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.zcard(self._key('user', username))
+        pipe.get(self._key('user', username, 'bytes'))
+        count, total = pipe.execute()
+        return count, int(total or 0)
+
+    def usage(self, username):
+        count, total = self._usage(username)
+        return {'entries': count, 'bytes': total, 'quota_bytes': self.quota_bytes,
+                'max_entries': self.max_entries}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RedisHistoryStore() if state.shared() else HistoryStore()
+        return _store
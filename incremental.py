@@ -0,0 +1,124 @@
+"""
+Incremental re-synthesis.
+
+Text is cut into sentence segments, and each generation is diffed against
+the previous one from the same session and voice settings with difflib.
+Segments that survived the edit keep their audio; only inserted or
+rewritten ones are synthesized, and the parts are spliced back together in
+order, so regenerating after a small edit costs about as much as the edit.
+
+A generation only remembers which backend made each segment's audio and
+its cache key, not the audio, so keeping one per session costs a few bytes
+per sentence. Reused
+parts are read back from the cache when spliced; any that have been
+evicted since are synthesized again.
+"""
+import difflib
+
+from audio_cache import get_audio_cache
+from chunking import CHUNK_CHARS, split_sentences, stitch, stream_chunks
+from metrics import span
+
+
+class Generation:
+    """
+    Segments of one text and the (backend name, cache key) of their audio
+    (None until synthesized).
+
+    settings is anything comparable that changes the engine's output
+    (engine, language, voice...); generations with different settings
+    never share audio.
+    """
+
+    def __init__(self, settings, segments, keys):
+        self.settings = settings
+        self.segments = segments
+        self.keys = keys
+
+    def pending(self):
+        return [i for i, key in enumerate(self.keys) if key is None]
+
+    @property
+    def reused(self):
+        return len(self.keys) - len(self.pending())
+
+
+def plan(text, settings, previous=None, max_chars=CHUNK_CHARS):
+    """Segment text and take over the audio of segments unchanged since previous."""
+    segments = split_sentences(text, max_chars)
+    keys = [None] * len(segments)
+    if previous is not None and previous.settings == settings:
+        matcher = difflib.SequenceMatcher(None, previous.segments, segments, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                keys[j1:j2] = previous.keys[i1:i2]
+    return Generation(settings, segments, keys)
+
+
+def incremental_task(generation, synthesize, segment_key, on_done=None, finish=stitch):
+    """
+    Job task (see jobs.synthesis_task) that synthesizes the segments of
+    generation with no usable audio in the cache, records their keys as
+    they arrive and returns finish(parts) for the whole text.
+
+    segment_key(text) is (backend name, cache key) for text from the
+    backend synthesize is using at the moment (see synthesis.synthesizer).
+    Only audio from that backend is reused. If synthesize falls back to
+    another backend part way, the reused segments are synthesized again
+    with it, so the result is in one voice. Characters passed to on_done
+    only count what was synthesized.
+    """
+    def task(job):
+        cache = get_audio_cache()
+        segments = generation.segments
+        parts = [None] * len(segments)
+        # The key each part in parts was produced under
+        produced = [None] * len(segments)
+        characters = 0
+        streamed = 0
+
+        def ready():
+            # Parts that now extend the in-order prefix of the text, for streaming
+            nonlocal streamed
+            start = streamed
+            while streamed < len(parts) and parts[streamed] is not None:
+                streamed += 1
+            if streamed == start:
+                return None
+            # Only joined up when someone is listening
+            return stitch(parts[start:streamed]) if job.stream else parts[start]
+
+        first_pass = True
+        while True:
+            wanted = [segment_key(segment) for segment in segments]
+            for i, key in enumerate(wanted):
+                if parts[i] is not None and produced[i] != key:
+                    # Made by a backend this run has since moved away from
+                    parts[i] = None
+                if parts[i] is None and generation.keys[i] == key:
+                    parts[i] = cache.get(key[1])
+                    produced[i] = key
+            pending = [i for i, part in enumerate(parts) if part is None]
+            if first_pass and 'reused' in job.meta:
+                # Less than planned if audio was evicted or came from another backend
+                job.meta['reused'] = len(parts) - len(pending)
+            first_pass = False
+            if not pending:
+                break
+            characters += sum(len(segments[i]) for i in pending)
+            stream = stream_chunks([segments[i] for i in pending], synthesize)
+            try:
+                for idx, total, data in stream:
+                    i = pending[idx]
+                    parts[i] = data
+                    # Kept even if a later segment fails, for the next attempt
+                    produced[i] = generation.keys[i] = segment_key(segments[i])
+                    job.report(idx + 1, total, ready())
+            finally:
+                stream.close()
+        with span('finish'):
+            audio = finish(parts)
+        if on_done:
+            on_done(job, audio, characters)
+        return audio
+    return task
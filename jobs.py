@@ -0,0 +1,454 @@
+"""
+Background synthesis jobs.
+
+The Streamlit script only submits work and gets a job id back; synthesis
+runs on a shared worker pool, so reruns triggered by widget interaction
+neither block on it nor throw it away. Finished jobs are kept for a while
+so their results can be rendered on any later rerun.
+
+At most JOB_WORKERS jobs run at once across all sessions. Queued jobs are
+started shortest estimated cost first, so one-line previews don't wait
+behind long documents; every second a job waits takes JOB_AGING seconds
+off its cost, so long jobs still get their turn. A job whose estimated
+queue wait would exceed JOB_QUEUE_SLO is turned away with Overloaded.
+Running jobs' chunks are queued on the shared chunk pool in the same
+order (see chunking.job_priority).
+
+With shared state (see state.py) every job's status, streamed parts and
+result are also published to Redis, so a replica other than the one
+running a job can show its progress and result and cancel it.
+"""
+import heapq
+import json
+import os
+import threading
+import time
+import uuid
+
+import state
+from chunking import job_priority, stitch, stream_long_text, stream_segments
+from metrics import observe, register_collector, span
+
+JOB_WORKERS = int(os.environ.get('VOICECRAFT_JOB_WORKERS', '4'))
+JOBS_PER_USER = int(os.environ.get('VOICECRAFT_JOBS_PER_USER', '2'))
+RESULT_TTL = float(os.environ.get('VOICECRAFT_JOB_RESULT_TTL', '3600'))
+JOB_AGING = float(os.environ.get('VOICECRAFT_JOB_AGING', '1.0'))
+JOB_QUEUE_SLO = float(os.environ.get('VOICECRAFT_JOB_QUEUE_SLO', '30'))
+JOB_QUEUE_SIZE = int(os.environ.get('VOICECRAFT_JOB_QUEUE_SIZE', '64'))
+
+
+class JobLimitReached(Exception):
+    pass
+
+
+class Overloaded(Exception):
+    def __init__(self, message, wait):
+        super().__init__(message)
+        self.wait = wait
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, username, meta, cost=0.0, stream=False):
+        self.id = uuid.uuid4().hex
+        self.username = username
+        self.meta = meta
+        self.cost = cost
+        # Keep the finished parts, in order, for streaming playback
+        self.stream = stream
+        self.parts = []
+        self.parts_published = 0
+        self._preview = (0, None)
+        self.status = 'queued'
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.first_audio_at = None
+        self.cancel_event = threading.Event()
+        # Set by the manager to publish progress elsewhere
+        self.on_report = None
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    @property
+    def fraction(self):
+        # Streams from uploaded files don't know their length up front
+        return self.done / self.total if self.total else 0.0
+
+    @property
+    def streamed(self):
+        return len(self.parts)
+
+    def preview(self):
+        """The parts finished so far as one stream; only re-stitched when parts were added."""
+        count, audio = self._preview
+        parts = self.parts[:len(self.parts)]
+        if parts and len(parts) != count:
+            try:
+                audio = stitch(parts)
+            except ValueError:
+                # Chunks of mixed formats; the final audio still gets them all
+                audio = parts[0]
+            self._preview = (len(parts), audio)
+        return audio
+
+    def report(self, done, total, chunk=None):
+        """Called by the task as chunks complete; raises if cancelled."""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.done, self.total = done, total
+        if chunk is not None:
+            if self.first_audio_at is None:
+                self.first_audio_at = time.monotonic() - self.started
+            if self.stream:
+                self.parts.append(chunk)
+        if self.on_report is not None:
+            self.on_report(self)
+
+
+def _wall(monotonic):
+    # Monotonic clocks aren't comparable between machines, wall clocks are
+    return None if monotonic is None else time.time() - (time.monotonic() - monotonic)
+
+
+def _monotonic(wall):
+    return None if wall is None else time.monotonic() - (time.time() - wall)
+
+
+class RemoteJob(Job):
+    """Read-only snapshot of a job published by another replica."""
+
+    def __init__(self, job_id, snapshot, meta, result, board):
+        super().__init__(snapshot['username'], meta, snapshot['cost'], snapshot.get('stream', False))
+        self.id = job_id
+        self.status = snapshot['status']
+        self.done = snapshot['done']
+        self.total = snapshot['total']
+        self.error = snapshot['error']
+        self.first_audio_at = snapshot['first_audio_at']
+        self.submitted = _monotonic(snapshot['submitted'])
+        self.started = _monotonic(snapshot['started'])
+        self.finished = _monotonic(snapshot['finished'])
+        self.result = result
+        self._streamed = snapshot.get('streamed', 0)
+        self._board = board
+
+    @property
+    def streamed(self):
+        return self._streamed
+
+    def preview(self):
+        # Fetched only when the player actually needs the longer audio
+        if len(self.parts) < self._streamed:
+            self.parts = self._board.load_parts(self.id)
+        return super().preview()
+
+
+class JobBoard:
+    """
+    Job status in Redis: a small JSON snapshot per job, rewritten as it
+    progresses, plus its meta, streamed parts (appended as they finish) and
+    result, all expiring
+    result_ttl seconds after the last update. Cancelling a job from another
+    replica sets a flag its owner picks up at the next chunk.
+    """
+
+    def __init__(self, client, result_ttl=RESULT_TTL):
+        self._redis = client
+        self.result_ttl = int(result_ttl)
+
+    def _key(self, job_id, *parts):
+        return state.key('job', job_id, *parts)
+
+    def publish(self, job, meta=False):
+        """Write job's snapshot; returns whether a cancel was requested elsewhere."""
+        pipe = self._redis.pipeline(transaction=False)
+        published = job.parts_published
+        if job.active and len(job.parts) > published:
+            # Only what finished since the last publish goes over the wire
+            new = job.parts[published:]
+            pipe.rpush(self._key(job.id, 'parts'), *new)
+            pipe.expire(self._key(job.id, 'parts'), self.result_ttl)
+            published += len(new)
+        elif not job.active:
+            pipe.delete(self._key(job.id, 'parts'))
+        snapshot = {'username': job.username, 'cost': job.cost, 'status': job.status, 'done': job.done,
+                    'total': job.total, 'error': job.error, 'first_audio_at': job.first_audio_at,
+                    'submitted': _wall(job.submitted), 'started': _wall(job.started),
+                    'finished': _wall(job.finished), 'stream': job.stream, 'streamed': published}
+        pipe.set(self._key(job.id), json.dumps(snapshot), ex=self.result_ttl)
+        if meta:
+            pipe.set(self._key(job.id, 'meta'), json.dumps(job.meta), ex=self.result_ttl)
+        else:
+            pipe.expire(self._key(job.id, 'meta'), self.result_ttl)
+        if job.result is not None:
+            pipe.set(self._key(job.id, 'result'), job.result, ex=self.result_ttl)
+        pipe.exists(self._key(job.id, 'cancel'))
+        cancelled = bool(pipe.execute()[-1])
+        job.parts_published = published
+        return cancelled
+
+    def load(self, job_id):
+        pipe = self._redis.pipeline(transaction=False)
+        for part in ((), ('meta',), ('result',)):
+            pipe.get(self._key(job_id, *part))
+        snapshot, meta, result = pipe.execute()
+        if snapshot is None:
+            return None
+        return RemoteJob(job_id, json.loads(snapshot), json.loads(meta) if meta else {}, result, self)
+
+    def load_parts(self, job_id):
+        return self._redis.lrange(self._key(job_id, 'parts'), 0, -1)
+
+    def cancel(self, job_id):
+        self._redis.set(self._key(job_id, 'cancel'), 1, ex=self.result_ttl)
+
+    def cancel_requested(self, job_id):
+        return bool(self._redis.exists(self._key(job_id, 'cancel')))
+
+
+class JobManager:
+    def __init__(self, workers=JOB_WORKERS, per_user=JOBS_PER_USER, result_ttl=RESULT_TTL,
+                 aging=JOB_AGING, queue_slo=JOB_QUEUE_SLO, queue_size=JOB_QUEUE_SIZE, board=None):
+        self.workers = max(1, workers)
+        self.per_user = per_user
+        self.result_ttl = result_ttl
+        self.aging = aging
+        self.queue_slo = queue_slo
+        self.queue_size = queue_size
+        self.board = board
+        self._jobs = {}
+        # (cost + aging * submitted, sequence, job, task): with the same aging
+        # for everyone, the order by aged cost never changes while queued
+        self._queue = []
+        # Cancelled jobs stay in the heap until a worker pops them; this
+        # counts only the ones still waiting
+        self._queued = 0
+        self._sequence = 0
+        self._running = set()
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"tts-job-{i}", daemon=True).start()
+
+    def _prune(self):
+        # Caller holds the lock
+        cutoff = time.monotonic() - self.result_ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _priority(self, cost, submitted):
+        return cost + self.aging * submitted
+
+    def expected_wait(self, cost=0.0):
+        """Estimated seconds a job of this cost submitted now would queue."""
+        with self._lock:
+            return self._expected_wait(self._priority(cost, time.monotonic()))
+
+    def _expected_wait(self, priority):
+        # Caller holds the lock. Jobs ahead in the queue plus what's left of
+        # the running ones, spread over the workers
+        now = time.monotonic()
+        ahead = [entry[2] for entry in self._queue if entry[0] <= priority and entry[2].status == 'queued']
+        if len(self._running) + len(ahead) < self.workers:
+            return 0.0
+        remaining = sum(max(0.0, job.cost - (now - job.started)) for job in self._running)
+        return (remaining + sum(job.cost for job in ahead)) / self.workers
+
+    def submit(self, username, task, cost=0.0, stream=False, **meta):
+        """
+        Queue task(job) -> bytes and return the new job's id. cost is the
+        estimated run time in seconds (characters * seconds per character);
+        stream keeps finished parts for playback while the job runs.
+        """
+        with self._lock:
+            self._prune()
+            active = sum(1 for j in self._jobs.values() if j.username == username and j.active)
+            if active >= self.per_user:
+                raise JobLimitReached(
+                    f"You already have {active} conversion(s) running. "
+                    "Wait for one to finish or cancel it."
+                )
+            job = Job(username, meta, cost, stream)
+            priority = self._priority(cost, job.submitted)
+            wait = self._expected_wait(priority)
+            if self._queued >= self.queue_size:
+                self.rejected += 1
+                raise Overloaded(
+                    f"The server is busy: {self._queued} conversions are already waiting. "
+                    "Please try again in a moment.", wait
+                )
+            if wait > self.queue_slo:
+                self.rejected += 1
+                raise Overloaded(
+                    f"The server is busy: this conversion would wait about {wait:.0f}s to start. "
+                    "Please try again in a moment, or convert a shorter text.", wait
+                )
+            self._jobs[job.id] = job
+            heapq.heappush(self._queue, (priority, self._sequence, job, task))
+            self._queued += 1
+            self._sequence += 1
+            self._ready.notify()
+        if self.board is not None:
+            job.on_report = self._publish
+            self.board.publish(job, meta=True)
+        return job.id
+
+    def _publish(self, job):
+        if self.board.publish(job):
+            job.cancel_event.set()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._ready.wait()
+                priority, _, job, task = heapq.heappop(self._queue)
+                if job.status != 'queued':
+                    # Cancelled while it waited
+                    continue
+                self._queued -= 1
+                job.status = 'running'
+                job.started = time.monotonic()
+                self._running.add(job)
+            try:
+                with job_priority(priority):
+                    self._run(job, task)
+            finally:
+                with self._lock:
+                    self._running.discard(job)
+
+    def _run(self, job, task):
+        observe(job.started - job.submitted, 'job_queue_wait')
+        try:
+            if job.on_report is not None:
+                # Publishes the start, and picks up a cancel from another replica
+                job.on_report(job)
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+            job.result = task(job)
+        except JobCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        else:
+            job.status = 'done'
+        finally:
+            job.finished = time.monotonic()
+            # Only running jobs are streamed; the result has it all
+            job.parts = []
+            job._preview = (0, None)
+            if self.board is not None:
+                self.board.publish(job)
+
+    def get(self, job_id):
+        """The job, or a snapshot of it if another replica runs it."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and job_id is not None and self.board is not None:
+            job = self.board.load(job_id)
+        return job
+
+    def jobs_for(self, username):
+        with self._lock:
+            return [j for j in self._jobs.values() if j.username == username]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+        if isinstance(job, RemoteJob):
+            self.board.cancel(job_id)
+            return True
+        job.cancel_event.set()
+        published = False
+        with self._lock:
+            # A queued job is skipped when it reaches the front
+            if job.status == 'queued':
+                self._queued -= 1
+                job.status = 'cancelled'
+                job.finished = time.monotonic()
+                published = self.board is not None
+        if published:
+            self.board.publish(job)
+        return True
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def load(self):
+        with self._lock:
+            return {'rejected': self.rejected, 'expected_wait_seconds': self._expected_wait(float('inf'))}
+
+
+def synthesis_task(source, synthesize, on_done=None, finish=stitch):
+    """
+    Build a job task that synthesizes a string or an iterable of text
+    segments chunk by chunk.
+
+    Finished chunks are reported to the job in order (kept for streaming
+    playback if the job streams); finish(parts) turns the chunks into the final audio, and
+    on_done(job, audio_bytes, characters) runs in the worker on success.
+    """
+    def task(job):
+        parts = []
+        characters = 0
+        if isinstance(source, str):
+            characters = len(source)
+            stream = stream_long_text(source, synthesize)
+        else:
+            def counted(segments):
+                nonlocal characters
+                for segment in segments:
+                    characters += len(segment)
+                    yield segment
+            stream = stream_segments(counted(source), synthesize)
+        try:
+            for idx, total, data in stream:
+                parts.append(data)
+                job.report(idx + 1, total, data)
+        finally:
+            # Closing the generator cancels chunks that haven't started
+            stream.close()
+        with span('finish'):
+            audio = finish(parts)
+        if on_done:
+            on_done(job, audio, characters)
+        return audio
+    return task
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(board=JobBoard(state.get_redis()) if state.shared() else None)
+            register_collector('jobs', _collect)
+        return _manager
+
+
+def _collect():
+    counts = _manager.stats()
+    for status in ('queued', 'running', 'done', 'failed', 'cancelled'):
+        yield 'voicecraft_jobs', {'status': status}, counts.get(status, 0)
+    for name, value in _manager.load().items():
+        yield f'voicecraft_jobs_{name}', {}, value
@@ -0,0 +1,203 @@
+"""
+Lightweight timing spans and Prometheus-format metrics.
+
+Disabled unless VOICECRAFT_METRICS=1, in which case span() hands back one
+shared no-op context manager and costs a single attribute check. When
+enabled, spans feed latency histograms labelled by stage, engine, language
+and voice type, and registered collectors contribute point-in-time gauges
+(cache, engine pool, job queue) at scrape time.
+"""
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.environ.get('VOICECRAFT_METRICS', '0') == '1'
+HTTP_HOST = os.environ.get('VOICECRAFT_METRICS_HOST', '127.0.0.1')
+HTTP_PORT = int(os.environ.get('VOICECRAFT_METRICS_PORT', '9464'))
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LABELS = ('stage', 'engine', 'lang', 'voice_type')
+
+STAGE_METRIC = 'voicecraft_stage_seconds'
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Bucket upper bound containing quantile q (Prometheus-style estimate)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+_lock = threading.Lock()
+_histograms = {}
+_collectors = {}
+
+
+def observe(seconds, stage, engine='', lang='', voice_type=''):
+    """Record a duration measured elsewhere (no-op while disabled)."""
+    if ENABLED:
+        _observe(seconds, stage, engine, lang, voice_type)
+
+
+def _observe(seconds, stage, engine='', lang='', voice_type=''):
+    key = (stage, engine or '', lang or '', voice_type or '')
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+class _Span:
+    __slots__ = ('labels', 'started')
+
+    def __init__(self, labels):
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(stage, engine='', lang='', voice_type=''):
+    """Time a block: `with span('run_and_wait', engine='pyttsx3'): ...`"""
+    if not ENABLED:
+        return _NOOP
+    return _Span({'stage': stage, 'engine': engine, 'lang': lang, 'voice_type': voice_type})
+
+
+def register_collector(name, collect):
+    """
+    collect() -> iterable of (metric_name, labels_dict, value), evaluated on
+    every scrape. Registering the same name again replaces the collector.
+    """
+    with _lock:
+        _collectors[name] = collect
+
+
+def histograms():
+    with _lock:
+        return {key: (h.count, h.sum, h.quantile(0.5), h.quantile(0.95)) for key, h in _histograms.items()}
+
+
+def gauges():
+    """Current collector values: {metric_name: [(labels, value), ...]}."""
+    with _lock:
+        collectors = list(_collectors.values())
+    result = {}
+    for collect in collectors:
+        try:
+            for name, labels, value in collect():
+                result.setdefault(name, []).append((labels, value))
+        except Exception:
+            # A broken collector shouldn't take the whole endpoint down
+            continue
+    return result
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = [
+        f'# HELP {STAGE_METRIC} Time spent in each synthesis/persistence stage.',
+        f'# TYPE {STAGE_METRIC} histogram',
+    ]
+    with _lock:
+        snapshot = [(key, list(h.counts), h.sum, h.count) for key, h in sorted(_histograms.items())]
+    for key, counts, total, count in snapshot:
+        base = list(zip(LABELS, key))
+        cumulative = 0
+        for bound, n in zip(BUCKETS, counts):
+            cumulative += n
+            lines.append(f'{STAGE_METRIC}_bucket{_labels(base + [("le", bound)])} {cumulative}')
+        lines.append(f'{STAGE_METRIC}_bucket{_labels(base + [("le", "+Inf")])} {count}')
+        lines.append(f'{STAGE_METRIC}_sum{_labels(base)} {total}')
+        lines.append(f'{STAGE_METRIC}_count{_labels(base)} {count}')
+
+    current = gauges()
+    for name in sorted(current):
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in current[name]:
+            lines.append(f'{name}{_labels(sorted(labels.items()))} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_attempted = False
+
+
+def start_http_server(host=HTTP_HOST, port=HTTP_PORT):
+    """Serve /metrics on a background thread; safe to call on every rerun."""
+    global _server, _server_attempted
+    with _lock:
+        if _server_attempted or not ENABLED:
+            return _server
+        _server_attempted = True
+        try:
+            _server = ThreadingHTTPServer((host, port), _Handler)
+        except OSError:
+            # Another process (e.g. a second Streamlit worker) owns the port
+            return None
+        threading.Thread(target=_server.serve_forever, name='metrics-http', daemon=True).start()
+        return _server
@@ -0,0 +1,585 @@
+"""
+Canonical text for cache and dedup keys.
+
+Two texts an engine reads out the same way should hit the same cached
+audio, however they were typed. normalize(text, lang) folds Unicode
+variants (quotes, dashes, odd spaces, full-width and native digits),
+collapses whitespace, squeezes repeated punctuation, rewrites numeric and
+spelled-out dates as ISO 8601, expands numbers, English ordinals and
+common abbreviations into words, and puts every sentence on a line of its
+own.
+
+Each language in LANGUAGE_RULES gets one combined regular expression,
+compiled the first time the language is used, and every stage is a single
+left-to-right pass, so megabyte inputs normalize in linear time. Numbers
+are spelled out where the rules can do it without knowing the grammar
+around them; Japanese, Korean, Chinese, Hindi and Arabic numbers are only
+brought to one digit form, because how they are read depends on the
+counter or noun that follows. Without a language (engines that don't
+take one) only the language-neutral stages run.
+
+The canonical form is a key, not what gets synthesized: engines still
+receive the text as it was typed.
+"""
+import re
+import threading
+import unicodedata
+
+UNICODE_FOLDS = {
+    **{ord(c): '"' for c in '“”„‟«»'},
+    **{ord(c): "'" for c in '‘’‚‛'},
+    **{ord(c): '-' for c in '‐‑‒−'},
+    **{ord(c): '—' for c in '–―'},
+    **{ord(c): ' ' for c in '\u00a0\u2007\u2009\u202f\u3000'},
+    **{ord(c): None for c in '\u200b\u2060\ufeff\u00ad'},
+    # Full-width digits
+    **{0xFF10 + i: str(i) for i in range(10)},
+}
+ARABIC_DIGITS = {**{0x0660 + i: str(i) for i in range(10)}, **{0x06F0 + i: str(i) for i in range(10)},
+                 0x066B: '.', 0x066C: ','}
+DEVANAGARI_DIGITS = {0x0966 + i: str(i) for i in range(10)}
+
+_paragraph = re.compile(r'\n[^\S\n]*\n\s*')
+_space = re.compile(r'\s+')
+_space_before = re.compile(r' (?=[,.;:!?…%)\]}،؟।])|(?<=[(\[{]) ')
+_repeated = re.compile(r'([!?。！？])\1+|\.{3,}')
+_sentence_end = re.compile(r'([.!?…؟।॥]["\')\]]*) |([。！？][」』"\')）]*) ?(?=[^\n])')
+_last_word = re.compile(r'[a-z]+$')
+
+# --- Numbers ---------------------------------------------------------------
+
+EN_UNITS = ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+            'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen',
+            'nineteen']
+EN_TENS = [None, None, 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
+EN_ORDINALS = {'one': 'first', 'two': 'second', 'three': 'third', 'five': 'fifth', 'eight': 'eighth',
+               'nine': 'ninth', 'twelve': 'twelfth'}
+
+
+def _spell_en(n, british=False):
+    if n < 20:
+        return EN_UNITS[n]
+    if n < 100:
+        tens, unit = divmod(n, 10)
+        return EN_TENS[tens] + ('-' + EN_UNITS[unit] if unit else '')
+    if n < 1000:
+        hundreds, rest = divmod(n, 100)
+        words = EN_UNITS[hundreds] + ' hundred'
+        return words + ((' and ' if british else ' ') + _spell_en(rest, british) if rest else '')
+    for value, name in ((10 ** 9, 'billion'), (10 ** 6, 'million'), (1000, 'thousand')):
+        if n >= value:
+            count, rest = divmod(n, value)
+            words = _spell_en(count, british) + ' ' + name
+            if not rest:
+                return words
+            return words + (' and ' if british and rest < 100 else ' ') + _spell_en(rest, british)
+
+
+def _spell_en_uk(n):
+    return _spell_en(n, british=True)
+
+
+def _ordinal_en(words):
+    last = _last_word.search(words).group()
+    if last in EN_ORDINALS:
+        ordinal = EN_ORDINALS[last]
+    elif last.endswith('y'):
+        ordinal = last[:-1] + 'ieth'
+    else:
+        ordinal = last + 'th'
+    return words[:-len(last)] + ordinal
+
+
+ES_UNITS = ['cero', 'uno', 'dos', 'tres', 'cuatro', 'cinco', 'seis', 'siete', 'ocho', 'nueve', 'diez',
+            'once', 'doce', 'trece', 'catorce', 'quince', 'dieciséis', 'diecisiete', 'dieciocho',
+            'diecinueve', 'veinte', 'veintiuno', 'veintidós', 'veintitrés', 'veinticuatro', 'veinticinco',
+            'veintiséis', 'veintisiete', 'veintiocho', 'veintinueve']
+ES_TENS = [None, None, None, 'treinta', 'cuarenta', 'cincuenta', 'sesenta', 'setenta', 'ochenta', 'noventa']
+ES_HUNDREDS = [None, 'ciento', 'doscientos', 'trescientos', 'cuatrocientos', 'quinientos', 'seiscientos',
+               'setecientos', 'ochocientos', 'novecientos']
+
+
+def _es_below_1000(n):
+    if n == 100:
+        return 'cien'
+    hundreds, rest = divmod(n, 100)
+    words = [ES_HUNDREDS[hundreds]] if hundreds else []
+    if rest:
+        if rest < 30:
+            words.append(ES_UNITS[rest])
+        else:
+            tens, unit = divmod(rest, 10)
+            words.append(ES_TENS[tens] + (' y ' + ES_UNITS[unit] if unit else ''))
+    return ' '.join(words)
+
+
+def _es_apocope(words):
+    # "uno" shortens in front of mil and millones: veintiún mil, treinta y un millones
+    if words.endswith('veintiuno'):
+        return words[:-3] + 'ún'
+    return words[:-1] if words.endswith('uno') else words
+
+
+def _spell_es(n):
+    if n == 0:
+        return 'cero'
+    parts = []
+    count, n = divmod(n, 10 ** 6)
+    if count:
+        parts.append('un millón' if count == 1 else _es_apocope(_spell_es(count)) + ' millones')
+    count, n = divmod(n, 1000)
+    if count:
+        parts.append('mil' if count == 1 else _es_apocope(_es_below_1000(count)) + ' mil')
+    if n:
+        parts.append(_es_below_1000(n))
+    return ' '.join(parts)
+
+
+FR_UNITS = ['zéro', 'un', 'deux', 'trois', 'quatre', 'cinq', 'six', 'sept', 'huit', 'neuf', 'dix', 'onze',
+            'douze', 'treize', 'quatorze', 'quinze', 'seize']
+FR_TENS = [None, None, 'vingt', 'trente', 'quarante', 'cinquante', 'soixante', 'soixante', 'quatre-vingt',
+           'quatre-vingt']
+_fr_plural = re.compile(r'(vingt|cent)s$')
+
+
+def _fr_below_100(n):
+    if n <= 16:
+        return FR_UNITS[n]
+    if n < 20:
+        return 'dix-' + FR_UNITS[n - 10]
+    tens, unit = divmod(n, 10)
+    if tens in (7, 9):
+        # soixante-dix, soixante et onze, quatre-vingt-dix...
+        return FR_TENS[tens] + (' et ' if n == 71 else '-') + _fr_below_100(10 + unit)
+    if not unit:
+        return FR_TENS[tens] + ('s' if tens == 8 else '')
+    return FR_TENS[tens] + (' et un' if unit == 1 and tens != 8 else '-' + FR_UNITS[unit])
+
+
+def _fr_below_1000(n):
+    hundreds, rest = divmod(n, 100)
+    if not hundreds:
+        return _fr_below_100(rest)
+    words = 'cent' if hundreds == 1 else FR_UNITS[hundreds] + ' cent' + ('' if rest else 's')
+    return words + (' ' + _fr_below_100(rest) if rest else '')
+
+
+def _spell_fr(n):
+    if n == 0:
+        return 'zéro'
+    parts = []
+    for value, name in ((10 ** 9, 'milliard'), (10 ** 6, 'million')):
+        count, n = divmod(n, value)
+        if count:
+            parts.append(_fr_below_1000(count) + ' ' + name + ('s' if count > 1 else ''))
+    count, n = divmod(n, 1000)
+    if count:
+        # mille never takes an s, and vingt and cent lose theirs in front of it
+        parts.append('mille' if count == 1 else _fr_plural.sub(r'\1', _fr_below_1000(count)) + ' mille')
+    if n:
+        parts.append(_fr_below_1000(n))
+    return ' '.join(parts)
+
+
+DE_UNITS = ['null', 'eins', 'zwei', 'drei', 'vier', 'fünf', 'sechs', 'sieben', 'acht', 'neun', 'zehn', 'elf',
+            'zwölf', 'dreizehn', 'vierzehn', 'fünfzehn', 'sechzehn', 'siebzehn', 'achtzehn', 'neunzehn']
+DE_TENS = [None, None, 'zwanzig', 'dreißig', 'vierzig', 'fünfzig', 'sechzig', 'siebzig', 'achtzig', 'neunzig']
+
+
+def _de_below_1000(n):
+    hundreds, rest = divmod(n, 100)
+    words = (('ein' if hundreds == 1 else DE_UNITS[hundreds]) + 'hundert') if hundreds else ''
+    if rest < 20:
+        return words + (DE_UNITS[rest] if rest else '')
+    tens, unit = divmod(rest, 10)
+    return words + ((('ein' if unit == 1 else DE_UNITS[unit]) + 'und') if unit else '') + DE_TENS[tens]
+
+
+def _spell_de(n):
+    if n == 0:
+        return 'null'
+    parts = []
+    for value, one, many in ((10 ** 9, 'eine Milliarde', 'Milliarden'), (10 ** 6, 'eine Million', 'Millionen')):
+        count, n = divmod(n, value)
+        if count:
+            words = _de_below_1000(count)
+            parts.append(one if count == 1 else (words[:-1] + 'e' if words.endswith('eins') else words) + ' ' + many)
+    count, n = divmod(n, 1000)
+    # Everything below a million is one word: zweitausenddreihunderteins
+    words = ''
+    if count:
+        words = _de_below_1000(count)
+        words = (words[:-1] if words.endswith('eins') else words) + 'tausend'
+    if n:
+        words += _de_below_1000(n)
+    if words:
+        parts.append(words)
+    return ' '.join(parts)
+
+
+IT_UNITS = ['zero', 'uno', 'due', 'tre', 'quattro', 'cinque', 'sei', 'sette', 'otto', 'nove', 'dieci',
+            'undici', 'dodici', 'tredici', 'quattordici', 'quindici', 'sedici', 'diciassette', 'diciotto',
+            'diciannove']
+IT_TENS = [None, None, 'venti', 'trenta', 'quaranta', 'cinquanta', 'sessanta', 'settanta', 'ottanta', 'novanta']
+
+
+def _it_below_1000(n):
+    hundreds, rest = divmod(n, 100)
+    words = ('cento' if hundreds == 1 else IT_UNITS[hundreds] + 'cento') if hundreds else ''
+    if not rest:
+        return words
+    if rest < 20:
+        tail = 'tré' if rest == 3 and hundreds else IT_UNITS[rest]
+    else:
+        tens, unit = divmod(rest, 10)
+        tail = IT_TENS[tens]
+        if unit:
+            # ventuno, ventotto, ventitré
+            tail = (tail[:-1] if unit in (1, 8) else tail) + ('tré' if unit == 3 else IT_UNITS[unit])
+    if words and tail.startswith('o'):
+        # centotto, centottanta
+        words = words[:-1]
+    return words + tail
+
+
+def _spell_it(n):
+    if n == 0:
+        return 'zero'
+    parts = []
+    for value, one, many in ((10 ** 9, 'un miliardo', 'miliardi'), (10 ** 6, 'un milione', 'milioni')):
+        count, n = divmod(n, value)
+        if count:
+            parts.append(one if count == 1 else _it_below_1000(count) + ' ' + many)
+    count, n = divmod(n, 1000)
+    words = ('mille' if count == 1 else _it_below_1000(count) + 'mila') if count else ''
+    if n:
+        words += _it_below_1000(n)
+    if words:
+        parts.append(words)
+    return ' '.join(parts)
+
+
+PT_UNITS = ['zero', 'um', 'dois', 'três', 'quatro', 'cinco', 'seis', 'sete', 'oito', 'nove', 'dez', 'onze',
+            'doze', 'treze', 'catorze', 'quinze', 'dezesseis', 'dezessete', 'dezoito', 'dezenove']
+PT_TENS = [None, None, 'vinte', 'trinta', 'quarenta', 'cinquenta', 'sessenta', 'setenta', 'oitenta', 'noventa']
+PT_HUNDREDS = [None, 'cento', 'duzentos', 'trezentos', 'quatrocentos', 'quinhentos', 'seiscentos',
+               'setecentos', 'oitocentos', 'novecentos']
+
+
+def _pt_below_1000(n):
+    if n == 100:
+        return 'cem'
+    hundreds, rest = divmod(n, 100)
+    words = [PT_HUNDREDS[hundreds]] if hundreds else []
+    if rest:
+        tens, unit = divmod(rest, 10)
+        words.append(PT_UNITS[rest] if rest < 20 else PT_TENS[tens] + (' e ' + PT_UNITS[unit] if unit else ''))
+    return ' e '.join(words)
+
+
+def _spell_pt(n):
+    if n == 0:
+        return 'zero'
+    groups = []
+    for value, one, many in ((10 ** 9, 'um bilhão', 'bilhões'), (10 ** 6, 'um milhão', 'milhões')):
+        count, n = divmod(n, value)
+        if count:
+            groups.append(one if count == 1 else _pt_below_1000(count) + ' ' + many)
+    count, n = divmod(n, 1000)
+    if count:
+        groups.append('mil' if count == 1 else _pt_below_1000(count) + ' mil')
+    if n:
+        groups.append(_pt_below_1000(n))
+    # "e" joins the last group when it is below a hundred or a round hundred
+    if len(groups) > 1 and n and (n < 100 or n % 100 == 0):
+        return ' '.join(groups[:-1]) + ' e ' + groups[-1]
+    return ' '.join(groups)
+
+
+RU_UNITS = ['ноль', 'один', 'два', 'три', 'четыре', 'пять', 'шесть', 'семь', 'восемь', 'девять', 'десять',
+            'одиннадцать', 'двенадцать', 'тринадцать', 'четырнадцать', 'пятнадцать', 'шестнадцать',
+            'семнадцать', 'восемнадцать', 'девятнадцать']
+RU_TENS = [None, None, 'двадцать', 'тридцать', 'сорок', 'пятьдесят', 'шестьдесят', 'семьдесят',
+           'восемьдесят', 'девяносто']
+RU_HUNDREDS = [None, 'сто', 'двести', 'триста', 'четыреста', 'пятьсот', 'шестьсот', 'семьсот', 'восемьсот',
+               'девятьсот']
+RU_SCALES = ((10 ** 9, ('миллиард', 'миллиарда', 'миллиардов'), False),
+             (10 ** 6, ('миллион', 'миллиона', 'миллионов'), False),
+             (1000, ('тысяча', 'тысячи', 'тысяч'), True))
+
+
+def _ru_below_1000(n, feminine=False):
+    hundreds, rest = divmod(n, 100)
+    words = [RU_HUNDREDS[hundreds]] if hundreds else []
+    if rest >= 20:
+        words.append(RU_TENS[rest // 10])
+        rest %= 10
+    if rest:
+        # одна тысяча, две тысячи
+        words.append({1: 'одна', 2: 'две'}[rest] if feminine and rest in (1, 2) else RU_UNITS[rest])
+    return ' '.join(words)
+
+
+def _ru_plural(n, one, few, many):
+    if 11 <= n % 100 <= 14:
+        return many
+    return {1: one, 2: few, 3: few, 4: few}.get(n % 10, many)
+
+
+def _spell_ru(n):
+    if n == 0:
+        return 'ноль'
+    parts = []
+    for value, forms, feminine in RU_SCALES:
+        count, n = divmod(n, value)
+        if count:
+            parts += [_ru_below_1000(count, feminine), _ru_plural(count, *forms)]
+    if n:
+        parts.append(_ru_below_1000(n))
+    return ' '.join(parts)
+
+
+# Longer digit strings are codes, not amounts, and stay as they are
+MAX_DIGITS = 12
+
+# --- Languages ---------------------------------------------------------------
+
+EN_MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september',
+             'october', 'november', 'december']
+EN_TITLES = {'Mr': 'mister', 'Mrs': 'missus', 'Dr': 'doctor', 'Prof': 'professor', 'Jr': 'junior',
+             'Sr': 'senior'}
+EN_ABBREVIATIONS = {'etc.': 'et cetera', 'vs.': 'versus', 'approx.': 'approximately', 'e. g.': 'for example',
+                    'i. e.': 'that is'}
+
+# spell: number -> words (None keeps digits); thousands/decimal: separators
+# in written numbers; point: how the decimal separator is read; dates: the
+# order of numeric dates; months: names by month, with alternatives after a
+# "|"; titles expand with or without their dot, abbreviations need theirs
+LANGUAGE_RULES = {
+    'en': {
+        'spell': _spell_en, 'ordinal': _ordinal_en, 'thousands': ',', 'decimal': '.', 'point': 'point',
+        'dates': 'MDY',
+        'months': [m + '|' + m[:3] + ('|sept' if m == 'september' else '') for m in EN_MONTHS],
+        'titles': EN_TITLES, 'abbreviations': EN_ABBREVIATIONS,
+    },
+    'en-uk': {
+        'spell': _spell_en_uk, 'ordinal': _ordinal_en, 'thousands': ',', 'decimal': '.', 'point': 'point',
+        'dates': 'DMY',
+        'months': [m + '|' + m[:3] + ('|sept' if m == 'september' else '') for m in EN_MONTHS],
+        'titles': dict(EN_TITLES, Ms='miz'), 'abbreviations': EN_ABBREVIATIONS,
+    },
+    'es': {
+        'spell': _spell_es, 'thousands': '. ', 'decimal': ',', 'point': 'coma', 'dates': 'DMY',
+        'months': ['enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio', 'agosto',
+                   'septiembre|setiembre', 'octubre', 'noviembre', 'diciembre'],
+        'titles': {'Sr': 'señor', 'Sra': 'señora', 'Srta': 'señorita', 'Dr': 'doctor', 'Dra': 'doctora',
+                   'Ud': 'usted', 'Uds': 'ustedes'},
+        'abbreviations': {'etc.': 'etcétera', 'p. ej.': 'por ejemplo'},
+    },
+    'fr': {
+        'spell': _spell_fr, 'thousands': ' .', 'decimal': ',', 'point': 'virgule', 'dates': 'DMY',
+        'months': ['janvier', 'février', 'mars', 'avril', 'mai', 'juin', 'juillet', 'août', 'septembre',
+                   'octobre', 'novembre', 'décembre'],
+        'titles': {'Mme': 'madame', 'Mlle': 'mademoiselle', 'Dr': 'docteur', 'Pr': 'professeur'},
+        'abbreviations': {'M.': 'monsieur', 'etc.': 'et cetera', 'p. ex.': 'par exemple'},
+    },
+    'de': {
+        'spell': _spell_de, 'thousands': '. ', 'decimal': ',', 'point': 'Komma', 'dates': 'DMY',
+        'months': ['januar|jänner', 'februar', 'märz', 'april', 'mai', 'juni', 'juli', 'august', 'september',
+                   'oktober', 'november', 'dezember'],
+        'titles': {},
+        'abbreviations': {'Dr.': 'Doktor', 'Prof.': 'Professor', 'z. B.': 'zum Beispiel', 'usw.': 'und so weiter',
+                          'bzw.': 'beziehungsweise', 'd. h.': 'das heißt', 'ca.': 'circa', 'Nr.': 'Nummer'},
+    },
+    'it': {
+        'spell': _spell_it, 'thousands': '. ', 'decimal': ',', 'point': 'virgola', 'dates': 'DMY',
+        'months': ['gennaio', 'febbraio', 'marzo', 'aprile', 'maggio', 'giugno', 'luglio', 'agosto',
+                   'settembre', 'ottobre', 'novembre', 'dicembre'],
+        'titles': {'Sig': 'signor', 'Sigg': 'signori', 'Dott': 'dottor', 'Prof': 'professor'},
+        'abbreviations': {'Sig.ra': 'signora', 'ecc.': 'eccetera'},
+    },
+    'pt': {
+        'spell': _spell_pt, 'thousands': '. ', 'decimal': ',', 'point': 'vírgula', 'dates': 'DMY',
+        'months': ['janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho', 'julho', 'agosto', 'setembro',
+                   'outubro', 'novembro', 'dezembro'],
+        'titles': {'Sr': 'senhor', 'Sra': 'senhora', 'Dr': 'doutor', 'Dra': 'doutora'},
+        'abbreviations': {'etc.': 'etcétera', 'p. ex.': 'por exemplo'},
+    },
+    'ru': {
+        'spell': _spell_ru, 'thousands': ' ', 'decimal': ',', 'point': 'запятая', 'dates': 'DMY',
+        # Genitive, as in dates
+        'months': ['января', 'февраля', 'марта', 'апреля', 'мая', 'июня', 'июля', 'августа', 'сентября',
+                   'октября', 'ноября', 'декабря'],
+        'year_suffix': r'(?: ?(?:года|г\.))?',
+        'titles': {},
+        'abbreviations': {'т. е.': 'то есть', 'т. д.': 'так далее', 'т. п.': 'тому подобное', 'др.': 'другие'},
+    },
+    'ja': {'thousands': ',，', 'decimal': '.', 'dates': 'YMD'},
+    'ko': {'thousands': ',，', 'decimal': '.', 'dates': 'YMD'},
+    'zh-cn': {'thousands': ',，', 'decimal': '.', 'dates': 'YMD'},
+    'hi': {'thousands': ',', 'decimal': '.', 'dates': 'DMY', 'digits': DEVANAGARI_DIGITS,
+           'abbreviations': {'डॉ.': 'डॉक्टर'}},
+    'ar': {'thousands': ',', 'decimal': '.', 'dates': 'DMY', 'digits': ARABIC_DIGITS,
+           'abbreviations': {'د.': 'دكتور'}},
+}
+
+
+def _alternation(words):
+    # Longest first, so a prefix never wins over the whole word
+    return '|'.join(sorted(words, key=len, reverse=True))
+
+
+def _abbreviation_pattern(abbreviation):
+    # The spaces inside "z. B." are optional
+    return re.escape(abbreviation).replace(r'\ ', ' ?')
+
+
+def _compact(abbreviation):
+    return abbreviation.replace(' ', '')
+
+
+class RuleSet:
+    """The compiled rules for one language (or the language-neutral ones for None)."""
+
+    def __init__(self, lang=None):
+        rules = LANGUAGE_RULES.get(lang, {})
+        self.lang = lang
+        self.table = {**UNICODE_FOLDS, **rules.get('digits', {})}
+        self.spell = rules.get('spell')
+        self.ordinal = rules.get('ordinal')
+        self.point = rules.get('point')
+        self.order = rules.get('dates')
+        self.months = {}
+        for number, names in enumerate(rules.get('months', []), 1):
+            for name in names.split('|'):
+                self.months[name] = number
+        self.abbreviations = {_compact(a): words for a, words in rules.get('abbreviations', {}).items()}
+        self.titles = rules.get('titles', {})
+        self.tokens = self._compile(rules) if rules else None
+
+    def _compile(self, rules):
+        alternatives = []
+        year_suffix = rules.get('year_suffix', '')
+        # Digits can't be bounded by \b in scripts whose letters count as
+        # word characters right next to them (価格は1000円)
+        before, after = (r'(?<!\w)', r'(?!\w)') if self.spell else (r'(?<![\d.,])', r'(?![\d]|[.,]\d)')
+        if self.months:
+            month = f"(?i:{_alternation(re.escape(m) for m in self.months)})"
+            alternatives.append(
+                rf"(?P<day_month>(?<!\w)(?P<dm_d>\d{{1,2}})(?:st|nd|rd|th|er|º|\.)? ?(?:de )?"
+                rf"(?P<dm_m>{month})\.?,? (?:de )?(?P<dm_y>\d{{4}}){year_suffix}(?!\w))"
+            )
+            alternatives.append(
+                rf"(?P<month_day>(?<!\w)(?P<md_m>{month})\.? (?P<md_d>\d{{1,2}})(?:st|nd|rd|th)?,? "
+                rf"(?P<md_y>\d{{4}})(?!\w))"
+            )
+        alternatives.append(r'(?P<iso>(?<![\w.-])(?P<iso_y>\d{4})-(?P<iso_m>\d{1,2})-(?P<iso_d>\d{1,2})(?![\w-]))')
+        if self.order == 'YMD':
+            alternatives.append(r'(?P<numeric>(?<![\d./])(?P<n1>\d{4})(?P<sep>[./])(?P<n2>\d{1,2})(?P=sep)'
+                                r'(?P<n3>\d{1,2})(?![\d]|[./]\d))')
+        else:
+            alternatives.append(r'(?P<numeric>(?<![\w./-])(?P<n1>\d{1,2})(?P<sep>[./-])(?P<n2>\d{1,2})(?P=sep)'
+                                rf'(?P<n3>\d{{4}}){year_suffix}(?![\w]|[./-]\d))')
+        if self.ordinal:
+            alternatives.append(r'(?P<ordinal>(?<!\w)(?P<ord_n>\d{1,12})(?i:st|nd|rd|th)(?!\w))')
+        groups = '|'.join(re.escape(separator) for separator in rules['thousands'])
+        alternatives.append(
+            rf"(?P<number>{before}(?P<int>\d{{1,3}}(?:(?P<grp>{groups})\d{{3}})(?:(?P=grp)\d{{3}})*|\d+)"
+            rf"(?:{re.escape(rules['decimal'])}(?P<frac>\d+))?{after})"
+        )
+        if self.titles:
+            alternatives.append(rf"(?P<title>(?<!\w)(?:{_alternation(re.escape(t) for t in self.titles)})\.?(?!\w))")
+        if self.abbreviations:
+            patterns = _alternation(_abbreviation_pattern(a) for a in rules['abbreviations'])
+            # Abbreviations end in a dot, so only the start needs a boundary
+            alternatives.append(rf"(?P<abbreviation>(?<!\w)(?:{patterns}))")
+        # Every alternative starts with one of these characters, and most
+        # positions in a text can be ruled out by that one check
+        first = set('0123456789')
+        for word in (*self.months, *self.titles, *self.abbreviations):
+            first.update((word[0].lower(), word[0].upper()))
+        starts = ''.join(re.escape(c) for c in sorted(first))
+        boundary = r'(?<!\w)' if self.spell else ''
+        return re.compile(rf"{boundary}(?=[{starts}])(?:{'|'.join(alternatives)})")
+
+    def _date(self, year, month, day, match):
+        year, month, day = int(year), int(month), int(day)
+        if not (1 <= month <= 12 and 1 <= day <= 31):
+            return match.group()
+        return f"{year:04d}-{month:02d}-{day:02d}"
+
+    def _number(self, match):
+        digits = match.group('int')
+        if match.group('grp'):
+            digits = digits.replace(match.group('grp'), '')
+        frac = match.group('frac')
+        # Leading zeros and long runs are codes and phone numbers: keep them
+        if (len(digits) > 1 and digits[0] == '0') or len(digits) > MAX_DIGITS:
+            return match.group()
+        if self.spell is None:
+            return digits + ('.' + frac if frac else '')
+        words = self.spell(int(digits))
+        if frac:
+            words += f" {self.point} " + ' '.join(self.spell(int(d)) for d in frac)
+        return words
+
+    def expand(self, match):
+        kind = match.lastgroup
+        if kind == 'day_month':
+            return self._date(match.group('dm_y'), self.months[match.group('dm_m').lower()],
+                              match.group('dm_d'), match)
+        if kind == 'month_day':
+            return self._date(match.group('md_y'), self.months[match.group('md_m').lower()],
+                              match.group('md_d'), match)
+        if kind == 'iso':
+            return self._date(match.group('iso_y'), match.group('iso_m'), match.group('iso_d'), match)
+        if kind == 'numeric':
+            first, second, third = match.group('n1', 'n2', 'n3')
+            if self.order == 'YMD':
+                return self._date(first, second, third, match)
+            if self.order == 'MDY':
+                return self._date(third, first, second, match)
+            return self._date(third, second, first, match)
+        if kind == 'ordinal':
+            return self.ordinal(self.spell(int(match.group('ord_n'))))
+        if kind == 'number':
+            return self._number(match)
+        if kind == 'title':
+            return self.titles[match.group().rstrip('.')]
+        return self.abbreviations[_compact(match.group())]
+
+    def normalize(self, text):
+        text = unicodedata.normalize('NFC', text).translate(self.table)
+        text = _repeated.sub(lambda m: m.group(1) or '…', text)
+        paragraphs = (_space.sub(' ', p).strip() for p in _paragraph.split(text))
+        text = '\n'.join(p for p in paragraphs if p)
+        text = _space_before.sub('', text)
+        if self.tokens is not None:
+            text = self.tokens.sub(self.expand, text)
+        return _sentence_end.sub(lambda m: (m.group(1) or m.group(2)) + '\n', text).strip()
+
+
+_rule_sets = {}
+_rule_sets_lock = threading.Lock()
+
+
+def rules(lang=None):
+    """The RuleSet for lang, compiled on first use; unknown codes get the neutral one."""
+    if lang not in LANGUAGE_RULES:
+        lang = None
+    rule_set = _rule_sets.get(lang)
+    if rule_set is None:
+        with _rule_sets_lock:
+            rule_set = _rule_sets.get(lang)
+            if rule_set is None:
+                rule_set = _rule_sets[lang] = RuleSet(lang)
+    return rule_set
+
+
+def normalize(text, lang=None):
+    """Canonical form of text for lang: one sentence per line, see the module docstring."""
+    return rules(lang).normalize(text)
+
+
+def sentences(text, lang=None):
+    return normalize(text, lang).split('\n')
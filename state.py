@@ -0,0 +1,64 @@
+"""
+Where shared state lives.
+
+By default everything stays on this machine: SQLite databases and
+directories relative to the working directory, which is enough for one
+Streamlit server. Pointing VOICECRAFT_STATE_URL at a Redis server
+(redis://host:6379/0, rediss://... or unix://...; anything speaking the
+Redis protocol, e.g. Valkey or KeyDB) moves users, history metadata and
+audio, the synthesis cache and job status there instead, so any number of
+replicas behind a load balancer see the same data and any of them can
+serve a user.
+
+The redis package is only needed (and only imported) when the URL is set.
+"""
+import os
+import threading
+
+STATE_URL = os.environ.get('VOICECRAFT_STATE_URL', '')
+# Every key is prefixed, so one Redis database can hold several deployments
+KEY_PREFIX = os.environ.get('VOICECRAFT_STATE_PREFIX', 'voicecraft:')
+
+
+class StateUnavailable(Exception):
+    pass
+
+
+def shared():
+    """True when state is kept in Redis rather than on local disk."""
+    return bool(STATE_URL)
+
+
+def _escape(part):
+    # Usernames and other values may contain ':' themselves
+    return str(part).replace('%', '%25').replace(':', '%3A')
+
+
+def key(*parts):
+    return KEY_PREFIX + ':'.join(_escape(part) for part in parts)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_redis(url=None):
+    """
+    The process-wide Redis client for VOICECRAFT_STATE_URL (or a new one for
+    url). Clients pool their connections and are safe to share between
+    session threads.
+    """
+    global _client
+    try:
+        import redis
+    except ImportError:
+        raise StateUnavailable("VOICECRAFT_STATE_URL is set but the redis package is not installed "
+                               "(pip install redis)") from None
+    if url is not None:
+        return redis.Redis.from_url(url, health_check_interval=30)
+    with _client_lock:
+        if _client is None:
+            if not STATE_URL:
+                raise StateUnavailable("VOICECRAFT_STATE_URL is not set")
+            _client = redis.Redis.from_url(STATE_URL, health_check_interval=30)
+        return _client
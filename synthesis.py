@@ -0,0 +1,146 @@
+"""
+Speech synthesis entry points shared by the Streamlit app and the headless
+batch tools. Nothing in here imports streamlit, and the engines and the
+numpy post-processing are only imported on first use (or by warm_up()).
+"""
+import io
+import threading
+import time
+
+from audio_cache import get_audio_cache
+from backends import BackendUnavailable, backends, get_backend, select_backend
+from metrics import span
+
+
+def synthesize(text, backend, lang='en', slow=False, voice_type='normal', gender='female'):
+    """
+    Synthesize text with the named backend (or a Backend instance) through
+    the audio cache. Returns (buffer, error) like the other entry points.
+    """
+    try:
+        if isinstance(backend, str):
+            backend = get_backend(backend)
+    except Exception as e:
+        return None, str(e)
+    cache = get_audio_cache()
+    key = backend.cache_key(text, lang, slow, voice_type, gender)
+    with span('cache_lookup', engine=backend.name, lang=lang, voice_type=voice_type):
+        cached = cache.get(key)
+    if cached is not None:
+        return io.BytesIO(cached), None
+    started = time.perf_counter()
+    try:
+        with span('synthesize', engine=backend.name, lang=lang, voice_type=voice_type):
+            data = backend.synthesize(text, lang=lang, voice_type=voice_type, gender=gender, slow=slow)
+    except Exception as e:
+        backend.record(len(text), time.perf_counter() - started, ok=False)
+        return None, str(e)
+    backend.record(len(text), time.perf_counter() - started)
+    cache.put(key, data)
+    return io.BytesIO(data), None
+
+
+def synthesizer(lang='en', backend=None, slow=False, voice_type='normal', gender='female',
+                fmt=None, bitrate=None, sample_rate=None, fallback=True):
+    """
+    chunk -> (buffer, error) callable for the chunking/job helpers.
+
+    With no backend given, the fastest available one for lang is chosen
+    once, up front, so every chunk of a conversion uses the same voice. If
+    it fails before any chunk has come back and fallback is set, the next
+    best one takes over the whole conversion. The callable's
+    segment_key(text) is (backend name, audio cache key) for text from the
+    backend the conversion is using now, for callers that splice in audio
+    from earlier runs. Returns (callable, backend_name, finish) where
+    backend_name is the first choice and finish(parts) joins and
+    post-processes the chunks and encodes them as fmt (see audio_effects;
+    None keeps the engine's container).
+    """
+    from audio_effects import finisher
+
+    def finisher_for(chosen):
+        return finisher(voice_type, native_styles=bool(chosen.capabilities.get('voice_styles')),
+                        fmt=fmt, bitrate=bitrate, sample_rate=sample_rate)
+
+    if backend is not None:
+        require = ()
+        first = get_backend(backend)
+        # Asked for by name, so never swapped for another
+        fallback = False
+    else:
+        require = ('voice_styles',) if voice_type != 'normal' else ()
+        first = select_backend(lang, require=require)
+    # Which backend the conversion uses, and whether a chunk has succeeded on it
+    chosen = {'backend': first, 'settled': False, 'tried': set()}
+    lock = threading.Lock()
+
+    def synthesize_chunk(chunk):
+        while True:
+            with lock:
+                current = chosen['backend']
+            buffer, error = synthesize(chunk, current, lang=lang, slow=slow, voice_type=voice_type, gender=gender)
+            with lock:
+                if chosen['backend'] is not current:
+                    # Another chunk switched backends meanwhile; redo this one to match
+                    continue
+                if buffer is not None:
+                    chosen['settled'] = True
+                    return buffer, None
+                if chosen['settled'] or not fallback:
+                    return None, error
+                chosen['tried'].add(current.name)
+                try:
+                    chosen['backend'] = select_backend(lang, require=require, exclude=chosen['tried'])
+                except BackendUnavailable:
+                    return None, error
+
+    def segment_key(text):
+        current = chosen['backend']
+        return current.name, current.cache_key(text, lang, slow, voice_type, gender)
+
+    def finish(parts):
+        return finisher_for(chosen['backend'])(parts)
+
+    synthesize_chunk.segment_key = segment_key
+    return synthesize_chunk, first.name, finish
+
+
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+
+def _warm_up():
+    import audio_effects  # noqa: F401
+    for backend in backends():
+        if backend.available():
+            try:
+                backend.warm_up()
+            except Exception as e:
+                # Installed but unusable here (e.g. pyttsx3 without eSpeak):
+                # don't let Auto pick it
+                backend.mark_broken(str(e))
+
+
+def warm_up():
+    """
+    Load the engines, probe their voices and import the audio pipeline on a
+    background thread so the first conversion doesn't pay for it. Only the
+    first call in a process starts anything; returns the thread.
+    """
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=_warm_up, name='synthesis-warm-up', daemon=True)
+            _warm_up_thread.start()
+        return _warm_up_thread
+
+
+def text_to_speech(text, lang='en', slow=False):
+    return synthesize(text, 'gtts', lang=lang, slow=slow)
+
+
+def text_to_speech_advanced(text, voice_type='normal', gender='female', emotion='neutral'):
+    """
+    Advanced TTS with voice and emotion options using the pooled pyttsx3 engines
+    """
+    return synthesize(text, 'pyttsx3', voice_type=voice_type, gender=gender)
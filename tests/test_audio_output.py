@@ -0,0 +1,141 @@
+"""
+Every pyttsx3 job gets its own audio, however many run at once.
+
+EspeakLikeEngine stands in for pyttsx3 with eSpeak's quirks: audio goes to
+whichever engine in the process was created last and voice, rate and
+volume are process-global, so sharing a process between workers shows up
+as crossed or mis-styled audio.
+"""
+import threading
+import wave
+
+import pytest
+
+from audio_output import OutputTarget
+from engine_pool import VOICE_PRESETS, EnginePool
+
+JOBS = 32
+VOICE_TYPES = sorted(VOICE_PRESETS)
+
+
+class _Voice:
+    def __init__(self, voice_id):
+        self.id = voice_id
+
+
+class EspeakLikeEngine:
+    latest = None
+    properties = {}
+
+    def __init__(self):
+        EspeakLikeEngine.latest = self
+        EspeakLikeEngine.properties.update(voice='male-voice', rate=200, volume=1.0)
+        self.pending = []
+        self.path = None
+
+    def getProperty(self, name):
+        if name == 'voices':
+            return [_Voice('male-voice'), _Voice('female-voice')]
+        return EspeakLikeEngine.properties[name]
+
+    def setProperty(self, name, value):
+        EspeakLikeEngine.properties[name] = value
+
+    def save_to_file(self, text, path):
+        self.pending.append(text)
+        self.path = path
+
+    def runAndWait(self):
+        for text in self.pending:
+            props = EspeakLikeEngine.properties
+            payload = f"{text}|{props['voice']}|{props['rate']}|{props['volume']}".encode()
+            # Like eSpeak's synth callback: the latest engine's file gets it
+            with wave.open(EspeakLikeEngine.latest.path, 'wb') as out:
+                out.setnchannels(1)
+                out.setsampwidth(1)
+                out.setframerate(8000)
+                out.writeframes(payload)
+        self.pending = []
+
+
+def expected(i):
+    voice_type = VOICE_TYPES[i % len(VOICE_TYPES)]
+    gender = ('male', 'female')[i % 2]
+    rate, volume = VOICE_PRESETS[voice_type]
+    return f"job {i}", voice_type, gender, f"job {i}|{gender}-voice|{rate}|{volume}".encode()
+
+
+def run_concurrently(fn, count):
+    results = [None] * count
+    errors = []
+    start = threading.Barrier(count)
+
+    def worker(i):
+        try:
+            start.wait()
+            results[i] = fn(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=120)
+    assert not errors
+    return results
+
+
+def test_output_targets_are_private():
+    written = threading.Barrier(JOBS)
+
+    def write_and_read(i):
+        payload = f"target {i}".encode() * 1000
+        with OutputTarget() as target:
+            with open(target.path, 'wb') as f:
+                f.write(payload)
+            # Everyone's target is open and written before anyone reads
+            written.wait()
+            return target.path, target.read() == payload
+
+    results = run_concurrently(write_and_read, JOBS)
+    assert all(matches for _, matches in results)
+    assert len({path for path, _ in results}) == JOBS
+
+
+def test_parallel_jobs_get_their_own_audio():
+    pool = EnginePool(size=4, queue_size=JOBS, engine_factory=EspeakLikeEngine)
+    try:
+        def synthesize(i):
+            text, voice_type, gender, _ = expected(i)
+            return pool.synthesize(text, voice_type=voice_type, gender=gender)
+
+        results = run_concurrently(synthesize, JOBS)
+    finally:
+        pool.shutdown()
+    for i, data in enumerate(results):
+        assert data[:4] == b'RIFF'
+        assert data.endswith(expected(i)[3]), i
+
+
+def test_parallel_jobs_match_sequential_output_with_real_driver():
+    pytest.importorskip('pyttsx3')
+    texts = [f"Sentence number {i} for the concurrency check." for i in range(8)]
+    reference = EnginePool(size=1)
+    try:
+        try:
+            reference.warm_up()[0].result(timeout=60)
+        except Exception as e:
+            pytest.skip(f"no working pyttsx3 driver here: {e}")
+        alone = [reference.synthesize(text, voice_type=VOICE_TYPES[i % len(VOICE_TYPES)])
+                 for i, text in enumerate(texts)]
+    finally:
+        reference.shutdown()
+
+    pool = EnginePool(size=4)
+    try:
+        together = run_concurrently(
+            lambda i: pool.synthesize(texts[i], voice_type=VOICE_TYPES[i % len(VOICE_TYPES)]), len(texts))
+    finally:
+        pool.shutdown()
+    assert together == alone
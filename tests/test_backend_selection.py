@@ -0,0 +1,128 @@
+"""Backends that can't work here are taken out of Auto's choices."""
+import io
+import wave
+
+import pytest
+
+import backends
+import synthesis
+from backends import Backend, BackendUnavailable
+
+
+def tone(text):
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(1)
+        writer.setframerate(8000)
+        writer.writeframes(text.encode())
+    return out.getvalue()
+
+
+class FakeBackend(Backend):
+    capabilities = {'languages': None, 'format': 'wav'}
+
+    def __init__(self, name, seconds_per_char, fail=False, warm_up_error=None):
+        super().__init__()
+        self.name = name
+        self.expected_seconds_per_char = seconds_per_char
+        self.fail = fail
+        self.warm_up_error = warm_up_error
+        self.calls = 0
+
+    def warm_up(self):
+        if self.warm_up_error:
+            raise RuntimeError(self.warm_up_error)
+
+    def synthesize(self, text, lang='en', voice_type='normal', gender='female', slow=False):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError(f"{self.name} is down")
+        return tone(f"{self.name}:{text}")
+
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path):
+    import audio_cache
+    import audio_effects
+    monkeypatch.setattr(backends, '_registry', {})
+    monkeypatch.setattr(audio_cache, '_cache', audio_cache.AudioCache(str(tmp_path)))
+    monkeypatch.setattr(audio_effects, 'ENABLED', False)
+    return backends
+
+
+def test_failed_warm_up_marks_backend_broken(registry):
+    fast = registry.register_backend(FakeBackend('fast', 0.001, warm_up_error="no eSpeak"))
+    registry.register_backend(FakeBackend('slow', 0.01))
+    synthesis._warm_up()
+    assert not fast.available()
+    assert fast.broken == "no eSpeak"
+    assert registry.select_backend('en').name == 'slow'
+
+
+def test_auto_falls_back_before_the_first_chunk(registry):
+    fast = registry.register_backend(FakeBackend('fast', 0.001, fail=True))
+    registry.register_backend(FakeBackend('slow', 0.01))
+    synthesize, engine, finish = synthesis.synthesizer('en')
+    assert engine == 'fast'
+    buffer, error = synthesize("hello")
+    assert error is None
+    assert finish([buffer.getvalue()]).endswith(b'slow:hello')
+    assert fast.calls == 1
+
+
+def test_auto_keeps_its_backend_once_a_chunk_succeeded(registry):
+    fast = registry.register_backend(FakeBackend('fast', 0.001))
+    registry.register_backend(FakeBackend('slow', 0.01))
+    synthesize, _, _ = synthesis.synthesizer('en')
+    assert synthesize("one")[1] is None
+    fast.fail = True
+    buffer, error = synthesize("two")
+    assert buffer is None and error == "fast is down"
+
+
+def test_no_fallback_when_disabled_or_exhausted(registry):
+    fast = registry.register_backend(FakeBackend('fast', 0.001, fail=True))
+    slow = registry.register_backend(FakeBackend('slow', 0.01, fail=True))
+    synthesize, _, _ = synthesis.synthesizer('en', fallback=False)
+    assert synthesize("hello")[1] == "fast is down"
+    assert slow.calls == 0
+    synthesize, _, _ = synthesis.synthesizer('en')
+    assert synthesize("hello")[1] is not None
+    assert (fast.calls, slow.calls) == (2, 1)
+    with pytest.raises(BackendUnavailable):
+        registry.select_backend('en', exclude=('fast', 'slow'))
+
+
+def test_incremental_reuse_stays_in_one_voice_across_a_fallback(registry):
+    from incremental import incremental_task, plan
+    from jobs import Job
+
+    fast = registry.register_backend(FakeBackend('fast', 0.001))
+    slow = registry.register_backend(FakeBackend('slow', 0.01))
+
+    def run(text, previous=None):
+        synthesize, _, finish = synthesis.synthesizer('en')
+        generation = plan(text, 'settings', previous)
+        job = Job('someone', {'reused': generation.reused})
+        job.started = 0
+        audio = incremental_task(generation, synthesize, synthesize.segment_key, finish=finish)(job)
+        return generation, job, audio
+
+    first, _, audio = run("One. Two. Three.")
+    assert audio.count(b'fast:') == 3
+    assert {key[0] for key in first.keys} == {'fast'}
+
+    # The edit goes to a backend that is down now: everything moves to slow
+    fast.fail = True
+    second, job, audio = run("One. Two. Four.", first)
+    assert audio.count(b'slow:') == 3 and b'fast:' not in audio
+    assert {key[0] for key in second.keys} == {'slow'}
+
+    # Fast is back and first choice again: slow's sentences aren't mixed in
+    fast.fail = False
+    fast.failed_at = None
+    fast.seconds_per_char, slow.seconds_per_char = 0.001, 0.01
+    third, job, audio = run("One. Two. Four.", second)
+    assert audio.count(b'fast:') == 3
+    assert job.meta['reused'] == 0
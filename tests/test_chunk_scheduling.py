@@ -0,0 +1,56 @@
+"""Chunks from many jobs share one pool without starving short jobs."""
+import io
+import threading
+
+import pytest
+
+from chunking import PriorityExecutor, job_priority, stream_chunks
+from jobs import JobManager, Overloaded
+
+
+def test_lowest_priority_runs_first():
+    executor = PriorityExecutor(1)
+    gate = threading.Event()
+    order = []
+    # Occupies the only worker while the rest queue up
+    executor.submit(gate.wait)
+    futures = []
+    for priority, name in ((30.0, 'long'), (10.0, 'short'), (20.0, 'medium'), (10.0, 'short again')):
+        with job_priority(priority):
+            futures.append(executor.submit(order.append, name))
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert order == ['short', 'short again', 'medium', 'long']
+
+
+def test_stream_keeps_a_bounded_window():
+    started = []
+
+    def synthesize(chunk):
+        started.append(chunk)
+        return io.BytesIO(chunk.encode()), None
+
+    parts = []
+    for index, total, data in stream_chunks([f"chunk {i}" for i in range(50)], synthesize, window=3):
+        # Never more than the window ahead of what has been consumed
+        assert len(started) <= index + 3
+        assert total == 50
+        parts.append(data)
+    assert parts == [f"chunk {i}".encode() for i in range(50)]
+
+
+def test_cancelled_jobs_free_their_queue_slots():
+    manager = JobManager(workers=1, per_user=1, queue_slo=float('inf'), queue_size=2)
+    gate, running = threading.Event(), threading.Event()
+    manager.submit('runner', lambda job: running.set() or gate.wait())
+    running.wait(timeout=5)
+    try:
+        for name in ('a', 'b'):
+            manager.cancel(manager.submit(name, bytes))
+        waiting = [manager.submit(name, bytes) for name in ('c', 'd')]
+        with pytest.raises(Overloaded, match='already waiting'):
+            manager.submit('e', bytes)
+    finally:
+        gate.set()
+    assert manager.rejected == 1 and len(waiting) == 2
@@ -0,0 +1,92 @@
+"""The pooled gTTS transport against the local mock endpoint."""
+import threading
+import types
+
+import pytest
+
+import gtts_transport
+from benchmarks.mock_gtts import fake_frame, parse_fragment, serve
+from gtts_transport import GTTSTransport, GTTSTransportError
+
+pytest.importorskip('gtts')
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Record backoff delays instead of waiting them out
+    slept = []
+    monkeypatch.setattr(gtts_transport, 'time', types.SimpleNamespace(sleep=slept.append))
+    return slept
+
+
+@pytest.fixture
+def mock():
+    servers = []
+
+    def start(**options):
+        server, url = serve(**options)
+        servers.append(server)
+        return server, GTTSTransport(endpoint=url, retries=2)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_retry_after_is_honoured(mock, sleeps):
+    server, transport = mock()
+    server.failures.extend([(429, '3'), (503, None)])
+    assert transport.synthesize("hello") == fake_frame("hello")
+    assert server.requests == 3
+    assert transport.counters['retries'] == 2
+    # At least what the server asked for, then plain jittered backoff
+    assert sleeps[0] >= 3
+    assert 0 <= sleeps[1] <= gtts_transport.BACKOFF * 2
+
+
+def test_gives_up_after_retries(mock, sleeps):
+    server, transport = mock()
+    server.failures.extend([(503, None)] * 5)
+    with pytest.raises(GTTSTransportError, match="503"):
+        transport.synthesize("hello")
+    assert server.requests == transport.retries + 1
+    assert len(sleeps) == transport.retries
+
+
+def test_permanent_errors_are_not_retried(mock, sleeps):
+    server, transport = mock()
+    server.failures.append((400, None))
+    with pytest.raises(GTTSTransportError, match="400"):
+        transport.synthesize("hello")
+    assert server.requests == 1
+    assert sleeps == []
+
+
+def test_identical_concurrent_calls_share_one_request(mock):
+    server, transport = mock(latency=0.3)
+    start = threading.Barrier(8)
+    results = []
+
+    def call():
+        start.wait()
+        results.append(transport.synthesize("the same sentence"))
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    assert results == [fake_frame("the same sentence")] * 8
+    assert server.requests == 1
+    assert transport.counters['coalesced'] == 7
+
+
+def test_fragments_come_back_in_order(mock):
+    # Random per-request delays make fragments finish out of order
+    server, transport = mock(jitter=0.2)
+    text = " ".join(f"Sentence number {i} is long enough to need its own request to the API." for i in range(12))
+    fragments = [parse_fragment(request.body)[0] for request in transport._prepare(text, 'en', False)]
+    assert len(fragments) > 4
+    assert transport.synthesize(text) == b''.join(fake_frame(fragment) for fragment in fragments)
+    assert server.requests == len(fragments)
@@ -0,0 +1,150 @@
+"""The Redis-backed stores, run against a throwaway local redis-server."""
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+
+redis = pytest.importorskip('redis')
+
+import state
+from audio_cache import AudioCache
+from auth import Authenticator
+from history_store import RedisHistoryStore
+from jobs import Job, JobBoard
+from user_store import RedisUserStore
+
+SERVER = shutil.which('redis-server')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def server():
+    if SERVER is None:
+        pytest.skip('redis-server is not installed')
+    port = free_port()
+    process = subprocess.Popen([SERVER, '--port', str(port), '--bind', '127.0.0.1', '--save', '', '--appendonly', 'no'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    client = redis.Redis(port=port)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            client.ping()
+            break
+        except redis.ConnectionError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                pytest.skip('redis-server did not start')
+            time.sleep(0.05)
+    yield port
+    process.terminate()
+    process.wait(timeout=10)
+
+
+@pytest.fixture
+def replicas(server, monkeypatch):
+    """Two clients on the same server, standing in for two app replicas."""
+    monkeypatch.setattr(state, 'KEY_PREFIX', 'voicecraft-test:')
+    first, second = redis.Redis(port=server), redis.Redis(port=server)
+    first.flushdb()
+    yield first, second
+    first.close()
+    second.close()
+
+
+def record(name='Alice'):
+    return {'name': name, 'created_at': '2024-01-01T00:00:00', 'total_conversions': 0}
+
+
+def test_a_username_is_created_once_and_logs_in_on_any_replica(replicas):
+    here, there = RedisUserStore(replicas[0]), RedisUserStore(replicas[1])
+    assert Authenticator(here, shared=True).register('alice', 's3cret', record())
+    assert not Authenticator(there, shared=True).register('alice', 'other', record('Mallory'))
+    assert here.get('alice')['name'] == 'Alice'
+
+    # The second replica's index predates the user; shared mode reads through to Redis
+    elsewhere = Authenticator(there, shared=True)
+    assert elsewhere.login('alice', 's3cret')['name'] == 'Alice'
+    assert elsewhere.login('alice', 'wrong') is None
+
+
+def test_usage_batches_from_several_replicas_add_up(replicas):
+    here, there = RedisUserStore(replicas[0]), RedisUserStore(replicas[1])
+    here.create('alice', dict(record(), password='x'))
+    here.record_usage([('alice', 'gtts', 'en', 2, 100, 1.5, 1.0)])
+    there.record_usage([('alice', 'gtts', 'en', 3, 50, 2.0, 0.5), ('alice', 'pyttsx3', 'fr', 1, 10, 0.2, 0.2)])
+
+    usage = {(row['engine'], row['lang']): row for row in here.usage('alice')}
+    assert usage[('gtts', 'en')] == {'engine': 'gtts', 'lang': 'en', 'conversions': 5, 'characters': 150,
+                                     'latency_total': 3.5, 'latency_max': 1.0}
+    assert usage[('pyttsx3', 'fr')]['conversions'] == 1
+    assert there.get('alice')['total_conversions'] == 6
+
+
+def test_history_shares_audio_until_the_last_entry_is_deleted(replicas):
+    here, there = RedisHistoryStore(replicas[0]), RedisHistoryStore(replicas[1])
+    audio = b'RIFF' + b'\0' * 64
+    first = here.add('alice', audio, 'Hello', '2024-01-01 10:00', 'en', 'normal', 'female')
+    second = there.add('bob', audio, 'Hello again', '2024-01-01 10:01', 'en', 'normal', 'female')
+    assert first['digest'] == second['digest']
+    assert replicas[0].get(state.key('history', 'refs', first['digest'])) == b'2'
+
+    assert there.get('bob', first['id']) is None
+    assert not there.delete('bob', first['id'])
+    assert here.delete('alice', first['id'])
+    assert there.load_audio(first['digest']) == audio
+    assert here.usage('alice')['entries'] == 0
+
+    assert there.delete('bob', second['id'])
+    with pytest.raises(FileNotFoundError):
+        here.load_audio(first['digest'])
+    assert not replicas[0].exists(state.key('history', 'refs', first['digest']))
+
+
+def test_history_pages_search_only_the_callers_entries(replicas):
+    history = RedisHistoryStore(replicas[0])
+    for i in range(3):
+        history.add('alice', f'clip {i}'.encode(), f'Chapter {i}', '', 'en', 'normal', 'female',
+                    source=f'Chapter {i} of the lighthouse keeper')
+    history.add('bob', b'bob', 'Lighthouse', '', 'en', 'normal', 'male')
+
+    records, cursor = history.page('alice', limit=2, query='light')
+    assert [r['text'] for r in records] == ['Chapter 2', 'Chapter 1']
+    records, cursor = history.page('alice', cursor=cursor, limit=2, query='light')
+    assert [r['text'] for r in records] == ['Chapter 0'] and cursor is None
+
+
+def test_job_progress_and_cancels_cross_replicas(replicas):
+    here, there = JobBoard(replicas[0]), JobBoard(replicas[1])
+    job = Job('alice', {'kind': 'tts'}, cost=1.0, stream=True)
+    job.status, job.started = 'running', time.monotonic()
+    job.report(1, 3, b'one')
+    job.report(2, 3, b'two')
+    assert not here.publish(job, meta=True)
+
+    remote = there.load(job.id)
+    assert (remote.status, remote.done, remote.total, remote.meta) == ('running', 2, 3, {'kind': 'tts'})
+    assert remote.streamed == 2
+    assert there.load_parts(job.id) == [b'one', b'two']
+
+    there.cancel(job.id)
+    job.report(3, 3, b'three')
+    assert here.publish(job)
+    assert here.cancel_requested(job.id)
+    # Parts go over the wire once, in order
+    assert there.load_parts(job.id) == [b'one', b'two', b'three']
+
+
+def test_cached_audio_is_shared_between_replicas(replicas):
+    here = AudioCache(client=replicas[0])
+    there = AudioCache(client=replicas[1])
+    assert there.get('k') is None
+    here.put('k', b'audio bytes')
+    assert there.get('k') == b'audio bytes'
+    assert there.counters['disk_hits'] == 1
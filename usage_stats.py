@@ -0,0 +1,128 @@
+"""
+In-memory aggregation of conversion statistics, flushed to the user store
+in batches from a background thread.
+
+Recording a conversion only touches a dict under a lock; the database sees
+one transaction per flush instead of one rewrite per click.
+"""
+import atexit
+import os
+import threading
+from collections import defaultdict
+
+from metrics import register_collector
+
+FLUSH_SECONDS = float(os.environ.get('VOICECRAFT_STATS_FLUSH_SECONDS', '5'))
+FLUSH_COUNT = int(os.environ.get('VOICECRAFT_STATS_FLUSH_COUNT', '50'))
+
+
+class UsageStats:
+    def __init__(self, store, flush_seconds=FLUSH_SECONDS, flush_count=FLUSH_COUNT):
+        self.store = store
+        self.flush_seconds = flush_seconds
+        self.flush_count = flush_count
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (username, engine, lang) -> [conversions, characters, latency_total, latency_max]
+        self._pending = defaultdict(lambda: [0, 0, 0.0, 0.0])
+        self._pending_count = 0
+        self._totals = {}
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='usage-stats-flusher', daemon=True)
+        self._thread.start()
+
+    def record(self, username, engine, lang, characters, latency):
+        with self._lock:
+            entry = self._pending[(username, engine, lang or '')]
+            entry[0] += 1
+            entry[1] += characters
+            entry[2] += latency
+            entry[3] = max(entry[3], latency)
+            self._pending_count += 1
+            if username in self._totals:
+                self._totals[username] += 1
+            if self._pending_count >= self.flush_count:
+                self._wake.set()
+
+    def conversions(self, username, baseline=0):
+        """
+        Current conversion count for username without touching disk.
+
+        baseline is the persisted total as last read from the store; it is
+        only used the first time this process is asked about the user.
+        """
+        with self._lock:
+            if username not in self._totals:
+                unflushed = sum(v[0] for k, v in self._pending.items() if k[0] == username)
+                self._totals[username] = baseline + unflushed
+            return self._totals[username]
+
+    def snapshot(self):
+        """Unflushed per-engine and per-language counts, for display."""
+        with self._lock:
+            by_engine = defaultdict(int)
+            by_lang = defaultdict(int)
+            for (_, engine, lang), entry in self._pending.items():
+                by_engine[engine] += entry[0]
+                by_lang[lang] += entry[0]
+            return {'pending': self._pending_count, 'by_engine': dict(by_engine), 'by_lang': dict(by_lang)}
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch = self._pending
+                self._pending = defaultdict(lambda: [0, 0, 0.0, 0.0])
+                self._pending_count = 0
+            rows = [(*key, *entry) for key, entry in batch.items()]
+            try:
+                self.store.record_usage(rows)
+            except Exception:
+                # Put the batch back so the next flush retries it
+                with self._lock:
+                    for key, entry in batch.items():
+                        merged = self._pending[key]
+                        merged[0] += entry[0]
+                        merged[1] += entry[1]
+                        merged[2] += entry[2]
+                        merged[3] = max(merged[3], entry[3])
+                        self._pending_count += entry[0]
+                raise
+            return len(rows)
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        self.flush()
+
+
+_stats = None
+_stats_lock = threading.Lock()
+
+
+def get_usage_stats(store):
+    global _stats
+    with _stats_lock:
+        if _stats is None:
+            _stats = UsageStats(store)
+            atexit.register(_stats.close)
+            register_collector('usage_stats', _collect)
+        return _stats
+
+
+def _collect():
+    snapshot = _stats.snapshot()
+    yield 'voicecraft_usage_pending', {}, snapshot['pending']
+    for engine, count in snapshot['by_engine'].items():
+        yield 'voicecraft_usage_pending_by_engine', {'engine': engine}, count
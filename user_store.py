@@ -0,0 +1,313 @@
+"""
+SQLite-backed user store.
+
+Replaces rewriting the whole users.json on every action with indexed
+lookups by username and atomic in-place updates. The database runs in WAL
+mode so readers in other sessions never block on a writer.
+
+RedisUserStore keeps the same records in Redis for deployments with
+several replicas (see state.py).
+"""
+import json
+import os
+import sqlite3
+import threading
+
+import state
+from metrics import span
+
+USER_DB_FILE = os.environ.get('VOICECRAFT_USER_DB', 'users.db')
+
+USER_FIELDS = ('password', 'name', 'created_at', 'total_conversions')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    name TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    total_conversions INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS usage_stats (
+    username TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    lang TEXT NOT NULL,
+    conversions INTEGER NOT NULL DEFAULT 0,
+    characters INTEGER NOT NULL DEFAULT 0,
+    latency_total REAL NOT NULL DEFAULT 0,
+    latency_max REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, engine, lang)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class UserStore:
+    def __init__(self, path=USER_DB_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads, and Streamlit
+        # runs every session on its own thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, username):
+        with span('user_store_get'):
+            row = self._connect().execute(
+                'SELECT password, name, created_at, total_conversions FROM users WHERE username = ?',
+                (username,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def credentials(self):
+        """(username, password hash) for every user."""
+        return [tuple(row) for row in self._connect().execute('SELECT username, password FROM users')]
+
+    def create(self, username, record):
+        """Insert a new user; returns False if the username is taken."""
+        with span('user_store_create'):
+            cur = self._connect().execute(
+                'INSERT OR IGNORE INTO users (username, password, name, created_at, total_conversions) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (username, record['password'], record['name'], record['created_at'],
+                 record.get('total_conversions', 0))
+            )
+        return cur.rowcount == 1
+
+    def update(self, username, **fields):
+        unknown = set(fields) - set(USER_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown user fields: {sorted(unknown)}")
+        if not fields:
+            return
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._connect().execute(
+            f'UPDATE users SET {assignments} WHERE username = ?',
+            (*fields.values(), username)
+        )
+
+    def increment(self, username, field='total_conversions', amount=1):
+        if field != 'total_conversions':
+            raise ValueError(f"Cannot increment {field}")
+        self._connect().execute(
+            f'UPDATE users SET {field} = {field} + ? WHERE username = ?',
+            (amount, username)
+        )
+
+    def record_usage(self, rows):
+        """
+        Apply a batch of aggregated usage in one transaction.
+
+        rows: iterable of (username, engine, lang, conversions, characters,
+        latency_total, latency_max).
+        """
+        with span('user_store_record_usage'):
+            self._record_usage(rows)
+
+    def _record_usage(self, rows):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for username, engine, lang, conversions, characters, latency_total, latency_max in rows:
+                conn.execute(
+                    'UPDATE users SET total_conversions = total_conversions + ? WHERE username = ?',
+                    (conversions, username)
+                )
+                conn.execute(
+                    'INSERT INTO usage_stats (username, engine, lang, conversions, characters, '
+                    'latency_total, latency_max) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (username, engine, lang) DO UPDATE SET '
+                    'conversions = conversions + excluded.conversions, '
+                    'characters = characters + excluded.characters, '
+                    'latency_total = latency_total + excluded.latency_total, '
+                    'latency_max = MAX(latency_max, excluded.latency_max)',
+                    (username, engine, lang, conversions, characters, latency_total, latency_max)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def usage(self, username):
+        return [dict(row) for row in self._connect().execute(
+            'SELECT engine, lang, conversions, characters, latency_total, latency_max '
+            'FROM usage_stats WHERE username = ?',
+            (username,)
+        )]
+
+    def import_json(self, json_path):
+        """Copy users from a legacy users.json once; later calls are no-ops."""
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'imported_json'").fetchone():
+            return 0
+        imported = 0
+        if os.path.exists(json_path):
+            with open(json_path, 'r') as f:
+                users = json.load(f)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for username, record in users.items():
+                    if self.create(username, record):
+                        imported += 1
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_json', ?)",
+                             (str(imported),))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        else:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_json', '0')")
+        return imported
+
+
+# KEYS: user hash, username set; ARGV: username, then field/value pairs
+CREATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('SADD', KEYS[2], ARGV[1])
+return 1
+"""
+
+# KEYS: user hash, user's usage set, usage row hash
+# ARGV: row member, conversions, characters, latency_total, latency_max
+RECORD_USAGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBY', KEYS[1], 'total_conversions', ARGV[2])
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('HINCRBY', KEYS[3], 'conversions', ARGV[2])
+redis.call('HINCRBY', KEYS[3], 'characters', ARGV[3])
+redis.call('HINCRBYFLOAT', KEYS[3], 'latency_total', ARGV[4])
+if tonumber(ARGV[5]) > tonumber(redis.call('HGET', KEYS[3], 'latency_max') or '0') then
+    redis.call('HSET', KEYS[3], 'latency_max', ARGV[5])
+end
+"""
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class RedisUserStore:
+    """
+    UserStore on Redis: a hash per user, a set of usernames and a hash per
+    (user, engine, language) of usage. Creation and usage batches run as
+    Lua scripts, so they are atomic across replicas like the SQLite
+    transactions they replace.
+    """
+
+    def __init__(self, client=None):
+        self._redis = client if client is not None else state.get_redis()
+        self._create = self._redis.register_script(CREATE_SCRIPT)
+        self._record = self._redis.register_script(RECORD_USAGE_SCRIPT)
+
+    def get(self, username):
+        with span('user_store_get'):
+            raw = self._redis.hgetall(state.key('user', username))
+        if not raw:
+            return None
+        record = {_text(k): _text(v) for k, v in raw.items()}
+        record['total_conversions'] = int(record.get('total_conversions', 0))
+        return record
+
+    def credentials(self):
+        """(username, password hash) for every user."""
+        usernames = [_text(u) for u in self._redis.smembers(state.key('users'))]
+        pipe = self._redis.pipeline(transaction=False)
+        for username in usernames:
+            pipe.hget(state.key('user', username), 'password')
+        return [(u, _text(p)) for u, p in zip(usernames, pipe.execute()) if p is not None]
+
+    def create(self, username, record):
+        """Insert a new user; returns False if the username is taken."""
+        fields = [record['password'], record['name'], record['created_at'], record.get('total_conversions', 0)]
+        args = [username]
+        for name, value in zip(USER_FIELDS, fields):
+            args += [name, value]
+        with span('user_store_create'):
+            return self._create(keys=[state.key('user', username), state.key('users')], args=args) == 1
+
+    def update(self, username, **fields):
+        unknown = set(fields) - set(USER_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown user fields: {sorted(unknown)}")
+        if fields and self._redis.exists(state.key('user', username)):
+            self._redis.hset(state.key('user', username), mapping=fields)
+
+    def increment(self, username, field='total_conversions', amount=1):
+        if field != 'total_conversions':
+            raise ValueError(f"Cannot increment {field}")
+        if self._redis.exists(state.key('user', username)):
+            self._redis.hincrby(state.key('user', username), field, amount)
+
+    def record_usage(self, rows):
+        """Apply a batch of aggregated usage in one MULTI/EXEC; see UserStore."""
+        with span('user_store_record_usage'):
+            pipe = self._redis.pipeline(transaction=True)
+            for username, engine, lang, conversions, characters, latency_total, latency_max in rows:
+                member = json.dumps([engine, lang])
+                self._record(keys=[state.key('user', username), state.key('usage', username),
+                                   state.key('usage', username, member)],
+                             args=[member, conversions, characters, latency_total, latency_max], client=pipe)
+            pipe.execute()
+
+    def usage(self, username):
+        members = [_text(m) for m in self._redis.smembers(state.key('usage', username))]
+        pipe = self._redis.pipeline(transaction=False)
+        for member in members:
+            pipe.hgetall(state.key('usage', username, member))
+        rows = []
+        for member, raw in zip(members, pipe.execute()):
+            engine, lang = json.loads(member)
+            raw = {_text(k): _text(v) for k, v in raw.items()}
+            rows.append({'engine': engine, 'lang': lang,
+                         'conversions': int(raw.get('conversions', 0)),
+                         'characters': int(raw.get('characters', 0)),
+                         'latency_total': float(raw.get('latency_total', 0)),
+                         'latency_max': float(raw.get('latency_max', 0))})
+        return rows
+
+    def import_json(self, json_path):
+        """Copy users from a legacy users.json once, from whichever replica gets there first."""
+        marker = state.key('meta', 'imported_json')
+        if not self._redis.set(marker, 'importing', nx=True):
+            return 0
+        imported = 0
+        try:
+            if os.path.exists(json_path):
+                with open(json_path, 'r') as f:
+                    users = json.load(f)
+                for username, record in users.items():
+                    if self.create(username, record):
+                        imported += 1
+        except Exception:
+            # Let the next start try again; create() skips users already copied
+            self._redis.delete(marker)
+            raise
+        self._redis.set(marker, str(imported))
+        return imported
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_user_store(legacy_json='users.json'):
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RedisUserStore() if state.shared() else UserStore()
+            _store.import_json(legacy_json)
+        return _store